@@ -1,9 +1,18 @@
 
+import asyncio
+import json
+import logging
 import os
-import subprocess
+import time
+import uuid
+from collections import deque
+
 import django
+from asgiref.sync import sync_to_async
 from channels.consumer import AsyncConsumer
 from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.conf import settings
 from django.core.cache import cache
 
 
@@ -12,24 +21,120 @@ django.setup()
 
 
 # All setting are moved bellow the django setup to avoid import error in django setup process.
+from app_websocket import registry
+from app_websocket.pool import ffmpeg_pool, spawn_ffmpeg, stream_group_name
+from core.auth import get_user_by_api_key
 from youtube.models import UserProfile
 from youtube.utils import transition_broadcast
 
 
+# Backpressure policies, see FFMPEG_BACKPRESSURE_POLICY
+POLICY_BLOCK = 'block'
+POLICY_DROP = 'drop'
+POLICY_DISCONNECT = 'disconnect'
+
+# EBML id of a WebM Cluster. MediaRecorder opens a new cluster on every
+# video keyframe, so it is the point FFmpeg can resume from after a drop.
+WEBM_CLUSTER_ID = b'\x1f\x43\xb6\x75'
+
+# Number of FFmpeg stderr lines kept for diagnostics
+STDERR_TAIL_LINES = 20
+
+# Teardown states, reported to the client as "teardown,<state>"
+TEARDOWN_DRAINING = 'draining'
+TEARDOWN_FLUSHING = 'flushing'
+TEARDOWN_TRANSITIONING = 'transitioning'
+TEARDOWN_DONE = 'done'
+
+# Keeps running teardowns referenced after their consumer is gone
+teardown_tasks = set()
+
+logger = logging.getLogger(__name__)
+
+
 @database_sync_to_async
 def get_user(api_key):
-    """Get user based on the API key"""
-    try:
-        return UserProfile.objects.get(api_key=api_key).user
-    except UserProfile.DoesNotExist:
-        return None
+    """Get user based on the API key, through APIKeyAuthentication's cache"""
+    return get_user_by_api_key(api_key)
+
+
+def get_user_broadcast_id(user_id):
+    """Id of the broadcast the user last created, its stream_dict is set by CreateBroadcastView"""
+    stream_dict = cache.get(f"stream_dict{user_id}")
+    return stream_dict.get('new_broadcast_id') if stream_dict else None
+
+
+def forget_user_broadcast(user_id, broadcast_id):
+    """Drop the user's stream_dict, unless it is for a broadcast created since"""
+    if broadcast_id is not None and get_user_broadcast_id(user_id) == broadcast_id:
+        cache.delete(f"stream_dict{user_id}")
+
+
+async def publish_stream_progress(user_id, progress):
+    """Cache a stream's latest FFmpeg progress for StreamProgressView"""
+    await sync_to_async(cache.set)(
+        f"stream_progress{user_id}", progress, 2 * settings.FFMPEG_PROGRESS_PUBLISH_INTERVAL)
+
+
+def parse_ffmpeg_progress(block):
+    """
+    Converts one block of FFmpeg's -progress key=value output into
+    a dictionary of numbers, unknown values ("N/A") become None.
+    """
+    def to_number(value, cast=float, suffix=''):
+        try:
+            return cast(value.strip().removesuffix(suffix))
+        except (AttributeError, ValueError):
+            return None
+
+    return {
+        'frame': to_number(block.get('frame'), int),
+        'fps': to_number(block.get('fps')),
+        'bitrate_kbps': to_number(block.get('bitrate'), suffix='kbits/s'),
+        'speed': to_number(block.get('speed'), suffix='x'),
+        'drop_frames': to_number(block.get('drop_frames'), int),
+        'dup_frames': to_number(block.get('dup_frames'), int),
+        'total_size': to_number(block.get('total_size'), int),
+        'out_time': block.get('out_time'),
+        'status': block.get('progress'),
+    }
 
 
 class VideoConsumer(AsyncConsumer):
     """Socket Consumer that accept websocket connection and live stream"""
 
     def __init__(self):
-        self.process_manager = FFmpegProcessManager(send=self.send)
+        self.process_manager = self.create_process_manager()
+        # Manager of the previous stream while its teardown may still run
+        self.previous_manager = None
+        # Id of the stream this consumer has in the registry
+        self.stream_id = None
+        self.stream_refreshed_at = 0
+
+    def create_process_manager(self):
+        if settings.FFMPEG_INGEST_WORKER:
+            # FFmpeg runs in the ingest workers, see app_websocket.ingest
+            return RemoteFFmpegProcessManager(consumer=self)
+        return FFmpegProcessManager(send=self.send_ack_message, on_progress=self.publish_progress)
+
+    async def prepare_stream(self):
+        """
+        Bind the process manager to the broadcast the new stream goes to. A
+        stream starting while the previous one is torn down gets a new
+        manager, the teardown keeps the old one and its handles.
+        """
+        if self.process_manager.teardown_started:
+            self.previous_manager = self.process_manager
+            self.process_manager = self.create_process_manager()
+        self.process_manager.broadcast_id = await sync_to_async(get_user_broadcast_id)(
+            self.scope['user'].id)
+
+    def get_stream_manager(self, stream_id):
+        """The manager of the stream, the current one or the previous one"""
+        for manager in (self.process_manager, self.previous_manager):
+            if manager is not None and manager.stream_id == stream_id:
+                return manager
+        return None
 
     async def websocket_connect(self, event):
         try:
@@ -41,6 +146,13 @@ class VideoConsumer(AsyncConsumer):
                 if user:
                     self.scope['user'] = user
                     await self.send({"type": "websocket.accept"})
+                    if self.channel_layer is not None:
+                        # Receives stream.prewarm when the user creates a broadcast
+                        await self.channel_layer.group_add(
+                            stream_group_name(user.id), self.channel_name)
+                        # Receives stream.shutdown when the node is drained
+                        await self.channel_layer.group_add(
+                            registry.node_group_name(), self.channel_name)
                 else:
                     await self.send({"type": "websocket.close", "text": "UnAuthorised"})
                     await self.websocket_disconnect(event)
@@ -60,15 +172,86 @@ class VideoConsumer(AsyncConsumer):
 
     async def websocket_disconnect(self, event):
         """Handle when websocket is disconnected"""
-        self.process_manager.cleanup_on_disconnect(self.scope)
+        await self.process_manager.cleanup_on_disconnect(self.scope)
+        await self.unregister_stream()
+        user = self.scope.get('user')
+        if self.channel_layer is not None and getattr(user, 'id', None):
+            await self.channel_layer.group_discard(
+                stream_group_name(user.id), self.channel_name)
+            await self.channel_layer.group_discard(
+                registry.node_group_name(), self.channel_name)
+
+    async def stream_prewarm(self, event):
+        """
+        Channel layer handler, parks FFmpeg processes for a new broadcast so
+        the stream starts on a warm process once its RTMP url arrives.
+        Both audio variants are started, the unused one is killed on start.
+        """
+        if self.process_manager.process or settings.FFMPEG_INGEST_WORKER:
+            return
+
+        rtmp_url = event['rtmp_url']
+        for audio_enabled in (True, False):
+            command = self.process_manager.generate_ffmpeg_command(rtmp_url, audio_enabled)
+            await ffmpeg_pool.warm(command, group=rtmp_url)
+
+    async def ingest_started(self, event):
+        """Channel layer handler, an ingest worker took the stream"""
+        manager = self.get_stream_manager(event['stream_id'])
+        if manager is not None:
+            await manager.handle_started(event)
+
+    async def ingest_credit(self, event):
+        """Channel layer handler, the ingest worker fed frames to FFmpeg"""
+        manager = self.get_stream_manager(event['stream_id'])
+        if manager is not None:
+            await manager.handle_credit(event)
+
+    async def ingest_notify(self, event):
+        """Channel layer handler, relays an ingest worker's message to the client"""
+        if self.get_stream_manager(event['stream_id']) is not None:
+            await self.send_ack_message(event['text'])
+
+    async def ingest_disconnect(self, event):
+        """Channel layer handler, the ingest worker gave up on the stream"""
+        if event['stream_id'] == self.process_manager.stream_id:
+            await self.send({"type": "websocket.close", "code": 1013})
+            await self.websocket_disconnect({"code": 1013})
+
+    async def stream_control(self, event):
+        """
+        Channel layer handler, control messages routed through the stream
+        registry from other connections, nodes or StreamControlView.
+        """
+        if event.get('stream_id') != self.stream_id:
+            return
+
+        if event.get('command') == 'end_broadcast':
+            await self.end_stream()
+
+    async def stream_shutdown(self, event):
+        """
+        Channel layer handler, ends the stream gracefully and closes the
+        websocket with "Service Restart" so the client reconnects elsewhere.
+        """
+        if self.stream_id is not None:
+            await self.send_ack_message("shutdown")
+            await self.end_stream()
+
+        await self.send({"type": "websocket.close", "code": 1012})
+        await self.websocket_disconnect({"code": 1012})
 
     async def process_text_event(self, text_data):
         """Process the text event"""
         if 'browser_sound' in text_data:
-            rtmp_url = self.process_manager.handle_browser_sound(text_data)
+            await self.prepare_stream()
+            rtmp_url = await self.process_manager.handle_browser_sound(text_data)
+            await self.register_stream()
             await self.send_ack_message("RTMP url received: " + rtmp_url)
         elif 'rtmp://a.rtmp.youtube.com' in text_data or 'rtmps://a.rtmps.youtube.com' in text_data:
-            rtmp_url = self.process_manager.handle_rtmp_url(text_data)
+            await self.prepare_stream()
+            rtmp_url = await self.process_manager.handle_rtmp_url(text_data)
+            await self.register_stream()
             await self.send_ack_message("RTMP url received: " + rtmp_url)
         elif 'command' in text_data:
             await self.process_command_event(text_data.split(",", 1)[1])
@@ -76,40 +259,129 @@ class VideoConsumer(AsyncConsumer):
     async def process_command_event(self, command):
         """Process the command event"""
         if command == 'end_broadcast':
-            success = self.process_manager.process_manager_cleanup(self.scope)
-            # success = self.process_manager.end_broadcast(self.scope)
-            await self.send({"type": "websocket.send", "text": "Success" if success else "Failed"})
+            if self.stream_id is not None:
+                # Runs in the background, the client gets "Success" or "Failed" when it is done
+                await self.end_stream()
+            else:
+                # The stream is held by another connection, maybe on another node
+                await self.route_to_user_stream({"type": "stream.control", "command": command})
+
+    async def end_stream(self):
+        """Start the teardown of this consumer's stream and drop it from the registry"""
+        self.process_manager.start_teardown(self.scope)
+        await self.unregister_stream()
+
+    async def register_stream(self):
+        """Record this consumer as the holder of its new stream"""
+        self.stream_id = self.process_manager.stream_id
+        self.stream_refreshed_at = time.monotonic()
+        await sync_to_async(registry.register_stream)(
+            self.scope['user'].id, self.stream_id, self.channel_name, self.process_manager.rtmp_url)
+
+    async def refresh_stream(self):
+        """Keep the registry entries alive while frames arrive"""
+        now = time.monotonic()
+        if self.stream_id is None or now - self.stream_refreshed_at < settings.STREAM_REGISTRY_TTL / 3:
+            return
+
+        self.stream_refreshed_at = now
+        await sync_to_async(registry.refresh_stream)(self.scope['user'].id, self.stream_id)
+
+    async def unregister_stream(self):
+        """Drop this consumer's stream from the registry, once"""
+        stream_id, self.stream_id = self.stream_id, None
+        if stream_id is not None:
+            await sync_to_async(registry.unregister_stream)(self.scope['user'].id, stream_id)
+
+    async def route_to_user_stream(self, message):
+        """Send a message to the consumer holding the user's live stream"""
+        stream = await sync_to_async(registry.get_user_stream)(self.scope['user'].id)
+        if stream is None or self.channel_layer is None:
+            await self.send_ack_message("Failed")
+            return
+
+        await self.channel_layer.send(stream['channel_name'], {
+            **message,
+            "stream_id": stream['stream_id'],
+        })
 
     async def process_bytes_event(self, bytes_data):
         """Process the bytes event"""
-        self.process_manager.handle_bytes_data(bytes_data)
+        accepted = await self.process_manager.handle_bytes_data(bytes_data)
+        await self.refresh_stream()
+        if not accepted:
+            # The stream went over its byte budget under the 'disconnect' policy
+            await self.send({"type": "websocket.close", "code": 1013})
+            await self.websocket_disconnect({"code": 1013})
 
     async def send_ack_message(self, message):
         """Send acknowledgement message to frontend"""
         await self.send({"type": "websocket.send", "text": message})
 
+    async def publish_progress(self, progress):
+        """Publish the stream's FFmpeg progress for StreamProgressView"""
+        user = self.scope.get('user')
+        if user is not None:
+            await publish_stream_progress(user.id, progress)
+
 
 class FFmpegProcessManager:
     """ Manages the FFmpeg process """
 
-    def __init__(self, send=None):
+    def __init__(self, send=None, on_progress=None):
         self.process = None
+        self.stream_id = None
+        # Broadcast the stream goes to, completed by the teardown
+        self.broadcast_id = None
         self.rtmp_url = None
         self.audio_enabled = False
-
-    def handle_browser_sound(self, text_data):
+        self.send = send
+        self.on_progress = on_progress
+
+        # Chunks waiting to be written to FFmpeg's stdin by the writer task
+        self.chunks = deque()
+        self.queued_bytes = 0
+        self.chunk_ready = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.writer_task = None
+        self.high_watermark = settings.FFMPEG_QUEUE_HIGH_WATERMARK
+        self.low_watermark = settings.FFMPEG_QUEUE_LOW_WATERMARK
+        self.byte_budget = settings.FFMPEG_STREAM_BYTE_BUDGET
+        self.policy = settings.FFMPEG_BACKPRESSURE_POLICY
+
+        # Flow control state reported to the client
+        self.paused = False
+        self.header_pending = True
+        self.resyncing = False
+        self.dropped_bytes = 0
+
+        # Tasks reading FFmpeg's stdout (progress) and stderr (log)
+        self.reader_tasks = []
+        self.teardown_task = None
+        self.teardown_state = None
+        self.progress = {}
+        self.progress_published_at = 0
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+
+        # Time to first frame, from the RTMP url arriving to FFmpeg's first frame
+        self.stream_started_at = None
+        self.warm_start = False
+        self.first_frame_ms = None
+
+    async def handle_browser_sound(self, text_data):
         """Handle the browser sound message"""
         self.audio_enabled = True
         self.rtmp_url = self.extract_rtmp_url(text_data)
-        self.start_ffmpeg_process()
+        await self.start_ffmpeg_process()
 
         return self.rtmp_url
 
-    def handle_rtmp_url(self, data):
+    async def handle_rtmp_url(self, data):
         """Handle the rtmp url message"""
         self.audio_enabled = False
         self.rtmp_url = data.strip()
-        self.start_ffmpeg_process()
+        await self.start_ffmpeg_process()
 
         return self.rtmp_url
 
@@ -118,30 +390,237 @@ class FFmpegProcessManager:
         success = self.transition_broadcast(scope=scope)
         return success
 
-    def handle_bytes_data(self, bytes_data):
-        """Handle the bytes data message"""
-        if self.process:
-            self.process.stdin.write(bytes_data)
+    async def handle_bytes_data(self, bytes_data):
+        """
+        Queue the bytes data for the writer task.
+        Returns False when the stream is over its byte budget and the
+        'disconnect' policy applies, True otherwise.
+        """
+        if not self.process or self.writer_task is None or self.writer_task.done():
+            return True
+        if self.teardown_state is not None:
+            return True
+
+        if self.queued_bytes + len(bytes_data) > self.byte_budget:
+            if self.policy == POLICY_DISCONNECT:
+                print(f"Stream over its byte budget, disconnecting: {self.rtmp_url}")
+                return False
+
+            if self.policy == POLICY_DROP:
+                self.drop_oldest_until_keyframe(len(bytes_data))
+            else:
+                # Wait until the writer drains to the low watermark
+                self.writable.clear()
+                await self.writable.wait()
+                if self.writer_task is None or self.writer_task.done():
+                    return True
+
+        if self.resyncing:
+            bytes_data = self.resync_at_keyframe(bytes_data)
+            if not bytes_data:
+                return True
+
+        self.chunks.append(bytes_data)
+        self.queued_bytes += len(bytes_data)
+        self.chunk_ready.set()
+
+        if self.queued_bytes >= self.high_watermark and not self.paused:
+            self.paused = True
+            await self.notify(f"pause,{self.queued_bytes}")
+
+        return True
+
+    def drop_oldest_until_keyframe(self, incoming):
+        """
+        Discard queued media from the front of the queue until there is room
+        for the incoming bytes and the queue starts on a WebM cluster.
+        The first chunk carries the WebM header and is never dropped.
+        """
+        dropped = 0
+        keep = 1 if self.header_pending else 0
+
+        while len(self.chunks) > keep and self.chunks[keep] is not None:
+            chunk = self.chunks[keep]
+            if self.queued_bytes + incoming <= self.byte_budget and dropped:
+                # Enough room, trim up to the next cluster and stop there
+                offset = chunk.find(WEBM_CLUSTER_ID)
+                if offset == 0:
+                    break
+                if offset > 0:
+                    self.chunks[keep] = chunk[offset:]
+                    self.queued_bytes -= offset
+                    dropped += offset
+                    break
+
+            del self.chunks[keep]
+            self.queued_bytes -= len(chunk)
+            dropped += len(chunk)
+        else:
+            # Nothing left to resume from, skip new data up to the next cluster
+            self.resyncing = dropped > 0
+
+        self.dropped_bytes += dropped
+        if dropped:
+            print(f"Dropped {dropped} bytes from stream: {self.rtmp_url}")
+
+    def resync_at_keyframe(self, bytes_data):
+        """Returns the part of the chunk from the next cluster on, if any"""
+        offset = bytes_data.find(WEBM_CLUSTER_ID)
+        if offset < 0:
+            self.dropped_bytes += len(bytes_data)
+            return b''
+
+        self.resyncing = False
+        self.dropped_bytes += offset
+        return bytes_data[offset:]
+
+    async def notify(self, message):
+        """Send a status message to the client, ignoring closed sockets"""
+        if self.send is None:
+            return
+        try:
+            await self.send(message)
+        except Exception as err:
+            print("Unable to notify client: ", err)
+
+    async def write_queued_chunks(self):
+        """Writer task, drains the chunk queue into FFmpeg's stdin"""
+        stdin = self.process.stdin
+        try:
+            while True:
+                if not self.chunks:
+                    self.chunk_ready.clear()
+                    await self.chunk_ready.wait()
+
+                chunk = self.chunks.popleft()
+                if chunk is None:
+                    # End of stream marker queued by process_manager_cleanup
+                    break
+
+                stdin.write(chunk)
+                self.header_pending = False
+                await stdin.drain()
+
+                self.queued_bytes -= len(chunk)
+                if self.queued_bytes <= self.low_watermark:
+                    self.writable.set()
+                    if self.paused:
+                        self.paused = False
+                        await self.notify(f"resume,{self.queued_bytes}")
+
+        except (BrokenPipeError, ConnectionResetError) as err:
+            print("FFmpeg stdin closed unexpectedly: ", err)
+
+        finally:
+            # Release any websocket waiting on the queue and drop what is left
+            self.chunks.clear()
+            self.queued_bytes = 0
+            self.writable.set()
+            if not stdin.is_closing():
+                stdin.close()
+
+    async def read_progress(self):
+        """Reader task, parses the -progress output FFmpeg writes to stdout"""
+        stdout = self.process.stdout
+        block = {}
+        while True:
+            try:
+                line = await stdout.readline()
+            except ValueError:
+                # Line longer than the stream limit, skip it
+                continue
+            if not line:
+                break
+
+            key, _, value = line.decode(errors='replace').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+
+            # "progress" closes a block
+            self.progress = parse_ffmpeg_progress(block)
+            self.progress['queued_bytes'] = self.queued_bytes
+            self.progress['dropped_bytes'] = self.dropped_bytes
+            block = {}
+
+            if self.first_frame_ms is None and (self.progress['frame'] or 0) > 0:
+                self.first_frame_ms = round((time.monotonic() - self.stream_started_at) * 1000)
+                logger.info("First frame after %s ms (%s start): %s", self.first_frame_ms,
+                            "warm" if self.warm_start else "cold", self.rtmp_url)
+                await self.notify(f"ttff,{self.first_frame_ms}")
+            self.progress['time_to_first_frame_ms'] = self.first_frame_ms
+            self.progress['warm_start'] = self.warm_start
+
+            await self.notify("progress," + json.dumps(self.progress))
+            now = time.monotonic()
+            if self.on_progress is not None \
+                    and now - self.progress_published_at >= settings.FFMPEG_PROGRESS_PUBLISH_INTERVAL:
+                self.progress_published_at = now
+                try:
+                    await self.on_progress(self.progress)
+                except Exception as err:
+                    print("Unable to publish stream progress: ", err)
+
+    async def read_stderr(self):
+        """Reader task, keeps FFmpeg's stderr drained so it never blocks"""
+        stderr = self.process.stderr
+        while True:
+            try:
+                line = await stderr.readline()
+            except ValueError:
+                continue
+            if not line:
+                break
 
-    def cleanup_on_disconnect(self, scope):
+            line = line.decode(errors='replace').rstrip()
+            self.stderr_tail.append(line)
+            logger.debug("ffmpeg %s: %s", self.rtmp_url, line)
+
+    async def cleanup_on_disconnect(self, scope):
         """Cleanup when the websocket disconnects"""
         if self.process:
 
-            self.process_manager_cleanup(scope)
+            self.start_teardown(scope)
             # _ = self.transition_broadcast(scope)
             # cache.delete(f"stream_dict{scope.get('user').id}")
 
+    def start_teardown(self, scope):
+        """
+        Starts process_manager_cleanup as a background task, once per stream.
+        The client is sent each state and finally "Success" or "Failed".
+        """
+        if self.teardown_task is None:
+            self.teardown_task = asyncio.create_task(self.run_teardown(scope))
+            teardown_tasks.add(self.teardown_task)
+            self.teardown_task.add_done_callback(teardown_tasks.discard)
+
+        return self.teardown_task
+
+    @property
+    def teardown_started(self):
+        return self.teardown_task is not None
+
+    async def run_teardown(self, scope):
+        """Body of the teardown task"""
+        success = await self.process_manager_cleanup(scope)
+        await self.notify("Success" if success else "Failed")
+        return success
+
+    async def set_teardown_state(self, state):
+        """Move the teardown to the next state and tell the client"""
+        self.teardown_state = state
+        await self.notify(f"teardown,{state}")
+
     def transition_broadcast(self, scope):
-        """Transition the broadcast"""
+        """Transition the stream's broadcast, the user's last one if it wasn't bound"""
         success = False
         if self.process:
             try:
-                stream_dict = cache.get(
-                    f"stream_dict{scope.get('user').id}", None)
-                if stream_dict:
+                broadcast_id = self.broadcast_id or get_user_broadcast_id(scope.get('user').id)
+                if broadcast_id:
                     broadcast_status = 'complete'
                     trans_dict = transition_broadcast(
-                        stream_dict.get('new_broadcast_id'),
+                        broadcast_id,
                         broadcast_status,
                         scope=scope
                     )
@@ -155,44 +634,86 @@ class FFmpegProcessManager:
 
         return success
 
-    def process_manager_cleanup(self, scope):
-        """Cleanup the process manager"""
+    async def process_manager_cleanup(self, scope):
+        """
+        Cleanup the process manager: draining -> flushing -> transitioning -> done.
+        Nothing here blocks the event loop, the YouTube call runs in a worker thread.
+        The manager is not reused once its teardown started (VideoConsumer.prepare_stream),
+        the process, its tasks and the broadcast are this stream's throughout.
+        """
+        process, writer_task, reader_tasks = self.process, self.writer_task, self.reader_tasks
         try:
-            if self.process:
-                if not self.process.stdin.closed:
-                    self.process.stdin.close()
-
-                _, stderr = self.process.communicate(timeout=35)
-
-                if stderr:
-                    print("Error in subprocess stderr:", stderr)
-
-                self.process.wait()
-        except subprocess.TimeoutExpired:
-            self.process.terminate()
+            if process:
+                # Let the writer flush what is queued, then it closes stdin
+                await self.set_teardown_state(TEARDOWN_DRAINING)
+                if writer_task and not writer_task.done():
+                    self.chunks.append(None)
+                    self.chunk_ready.set()
+                    await asyncio.wait_for(writer_task, timeout=35)
+
+                # FFmpeg finishes muxing and sending to YouTube, then exits
+                await self.set_teardown_state(TEARDOWN_FLUSHING)
+                returncode = await asyncio.wait_for(process.wait(), timeout=35)
+                # The readers stop at EOF once the process has exited
+                await asyncio.wait_for(asyncio.gather(*reader_tasks), timeout=5)
+
+                if returncode:
+                    print("Error in subprocess stderr:", "\n".join(self.stderr_tail))
+
+        except asyncio.TimeoutError:
+            if process.returncode is None:
+                process.terminate()
 
         except Exception as e:
             print("Error while closing the subprocess: ", e)
 
         finally:
+            for task in [writer_task, *reader_tasks]:
+                if task and not task.done():
+                    task.cancel()
+            if self.writer_task is writer_task:
+                self.writer_task = None
+                self.reader_tasks = []
+
+        await self.set_teardown_state(TEARDOWN_TRANSITIONING)
+        success = await database_sync_to_async(
+            self.transition_broadcast, thread_sensitive=False)(scope)
+        if self.process is process:
             self.process = None
-            success = self.transition_broadcast(scope)
-            cache.delete(f"stream_dict{scope.get('user').id}")
+        await sync_to_async(forget_user_broadcast)(scope.get('user').id, self.broadcast_id)
 
-            return success
+        await self.set_teardown_state(TEARDOWN_DONE)
+        return success
 
-    def start_ffmpeg_process(self):
+    async def start_ffmpeg_process(self):
         # try:
         command = self.generate_ffmpeg_command()
-        self.process = subprocess.Popen(
-            command, stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        self.stream_id = uuid.uuid4().hex
+        self.teardown_task = None
+        self.teardown_state = None
+        self.stream_started_at = time.monotonic()
+        self.first_frame_ms = None
+
+        # Take a process pre-warmed for this broadcast, or start one
+        self.process = ffmpeg_pool.acquire(command, group=self.rtmp_url)
+        self.warm_start = self.process is not None
+        if self.process is None:
+            self.process = await spawn_ffmpeg(command)
+        self.writer_task = asyncio.create_task(self.write_queued_chunks())
+        self.reader_tasks = [
+            asyncio.create_task(self.read_progress()),
+            asyncio.create_task(self.read_stderr()),
+        ]
         # except Exception as e:
             # print("Error starting FFmpeg process: ", e)
 
-    def generate_ffmpeg_command(self):
+    def generate_ffmpeg_command(self, rtmp_url=None, audio_enabled=None):
+        """Builds the FFmpeg command for this stream, or for the given url and audio setting"""
+        if rtmp_url is None:
+            rtmp_url = self.rtmp_url
+        if audio_enabled is None:
+            audio_enabled = self.audio_enabled
+
         # common_options = [
         #     'ffmpeg',
         #     '-vcodec', 'copy',
@@ -203,15 +724,17 @@ class FFmpegProcessManager:
         # ]
         common_options = [
             'ffmpeg',
+            '-progress', 'pipe:1',  # Machine readable progress on stdout
+            '-nostats',
             '-vcodec', 'copy',
             '-acodec', 'aac',
             '-f', 'flv',
             '-preset', 'ultrafast',
             '-tune', 'zerolatency',  # Enable zerolatency tuning
-            self.rtmp_url,
+            rtmp_url,
         ]
 
-        if not self.audio_enabled:
+        if not audio_enabled:
             return common_options + [
                 '-f', 'lavfi', '-i', 'anullsrc',
                 '-i', '-',
@@ -223,4 +746,227 @@ class FFmpegProcessManager:
     def extract_rtmp_url(self, data):
         """Extract the rtmp url from the data"""
         _, rtmp_url = data.split(",", 1)
-        return rtmp_url.strip()
\ No newline at end of file
+        return rtmp_url.strip()
+
+
+class RemoteFFmpegProcessManager:
+    """
+    Used instead of FFmpegProcessManager when FFMPEG_INGEST_WORKER is on.
+    The stream is handed to an IngestWorkerConsumer over the channel layer
+    and its frames are forwarded to that worker by stream id. The worker's
+    replies reach VideoConsumer's ingest_* handlers.
+
+    At most FFMPEG_STREAM_BYTE_BUDGET bytes are in flight to the worker, it
+    credits them back with ingest.credit as they are fed to FFmpeg. The
+    frames beyond that wait in pending_frames, so a slow stream waits here
+    and not in the worker shared by other streams. Over
+    FFMPEG_INGEST_PENDING_BYTES the backpressure policy applies, see
+    handle_bytes_data.
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.process = None
+        self.stream_id = None
+        self.broadcast_id = None
+        self.rtmp_url = None
+        self.audio_enabled = False
+        self.worker_channel = None
+        self.pending_frames = deque()
+        self.pending_bytes = 0
+        self.in_flight_bytes = 0
+        self.window = settings.FFMPEG_STREAM_BYTE_BUDGET
+        self.pending_budget = settings.FFMPEG_INGEST_PENDING_BYTES
+        self.header_pending = True
+        self.resyncing = False
+        self.stop_requested = False
+
+    async def handle_browser_sound(self, text_data):
+        """Handle the browser sound message"""
+        self.audio_enabled = True
+        self.rtmp_url = text_data.split(",", 1)[1].strip()
+        await self.start_stream()
+
+        return self.rtmp_url
+
+    async def handle_rtmp_url(self, data):
+        """Handle the rtmp url message"""
+        self.audio_enabled = False
+        self.rtmp_url = data.strip()
+        await self.start_stream()
+
+        return self.rtmp_url
+
+    async def start_stream(self):
+        """Ask any ingest worker to start FFmpeg for the stream"""
+        self.stream_id = uuid.uuid4().hex
+        self.process = self.stream_id
+        self.worker_channel = None
+        self.pending_frames = deque()
+        self.pending_bytes = 0
+        self.in_flight_bytes = 0
+        self.header_pending = True
+        self.resyncing = False
+        self.stop_requested = False
+
+        await self.consumer.channel_layer.send(settings.FFMPEG_INGEST_CHANNEL, {
+            "type": "ingest.start",
+            "stream_id": self.stream_id,
+            "reply_channel": self.consumer.channel_name,
+            "user_id": self.consumer.scope['user'].id,
+            "broadcast_id": self.broadcast_id,
+            "rtmp_url": self.rtmp_url,
+            "audio_enabled": self.audio_enabled,
+        })
+
+    async def handle_started(self, event):
+        """The worker owns the stream now, send it what arrived in the meantime"""
+        if event['stream_id'] != self.stream_id:
+            return
+
+        self.worker_channel = event['worker_channel']
+        if self.stop_requested:
+            await self.send_stop()
+        else:
+            await self.send_pending_frames()
+
+    async def handle_credit(self, event):
+        """The worker fed frames to FFmpeg, send the ones waiting for room"""
+        if event['stream_id'] != self.stream_id:
+            return
+
+        self.in_flight_bytes = max(self.in_flight_bytes - event['bytes'], 0)
+        if self.process and not await self.send_pending_frames():
+            await self.consumer.ingest_disconnect({"stream_id": self.stream_id})
+
+    async def handle_bytes_data(self, bytes_data):
+        """
+        Forward the bytes to the stream's worker, or keep them until it has
+        room for them. Over FFMPEG_INGEST_PENDING_BYTES waiting, 'drop'
+        discards the oldest frames and the worker resumes at the next
+        keyframe, 'disconnect' and 'block' close the stream: the credits
+        that would unblock it arrive through this consumer's own dispatch,
+        and the client was sent "pause" by the worker's FFmpeg queue long
+        before.
+        Returns False when the stream has to be closed, True otherwise.
+        """
+        if not self.process:
+            return True
+
+        self.pending_frames.append(bytes_data)
+        self.pending_bytes += len(bytes_data)
+        if self.pending_bytes > self.pending_budget:
+            if settings.FFMPEG_BACKPRESSURE_POLICY != POLICY_DROP:
+                print(f"Ingest worker too far behind, disconnecting: {self.rtmp_url}")
+                return False
+            self.drop_pending_frames()
+
+        if self.worker_channel is None:
+            return True
+        return await self.send_pending_frames()
+
+    def drop_pending_frames(self):
+        """
+        Discard the oldest pending frames until they fit in the budget, the
+        first frame carries the WebM header and is never dropped
+        """
+        keep = 1 if self.header_pending else 0
+        dropped = 0
+        while len(self.pending_frames) > keep + 1 and self.pending_bytes > self.pending_budget:
+            bytes_data = self.pending_frames[keep]
+            del self.pending_frames[keep]
+            self.pending_bytes -= len(bytes_data)
+            dropped += len(bytes_data)
+
+        if dropped:
+            self.resyncing = True
+            print(f"Ingest worker too far behind, dropped {dropped} bytes: {self.rtmp_url}")
+
+    async def send_pending_frames(self):
+        """
+        Send the pending frames that fit in the window, in order.
+        Returns False when the worker can't keep up and the 'disconnect'
+        policy applies, True otherwise.
+        """
+        while self.pending_frames:
+            bytes_data = self.pending_frames[0]
+            # A frame larger than the window is sent once nothing is in flight
+            if self.in_flight_bytes and self.in_flight_bytes + len(bytes_data) > self.window:
+                return True
+
+            self.pending_frames.popleft()
+            self.pending_bytes -= len(bytes_data)
+            if not await self.send_frame(bytes_data):
+                return False
+        return True
+
+    async def send_frame(self, bytes_data):
+        """Send one frame to the worker, applying the policy while its channel is full"""
+        while True:
+            try:
+                # The worker resumes at the next keyframe after dropped
+                # frames, the header kept in front of them goes through as is
+                resync = self.resyncing and not self.header_pending
+                await self.send_to_worker("ingest.frame", bytes=bytes_data, resync=resync)
+                self.in_flight_bytes += len(bytes_data)
+                self.header_pending = False
+                if resync:
+                    self.resyncing = False
+                return True
+            except ChannelFull:
+                policy = settings.FFMPEG_BACKPRESSURE_POLICY
+                if policy == POLICY_DISCONNECT:
+                    return False
+                if policy == POLICY_DROP:
+                    print(f"Ingest worker full, dropped {len(bytes_data)} bytes: {self.rtmp_url}")
+                    self.resyncing = True
+                    return True
+                await asyncio.sleep(0.1)
+
+    async def send_stop(self):
+        """
+        End the stream on the worker after the frames still pending, the
+        stream is ending so they are sent without waiting for credits
+        """
+        while self.pending_frames:
+            bytes_data = self.pending_frames.popleft()
+            self.pending_bytes -= len(bytes_data)
+            if not await self.send_frame(bytes_data):
+                break
+        await self.send_to_worker("ingest.stop")
+
+    async def send_to_worker(self, message_type, **fields):
+        """Send a message for this stream to its worker"""
+        await self.consumer.channel_layer.send(self.worker_channel, {
+            "type": message_type,
+            "stream_id": self.stream_id,
+            **fields,
+        })
+
+    async def cleanup_on_disconnect(self, scope):
+        """Cleanup when the websocket disconnects"""
+        if self.process:
+            self.start_teardown(scope)
+
+    @property
+    def teardown_started(self):
+        return self.stop_requested
+
+    def start_teardown(self, scope):
+        """
+        Ask the worker to tear the stream down, it reports the states and
+        the final "Success" or "Failed" through ingest.notify.
+        """
+        self.process = None
+        if self.stop_requested or self.stream_id is None:
+            return None
+
+        self.stop_requested = True
+        if self.worker_channel is None:
+            # Sent by handle_started once the worker answers
+            return None
+
+        task = asyncio.create_task(self.send_stop())
+        teardown_tasks.add(task)
+        task.add_done_callback(teardown_tasks.discard)
+        return task
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.consumer import AsyncConsumer
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from app_websocket.consumers import (
+    POLICY_BLOCK, POLICY_DISCONNECT, POLICY_DROP, FFmpegProcessManager, publish_stream_progress,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Inbox marker of dropped frames
+RESYNC = object()
+
+# Fed bytes credited back to the websocket side in one ingest.credit message
+CREDIT_BATCH_BYTES = 1024 * 1024
+
+
+class IngestStream:
+    """One stream owned by an ingest worker"""
+
+    def __init__(self, stream_id, reply_channel, user_id):
+        self.stream_id = stream_id
+        self.reply_channel = reply_channel
+        self.user_id = user_id
+        self.manager = None
+        # Frames from the websocket process, fed to the manager by feeder_task
+        self.inbox = asyncio.Queue()
+        self.inbox_bytes = 0
+        # Bytes fed to the manager and not credited back to the websocket side yet
+        self.uncredited_bytes = 0
+        self.feeder_task = None
+
+    @property
+    def queued_bytes(self):
+        """Bytes waiting in the inbox and in the manager's queue, one budget covers both"""
+        return self.inbox_bytes + self.manager.queued_bytes
+
+
+class IngestWorkerConsumer(AsyncConsumer):
+    """
+    Runs the FFmpeg processes of streams whose websocket lives in another
+    process, started with `python manage.py runworker ffmpeg-ingest`.
+    VideoConsumer sends ingest.start, ingest.frame and ingest.stop through
+    the channel layer when FFMPEG_INGEST_WORKER is on.
+    """
+
+    def __init__(self):
+        self.streams = {}
+
+    async def ingest_start(self, event):
+        """Start FFmpeg for a new stream and tell the websocket which worker has it"""
+        stream = IngestStream(event['stream_id'], event['reply_channel'], event['user_id'])
+        stream.manager = FFmpegProcessManager(
+            send=lambda text: self.notify(stream, text),
+            on_progress=lambda progress: publish_stream_progress(stream.user_id, progress))
+        stream.manager.broadcast_id = event.get('broadcast_id')
+        stream.manager.rtmp_url = event['rtmp_url']
+        stream.manager.audio_enabled = event['audio_enabled']
+
+        await stream.manager.start_ffmpeg_process()
+        self.streams[stream.stream_id] = stream
+        stream.feeder_task = asyncio.create_task(self.feed_stream(stream))
+
+        await self.channel_layer.send(stream.reply_channel, {
+            "type": "ingest.started",
+            "stream_id": stream.stream_id,
+            "worker_channel": self.channel_name,
+        })
+
+    async def ingest_frame(self, event):
+        """
+        Queue a frame for the stream. The websocket side keeps at most
+        FFMPEG_STREAM_BYTE_BUDGET bytes in flight and sends more as the
+        feeder credits them back, so a slow stream waits there and never
+        holds up the worker's other streams. Over the budget the 'disconnect'
+        and 'drop' policies apply here as in the manager: 'disconnect' closes
+        the stream, 'drop' discards the frame and the stream resumes at the
+        next keyframe. Under 'block' the frame is queued, the window bounds
+        the inbox.
+        """
+        stream = self.streams.get(event['stream_id'])
+        if stream is None:
+            return
+
+        bytes_data = event['bytes']
+        if event.get('resync'):
+            # The websocket side dropped frames before this one
+            stream.inbox.put_nowait(RESYNC)
+
+        policy = settings.FFMPEG_BACKPRESSURE_POLICY
+        if policy != POLICY_BLOCK and \
+                stream.queued_bytes + len(bytes_data) > settings.FFMPEG_STREAM_BYTE_BUDGET:
+            if policy == POLICY_DISCONNECT:
+                # FFmpeg is too far behind, the websocket side closes the stream
+                await self.channel_layer.send(stream.reply_channel, {
+                    "type": "ingest.disconnect",
+                    "stream_id": stream.stream_id,
+                })
+                await self.stop_stream(stream)
+                return
+
+            if policy == POLICY_DROP:
+                stream.manager.dropped_bytes += len(bytes_data)
+                # The next frames don't follow the queued ones, FFmpeg
+                # resumes at a cluster
+                stream.inbox.put_nowait(RESYNC)
+                await self.credit(stream, len(bytes_data))
+                return
+
+        stream.inbox_bytes += len(bytes_data)
+        stream.inbox.put_nowait(bytes_data)
+
+    async def ingest_stop(self, event):
+        """End of the stream, the feeder tears it down after the queued frames"""
+        stream = self.streams.get(event['stream_id'])
+        if stream is not None:
+            await self.stop_stream(stream)
+
+    async def stop_stream(self, stream):
+        """Queue the end of stream marker, once"""
+        if self.streams.pop(stream.stream_id, None) is not None:
+            stream.inbox.put_nowait(None)
+
+    async def feed_stream(self, stream):
+        """
+        Feeder task, passes the stream's frames to its manager, credits them
+        back to the websocket side and then runs the teardown. The manager
+        applies the backpressure policy to its own queue, under 'block' only
+        this stream's feeder waits. A stream that stops sending frames for
+        FFMPEG_INGEST_IDLE_TIMEOUT seconds is torn down as well.
+        """
+        try:
+            while True:
+                try:
+                    bytes_data = await asyncio.wait_for(
+                        stream.inbox.get(), timeout=settings.FFMPEG_INGEST_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("Ingest stream idle, ending it: %s", stream.manager.rtmp_url)
+                    break
+                if bytes_data is None:
+                    break
+                if bytes_data is RESYNC:
+                    stream.manager.resyncing = True
+                    continue
+
+                stream.inbox_bytes -= len(bytes_data)
+                accepted = await stream.manager.handle_bytes_data(bytes_data)
+                if not accepted:
+                    await self.channel_layer.send(stream.reply_channel, {
+                        "type": "ingest.disconnect",
+                        "stream_id": stream.stream_id,
+                    })
+                    break
+                await self.credit(stream, len(bytes_data))
+        finally:
+            self.streams.pop(stream.stream_id, None)
+
+        user = await sync_to_async(User.objects.filter(id=stream.user_id).first)()
+        await stream.manager.run_teardown({'user': user})
+
+    async def credit(self, stream, size):
+        """
+        Give size bytes of the stream's window back to the websocket side,
+        batched unless the inbox ran empty
+        """
+        stream.uncredited_bytes += size
+        if stream.uncredited_bytes < CREDIT_BATCH_BYTES and not stream.inbox.empty():
+            return
+
+        size, stream.uncredited_bytes = stream.uncredited_bytes, 0
+        await self.channel_layer.send(stream.reply_channel, {
+            "type": "ingest.credit",
+            "stream_id": stream.stream_id,
+            "bytes": size,
+        })
+
+    async def notify(self, stream, text):
+        """Relay a manager message to the websocket consumer of the stream"""
+        await self.channel_layer.send(stream.reply_channel, {
+            "type": "ingest.notify",
+            "stream_id": stream.stream_id,
+            "text": text,
+        })
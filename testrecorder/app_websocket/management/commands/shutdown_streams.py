@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app_websocket.registry import shutdown_node_streams
+
+
+class Command(BaseCommand):
+    help = "Gracefully end the live streams held by a node, e.g. before restarting it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--node', default=settings.NODE_NAME,
+            help="NODE_NAME of the node to drain, this node by default")
+
+    def handle(self, *args, **options):
+        if not shutdown_node_streams(options['node']):
+            raise CommandError("No channel layer configured")
+
+        self.stdout.write(f"Shutdown sent to the streams of {options['node']}")
@@ -0,0 +1,110 @@
+"""
+Pool of pre-warmed FFmpeg processes for the websocket video path.
+
+FFmpeg only opens its RTMP output once it has probed the input on stdin, so
+a process started for a broadcast's RTMP url can be parked before the
+browser starts sending: process start and codec initialisation are then
+already paid for when the stream arrives. StartBroadcastView asks for the
+warm-up through the user's channel layer group, see prewarm_stream.
+"""
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+
+def stream_group_name(user_id):
+    """Channel layer group joined by the user's VideoConsumers"""
+    return f"user_{user_id}_streams"
+
+
+def prewarm_stream(user_id, rtmp_url):
+    """Ask the user's VideoConsumer to pre-warm FFmpeg for a new broadcast"""
+    channel_layer = get_channel_layer()
+    if not settings.FFMPEG_POOL_ENABLED or channel_layer is None:
+        return
+
+    try:
+        async_to_sync(channel_layer.group_send)(
+            stream_group_name(user_id),
+            {"type": "stream.prewarm", "rtmp_url": rtmp_url}
+        )
+    except Exception as err:
+        print("Unable to pre-warm FFmpeg: ", err)
+
+
+async def spawn_ffmpeg(command):
+    """Start an FFmpeg process with all three pipes attached"""
+    return await asyncio.create_subprocess_exec(
+        *command, stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+async def kill_process(process):
+    """Kill a parked process and reap it"""
+    if process.returncode is None:
+        process.kill()
+    await process.wait()
+
+
+class FFmpegProcessPool:
+    """
+    Parks FFmpeg processes by command line until a stream claims them.
+    Processes sharing a group (the RTMP url) are alternatives: claiming one
+    kills the others. Unclaimed processes are killed after FFMPEG_POOL_WARM_TTL.
+    """
+
+    def __init__(self):
+        # command tuple -> (process, group, parked at)
+        self.parked = {}
+        # Keeps the kill tasks referenced until the processes are reaped
+        self.kill_tasks = set()
+
+    async def warm(self, command, group=None):
+        """Start and park a process for the command unless one is parked already"""
+        key = tuple(command)
+        if key in self.parked or len(self.parked) >= settings.FFMPEG_POOL_MAX_WARM:
+            return
+
+        process = await spawn_ffmpeg(command)
+        self.parked[key] = (process, group, time.monotonic())
+        asyncio.get_running_loop().call_later(
+            settings.FFMPEG_POOL_WARM_TTL, self.expire, key, process)
+
+    def acquire(self, command, group=None):
+        """Returns the parked process for the command, or None"""
+        entry = self.parked.pop(tuple(command), None)
+        if group is not None:
+            self.discard(group)
+
+        if entry is None or entry[0].returncode is not None:
+            return None
+
+        return entry[0]
+
+    def discard(self, group):
+        """Kill every parked process of the group"""
+        for key, (process, process_group, _) in list(self.parked.items()):
+            if process_group == group:
+                del self.parked[key]
+                self.kill(process)
+
+    def expire(self, key, process):
+        """Kill the process if it is still parked"""
+        entry = self.parked.get(key)
+        if entry is not None and entry[0] is process:
+            del self.parked[key]
+            self.kill(process)
+
+    def kill(self, process):
+        """Kill and reap a process in the background"""
+        task = asyncio.create_task(kill_process(process))
+        self.kill_tasks.add(task)
+        task.add_done_callback(self.kill_tasks.discard)
+
+
+ffmpeg_pool = FFmpegProcessPool()
@@ -0,0 +1,91 @@
+"""
+Registry of live streams, shared by every node through the cache.
+
+Each stream is recorded under its id with the channel name of the
+VideoConsumer holding its websocket, so control messages, status queries
+and shutdowns reach that consumer whichever node or process they start
+from. The channel layer has to be shared as well, see CHANNEL_LAYERS.
+"""
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+
+def node_group_name(node_name=None):
+    """Channel layer group joined by every VideoConsumer of a node"""
+    return f"node_{node_name or settings.NODE_NAME}_streams"
+
+
+def register_stream(user_id, stream_id, channel_name, rtmp_url=None):
+    """Record that the consumer on channel_name holds the user's stream"""
+    stream = {
+        'stream_id': stream_id,
+        'user_id': user_id,
+        'channel_name': channel_name,
+        'node': settings.NODE_NAME,
+        'rtmp_url': rtmp_url,
+        'started_at': time.time(),
+    }
+    cache.set_many({
+        f"stream_owner{stream_id}": stream,
+        f"user_stream{user_id}": stream_id,
+    }, settings.STREAM_REGISTRY_TTL)
+
+    return stream
+
+
+def refresh_stream(user_id, stream_id):
+    """Keep a stream's entries alive, they expire if the node goes away"""
+    cache.touch(f"stream_owner{stream_id}", settings.STREAM_REGISTRY_TTL)
+    cache.touch(f"user_stream{user_id}", settings.STREAM_REGISTRY_TTL)
+
+
+def unregister_stream(user_id, stream_id):
+    """Forget a stream, the user's entry only if it still points to it"""
+    cache.delete(f"stream_owner{stream_id}")
+    if cache.get(f"user_stream{user_id}") == stream_id:
+        cache.delete(f"user_stream{user_id}")
+
+
+def get_stream(stream_id):
+    """Returns the registry entry of a stream, None if it is not live"""
+    return cache.get(f"stream_owner{stream_id}")
+
+
+def get_user_stream(user_id):
+    """Returns the registry entry of the user's live stream, if any"""
+    stream_id = cache.get(f"user_stream{user_id}")
+    if stream_id is None:
+        return None
+
+    return get_stream(stream_id)
+
+
+def send_to_stream(stream, message):
+    """
+    Send a channel layer message to the consumer holding the stream.
+    Returns False when there is no stream or no channel layer.
+    """
+    channel_layer = get_channel_layer()
+    if stream is None or channel_layer is None:
+        return False
+
+    async_to_sync(channel_layer.send)(stream['channel_name'], {
+        **message,
+        "stream_id": stream['stream_id'],
+    })
+    return True
+
+
+def shutdown_node_streams(node_name=None):
+    """Ask every stream of a node to end gracefully, e.g. before a deploy"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return False
+
+    async_to_sync(channel_layer.group_send)(
+        node_group_name(node_name), {"type": "stream.shutdown"})
+    return True
@@ -1,5 +1,9 @@
 from django.urls import path
 
+from .views import StreamControlView, StreamProgressView
+
 
 urlpatterns = [
-]
\ No newline at end of file
+    path('progress/api/', StreamProgressView.as_view(), name='stream-progress'),
+    path('control/api/', StreamControlView.as_view(), name='stream-control'),
+]
@@ -1 +1,57 @@
-from django.shortcuts import render
\ No newline at end of file
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.decorators import authentication_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from app_websocket import registry
+from core.auth import APIKeyAuthentication
+
+
+@authentication_classes([APIKeyAuthentication])
+class StreamProgressView(APIView):
+    """ DRF API that returns the FFmpeg progress of the user's live stream """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the latest fps, bitrate, speed, dropped frames and out_time
+        reported by the FFmpeg process of the user's stream.
+        """
+        progress = cache.get(f'stream_progress{request.user.id}', None)
+        if progress is None:
+            return Response({'Error': 'No live stream in progress'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(progress, status=status.HTTP_200_OK)
+
+
+@authentication_classes([APIKeyAuthentication])
+class StreamControlView(APIView):
+    """ DRF API that reaches the user's live stream on whichever node holds it """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """Returns the registry entry of the user's stream and its latest progress"""
+        stream = registry.get_user_stream(request.user.id)
+        if stream is None:
+            return Response({'Error': 'No live stream in progress'}, status=status.HTTP_404_NOT_FOUND)
+
+        stream['progress'] = cache.get(f'stream_progress{request.user.id}', None)
+        return Response(stream, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Sends a command to the user's stream, the only command is
+        'end_broadcast'. The client holding the stream is told the outcome.
+        """
+        command = request.data.get('command')
+        if command != 'end_broadcast':
+            return Response({'Error': 'Unknown command'}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream = registry.get_user_stream(request.user.id)
+        if not registry.send_to_stream(stream, {"type": "stream.control", "command": command}):
+            return Response({'Error': 'No live stream in progress'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({'stream_id': stream['stream_id'], 'node': stream['node']},
+                        status=status.HTTP_202_ACCEPTED)
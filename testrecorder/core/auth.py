@@ -1,9 +1,61 @@
+import pickle
+import threading
 
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from youtube.models import UserProfile
 
 
+# Local tier of the API key cache: API key -> pickled user, per process.
+# Each request unpickles a user of its own, so one request's changes to the
+# object never reach another. Other processes' invalidations reach it after
+# API_KEY_CACHE_LOCAL_TTL.
+api_key_users = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_LOCAL_TTL)
+api_key_users_lock = threading.Lock()
+
+
+def get_api_key_cache_key(api_key):
+    return f'api_key_user{api_key}'
+
+
+def get_user_by_api_key(api_key):
+    """
+    Returns the user owning the API key, None if there is none.
+    Looks in the process' cache, then the shared cache (API key -> pickled
+    user), then the database. Only a miss of both tiers queries it.
+    """
+    with api_key_users_lock:
+        pickled_user = api_key_users.get(api_key)
+
+    if pickled_user is None:
+        pickled_user = cache.get(get_api_key_cache_key(api_key))
+
+    if pickled_user is None:
+        try:
+            user = UserProfile.objects.select_related('user').get(api_key=api_key).user
+        except UserProfile.DoesNotExist:
+            return None
+        pickled_user = pickle.dumps(user)
+        cache.set(get_api_key_cache_key(api_key), pickled_user, settings.API_KEY_CACHE_TTL)
+
+    with api_key_users_lock:
+        api_key_users[api_key] = pickled_user
+    return pickle.loads(pickled_user)
+
+
+def invalidate_api_key(api_key):
+    """Forget the API key in both tiers, called when it is regenerated or deleted"""
+    if not api_key:
+        return
+
+    cache.delete(get_api_key_cache_key(api_key))
+    with api_key_users_lock:
+        api_key_users.pop(api_key, None)
+
+
 class APIKeyAuthentication(BaseAuthentication):
     """ Custom API Key bases autehnticaation class """
     def authenticate(self, request):
@@ -13,9 +65,8 @@ class APIKeyAuthentication(BaseAuthentication):
             return None
 
         api_key = api_key.split(' ')[1]
-        try:
-            user_profile = UserProfile.objects.get(api_key=api_key)
-        except UserProfile.DoesNotExist:
+        user = get_user_by_api_key(api_key)
+        if user is None:
             raise AuthenticationFailed('Invalid API key')
 
-        return (user_profile.user, None)
+        return (user, None)
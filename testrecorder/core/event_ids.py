@@ -0,0 +1,121 @@
+"""
+Local, time-ordered event ids.
+
+An id is a 63-bit integer: milliseconds since EVENT_ID_EPOCH_MS (41 bits),
+the generator's node number (10 bits) and a per-millisecond sequence
+(12 bits), so ids sort by creation time and two generators with different
+node numbers never produce the same id. Set EVENT_ID_NODE to a number
+unique to each process (0-1023), otherwise each process leases a free node
+number in the shared cache for EVENT_ID_NODE_LEASE_TTL seconds and renews
+it while it makes ids.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def get_lease_key(node):
+    return f"event-id-node:{node}"
+
+
+def get_lease_owner():
+    return f"{settings.NODE_NAME}:{os.getpid()}"
+
+
+def lease_node_number():
+    """Leases the first free node number in the cache, raises if there is none"""
+    for node in range(MAX_NODE + 1):
+        if cache.add(get_lease_key(node), get_lease_owner(), settings.EVENT_ID_NODE_LEASE_TTL):
+            return node
+    raise ImproperlyConfigured(
+        f"No free event id node number, {MAX_NODE + 1} processes hold one. Set EVENT_ID_NODE.")
+
+
+def renew_node_lease(node):
+    """Extends the lease of node, returns the node number to use from now on"""
+    if cache.get(get_lease_key(node)) != get_lease_owner():
+        # Expired while the process wasn't making ids, another process may
+        # use the number now
+        return lease_node_number()
+    cache.touch(get_lease_key(node), settings.EVENT_ID_NODE_LEASE_TTL)
+    return node
+
+
+def get_node_number():
+    """The generator's node number, EVENT_ID_NODE or a leased one"""
+    if settings.EVENT_ID_NODE is not None:
+        node = int(settings.EVENT_ID_NODE)
+        if not 0 <= node <= MAX_NODE:
+            raise ImproperlyConfigured(f"EVENT_ID_NODE must be between 0 and {MAX_NODE}")
+        return node
+
+    return lease_node_number()
+
+
+class EventIdGenerator:
+    """Thread safe generator of one node"""
+
+    def __init__(self, node=None):
+        # Only a leased node number has to be renewed
+        self.leased = node is None and settings.EVENT_ID_NODE is None
+        self.node = get_node_number() if node is None else node
+        self.renewed_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.sequence = 0
+
+    def next_id(self):
+        with self.lock:
+            if self.leased and time.monotonic() - self.renewed_at > settings.EVENT_ID_NODE_LEASE_TTL / 3:
+                self.node = renew_node_lease(self.node)
+                self.renewed_at = time.monotonic()
+
+            now_ms = self.current_ms()
+            if now_ms < self.last_ms:
+                # The clock went back, wait for it rather than reuse ids
+                time.sleep((self.last_ms - now_ms) / 1000)
+                now_ms = self.current_ms()
+
+            if now_ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # Sequence exhausted for this millisecond
+                    while now_ms <= self.last_ms:
+                        now_ms = self.current_ms()
+            else:
+                self.sequence = 0
+
+            self.last_ms = now_ms
+            return ((now_ms - settings.EVENT_ID_EPOCH_MS) << (NODE_BITS + SEQUENCE_BITS)) \
+                | (self.node << SEQUENCE_BITS) | self.sequence
+
+    @staticmethod
+    def current_ms():
+        return time.time_ns() // 1_000_000
+
+
+generator = None
+generator_pid = None
+generator_lock = threading.Lock()
+
+
+def new_event_id() -> str:
+    """Returns a new event id, as the string the Dowell documents store"""
+    global generator, generator_pid
+    with generator_lock:
+        # Forked workers get a generator, and a node number, of their own
+        if generator is None or generator_pid != os.getpid():
+            generator = EventIdGenerator()
+            generator_pid = os.getpid()
+
+    return str(generator.next_id())
@@ -0,0 +1,158 @@
+"""
+Client for the external services listed in settings.EXTERNAL_SERVICES.
+
+Every call goes through one keep-alive requests.Session per process, so
+connections to a service are reused instead of opened per call. Each
+service has its own timeout and circuit breaker: after
+CIRCUIT_BREAKER_FAILURES consecutive failures calls fail fast with
+ServiceUnavailable for CIRCUIT_BREAKER_RESET_SECONDS, then one trial
+call decides if the circuit closes again. Call latencies are kept in
+per-service histograms, see HTTPMetricsView.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+# Upper bounds in ms of the latency histogram buckets, the last one is unbounded
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+
+class ServiceUnavailable(Exception):
+    """
+    The service's circuit is open, the call was not made. retry_after is
+    the number of seconds until the circuit lets a trial call through.
+    """
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive failure counter of one service"""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        """Checks if a call may go out, lets one trial call through once the reset time passed"""
+        if self.opened_at is None:
+            return True
+        if self.trial_running or time.monotonic() - self.opened_at < settings.CIRCUIT_BREAKER_RESET_SECONDS:
+            return False
+
+        self.trial_running = True
+        return True
+
+    def retry_after(self):
+        """Seconds until allow lets a call through again, at least until a running trial ends"""
+        if self.opened_at is None:
+            return 0
+        remaining = settings.CIRCUIT_BREAKER_RESET_SECONDS - (time.monotonic() - self.opened_at)
+        return max(remaining, 1 if self.trial_running else 0)
+
+    def record(self, success):
+        self.trial_running = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= settings.CIRCUIT_BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    """Call counts per latency bucket of one service"""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+
+    def observe(self, elapsed_ms, success):
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if not success:
+            self.errors += 1
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+            'buckets_ms': {
+                str(bound if bound != float('inf') else '+Inf'): calls
+                for bound, calls in zip(LATENCY_BUCKETS_MS, self.buckets)
+            },
+        }
+
+
+class ExternalServiceClient:
+    """Pooled session plus the breakers and histograms of every service"""
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.EXTERNAL_SERVICES_POOL_CONNECTIONS,
+            pool_maxsize=settings.EXTERNAL_SERVICES_POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.histograms = {}
+
+    def request(self, service, method='POST', **kwargs):
+        """
+        Calls a service of settings.EXTERNAL_SERVICES at its url with its timeout.
+        Raises ServiceUnavailable while its circuit is open, HTTP error
+        statuses raise requests.HTTPError and count as failures.
+        """
+        config = settings.EXTERNAL_SERVICES[service]
+        with self.lock:
+            breaker = self.breakers.setdefault(service, CircuitBreaker())
+            histogram = self.histograms.setdefault(service, LatencyHistogram())
+            if not breaker.allow():
+                histogram.rejected += 1
+                raise ServiceUnavailable(f"{service} is unavailable, retry later", breaker.retry_after())
+
+        kwargs.setdefault('timeout', config['timeout'])
+        started = time.perf_counter()
+        success = False
+        try:
+            response = self.session.request(method, config['url'], **kwargs)
+            response.raise_for_status()
+            success = True
+            return response
+        finally:
+            with self.lock:
+                breaker.record(success)
+                histogram.observe((time.perf_counter() - started) * 1000, success)
+
+    def metrics(self):
+        """Latency histograms and circuit states of the services called by this process"""
+        with self.lock:
+            return {
+                service: {
+                    **histogram.snapshot(),
+                    'circuit_open': self.breakers[service].opened_at is not None,
+                }
+                for service, histogram in self.histograms.items()
+            }
+
+
+external_services = ExternalServiceClient()
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import HTTPMetricsView
+
+
+urlpatterns = [
+    path('http-metrics/api/', HTTPMetricsView.as_view(), name='http-metrics'),
+]
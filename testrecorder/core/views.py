@@ -1,3 +1,14 @@
-from django.shortcuts import render
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from core.http_client import external_services
+
+
+class HTTPMetricsView(APIView):
+    """ DRF API that returns this process' external service latencies and circuit states """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(external_services.metrics(), status=status.HTTP_200_OK)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from file_app.models import TestRecords, MegaTestRecord, VpsTestRecord
+from file_app.models import TestRecords, MegaTestRecord, VpsTestRecord, DowellOutbox, MergeJob
 
 """
 admin.site.register(TestRecords)
@@ -25,3 +25,15 @@ class MegaTestRecordAdmin(admin.ModelAdmin):
 class VpsTestRecordAdmin(admin.ModelAdmin):
     list_display = ('user_name', 'test_description',
                     'test_name', 'user_files_timestamp','webcam_file', 'merged_webcam_screen_file','beanote_file','timestamp')
+
+
+@admin.register(DowellOutbox)
+class DowellOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at', 'event_registered')
+    list_filter = ('status', 'event_registered')
+
+
+@admin.register(MergeJob)
+class MergeJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'output_name', 'status', 'attempts', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status',)
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class FileAppConfig(AppConfig):
     name = 'file_app'
+
+    def ready(self) -> None:
+        from django.core import checks
+        from file_app.storage import check_storage_layout, log_storage_layout
+
+        checks.register(check_storage_layout)
+        log_storage_layout()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from file_app.uploads import copy_file_descriptor, write_request_body
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the multipart BytesView upload path with the raw body "
+        "RawBytesView path, and with the sendfile copy of a spooled body, "
+        "in MB/s and CPU seconds per GB"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64)
+        parser.add_argument('--iterations', type=int, default=3)
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        payload = os.urandom(size)
+        factory = RequestFactory()
+
+        with tempfile.TemporaryDirectory() as directory:
+            destination = os.path.join(directory, 'destination')
+            spooled_body = os.path.join(directory, 'body')
+            with open(spooled_body, 'wb') as body_file:
+                body_file.write(payload)
+
+            # Requests are built outside the timings, only the server side is measured
+            def multipart_request():
+                return factory.post('/file/upload/bytes/', {
+                    'fileName': 'destination',
+                    'video_bytes': SimpleUploadedFile('destination', payload),
+                })
+
+            def multipart_path(request):
+                # What BytesView does, parsing included
+                with open(destination, 'ab+') as output:
+                    for chunk in request.FILES['video_bytes'].chunks():
+                        output.write(chunk)
+
+            def raw_request():
+                return factory.post(
+                    '/file/upload/raw/?fileName=destination', payload,
+                    content_type='application/octet-stream')
+
+            def raw_path(request):
+                write_request_body(request, destination)
+
+            def sendfile_path(request):
+                # Only the copy of a body the ASGI server spooled to disk, not
+                # the view, which the buffered row measures
+                in_fd = os.open(spooled_body, os.O_RDONLY)
+                # sendfile can't write to an O_APPEND descriptor
+                out_fd = os.open(destination, os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    copy_file_descriptor(in_fd, out_fd, size)
+                finally:
+                    os.close(in_fd)
+                    os.close(out_fd)
+
+            # Bodies are spooled to disk past 2.5 MB by default, keep the
+            # multipart path comparable to production
+            with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=2621440):
+                for name, build_request, path in (
+                    ('multipart', multipart_request, multipart_path),
+                    ('raw buffered', raw_request, raw_path),
+                    ('spooled file to file sendfile copy', lambda: None, sendfile_path),
+                ):
+                    wall = cpu = 0.0
+                    for _ in range(options['iterations']):
+                        if os.path.exists(destination):
+                            os.remove(destination)
+                        request = build_request()
+                        started, started_cpu = time.perf_counter(), time.process_time()
+                        path(request)
+                        wall += time.perf_counter() - started
+                        cpu += time.process_time() - started_cpu
+
+                    gigabytes = size * options['iterations'] / 1024 ** 3
+                    self.stdout.write(
+                        f"{name}: {size * options['iterations'] / 1024 ** 2 / wall:.1f} MB/s, "
+                        f"{cpu / gigabytes:.2f} CPU s per GB")
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from file_app.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued recording documents to the Dowell database, retrying failures"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Seconds to wait when the outbox is empty, keeps running when set")
+        parser.add_argument('--batch-size', type=int, default=settings.DOWELL_OUTBOX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} documents, {failed} failed")
+
+            if not options['interval']:
+                break
+            if sent + failed < options['batch_size']:
+                # Drained what was due, wait for more
+                time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from file_app.uploads import prune_sessions
+
+
+class Command(BaseCommand):
+    help = "Remove the resumable and multi-track uploads not written to for UPLOAD_SESSION_TTL seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help="Seconds, defaults to UPLOAD_SESSION_TTL")
+
+    def handle(self, *args, **options):
+        pruned = prune_sessions(options['max_age'])
+        self.stdout.write(f"Removed {pruned} upload sessions")
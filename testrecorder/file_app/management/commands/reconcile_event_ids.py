@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from file_app.outbox import reconcile_event_ids
+
+
+class Command(BaseCommand):
+    help = "Register the local event ids of delivered recordings with the event creation service"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DOWELL_OUTBOX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        registered, failed = reconcile_event_ids(options['batch_size'])
+        self.stdout.write(f"Registered {registered} event ids, {failed} failed")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from file_app.merge import get_worker_count, run_merge_jobs
+
+
+class Command(BaseCommand):
+    help = "Merge queued webcam and screen files picture in picture with FFmpeg"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Seconds between looking for new jobs, keeps running when set")
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Jobs run at once, defaults to MERGE_JOBS_PER_CORE per CPU core")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or get_worker_count()
+        self.stdout.write(f"Running merge jobs, {workers} at a time")
+        processed = run_merge_jobs(
+            workers, run_forever=bool(options['interval']), interval=options['interval'] or 5)
+        self.stdout.write(f"Ran {processed} merge jobs")
@@ -0,0 +1,211 @@
+"""
+Server side merge of a recording's webcam and screen files.
+
+With SERVER_SIDE_MERGE, saving a recording whose webcam and screen files
+are in the recording storage queues a MergeJob instead of expecting the
+browser's merged file; the merged file's link is known up front and saved
+with the recording. `python manage.py run_merge_jobs` composes the files
+with FFmpeg, the webcam over the bottom left of the screen as the
+browser's video-stream-merger does, running MERGE_JOBS_PER_CORE jobs per
+CPU core.
+"""
+import datetime
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import MergeJob, RecordingFile
+from .storage import FileSystemRecordingStorage, get_recording_name, get_recording_storage
+
+
+def get_merged_file_name(screen_file_name):
+    return f"{os.path.splitext(screen_file_name)[0]}_merged.mp4"
+
+
+def enqueue_merge(megadrive_record, webcam_file_name, screen_file_name):
+    """Queue the merge of a recording's files, returns the merged file's link"""
+    storage = get_recording_storage()
+    names = [
+        get_recording_name(megadrive_record.user_name, megadrive_record.user_files_timestamp, file_name)
+        for file_name in (webcam_file_name, screen_file_name, get_merged_file_name(screen_file_name))
+    ]
+    MergeJob.objects.create(webcam_name=names[0], screen_name=names[1], output_name=names[2])
+
+    return storage.url(names[2])
+
+
+def get_worker_count():
+    return max(1, int((os.cpu_count() or 1) * settings.MERGE_JOBS_PER_CORE))
+
+
+def has_audio(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+         '-of', 'csv=p=0', path],
+        capture_output=True, text=True, timeout=60)
+    return bool(result.stdout.strip())
+
+
+def build_merge_command(webcam_path, screen_path, output_path, threads):
+    """FFmpeg command putting the webcam over the bottom left of the screen"""
+    scale = settings.MERGE_PIP_SCALE
+    filters = [
+        # The webcam is scaled to a part of the screen's width keeping its
+        # aspect ratio, to even sizes for x264
+        f"[1:v][0:v]scale2ref=w=trunc(main_w*{scale}/2)*2:h=-2[pip][screen]",
+        "[screen][pip]overlay=x=0:y=main_h-overlay_h:shortest=1[video]",
+    ]
+    maps = ['-map', '[video]']
+
+    # The browser mixes the screen's and the microphone's sound
+    audio_inputs = [index for index, path in enumerate((screen_path, webcam_path)) if has_audio(path)]
+    if len(audio_inputs) == 2:
+        filters.append("[0:a][1:a]amix=inputs=2:duration=longest[audio]")
+        maps += ['-map', '[audio]']
+    elif audio_inputs:
+        maps += ['-map', f'{audio_inputs[0]}:a']
+
+    return [
+        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        '-i', screen_path,
+        '-i', webcam_path,
+        '-filter_complex', ";".join(filters),
+        *maps,
+        '-c:v', 'libx264', '-preset', settings.MERGE_FFMPEG_PRESET, '-crf', str(settings.MERGE_FFMPEG_CRF),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-threads', str(threads),
+        '-movflags', '+faststart',
+        output_path,
+    ]
+
+
+def get_local_file(storage, name, work_dir):
+    """A local path of a stored file, downloaded to work_dir if the storage isn't local"""
+    if isinstance(storage, FileSystemRecordingStorage):
+        return storage.path(name)
+
+    path = os.path.join(work_dir, os.path.basename(name))
+    storage.fetch(name, path)
+    return path
+
+
+def run_merge(job, threads):
+    """Merges the files of a claimed job and stores the result, raises if it fails"""
+    storage = get_recording_storage()
+    work_dir = os.path.join(settings.MERGE_WORK_ROOT, str(job.id))
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        webcam_path = get_local_file(storage, job.webcam_name, work_dir)
+        screen_path = get_local_file(storage, job.screen_name, work_dir)
+        output_path = os.path.join(work_dir, os.path.basename(job.output_name))
+
+        result = subprocess.run(
+            build_merge_command(webcam_path, screen_path, output_path, threads),
+            capture_output=True, text=True, timeout=settings.MERGE_JOB_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr[-2000:]}")
+
+        storage.save(output_path, job.output_name)
+        # The merged file belongs to the webcam file's user
+        owner_id = RecordingFile.objects.filter(name=job.webcam_name).values_list('owner_id', flat=True).first()
+        RecordingFile.objects.update_or_create(name=job.output_name, defaults={'owner_id': owner_id})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def claim_job(exclude_ids=()):
+    """Marks the oldest due pending job as running, None if there is none"""
+    pending = MergeJob.objects.filter(
+        status=MergeJob.PENDING, next_attempt_at__lte=timezone.now()).exclude(id__in=exclude_ids)
+    for job in pending.order_by('next_attempt_at', 'id')[:10]:
+        # Conditional update, other workers may claim the same job
+        claimed = MergeJob.objects.filter(id=job.id, status=MergeJob.PENDING).update(
+            status=MergeJob.RUNNING, started_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def record_failure(job, error):
+    """Counts a failed attempt, the job is retried with a backoff or fails for good"""
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= settings.MERGE_MAX_ATTEMPTS:
+        job.status = MergeJob.FAILED
+    else:
+        job.status = MergeJob.PENDING
+        backoff = min(settings.MERGE_RETRY_BASE * 2 ** (job.attempts - 1), settings.MERGE_RETRY_MAX)
+        job.next_attempt_at = timezone.now() + datetime.timedelta(seconds=backoff)
+
+
+def process_job(job, threads):
+    try:
+        run_merge(job, threads)
+    except Exception as err:
+        print(f"Error while merging {job.output_name}: {err}")
+        record_failure(job, str(err))
+        job.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    else:
+        job.status = MergeJob.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at'])
+    finally:
+        close_old_connections()
+
+
+def requeue_stale_jobs():
+    """
+    Puts back jobs left running by a worker that died, returns how many.
+    Each counts as an attempt, a job that kills its worker isn't retried forever.
+    """
+    # A live worker's ffmpeg is killed at MERGE_JOB_TIMEOUT
+    stale_before = timezone.now() - datetime.timedelta(seconds=settings.MERGE_JOB_TIMEOUT * 2)
+    requeued = 0
+    for job in MergeJob.objects.filter(status=MergeJob.RUNNING, started_at__lt=stale_before):
+        started_at = job.started_at
+        record_failure(job, "The worker running the job stopped")
+        # Conditional update, other workers may requeue the same job
+        requeued += MergeJob.objects.filter(
+            id=job.id, status=MergeJob.RUNNING, started_at=started_at).update(
+            attempts=job.attempts, last_error=job.last_error, status=job.status,
+            next_attempt_at=job.next_attempt_at)
+    return requeued
+
+
+def run_merge_jobs(workers=None, run_forever=False, interval=5):
+    """
+    Runs pending jobs, workers at a time. Returns the number of jobs run,
+    keeps polling every interval seconds with run_forever.
+    """
+    workers = workers or get_worker_count()
+    # The cores are shared by the jobs running at once
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    processed = set()
+    running = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            requeue_stale_jobs()
+            while len(running) < workers:
+                # A single run tries a failed job once, a polling worker retries it
+                job = claim_job(processed if not run_forever else ())
+                if job is None:
+                    break
+                running.add(executor.submit(process_job, job, threads))
+                processed.add(job.id)
+
+            if not running and not run_forever:
+                return len(processed)
+            if running:
+                # Wakes up when a job finishes, or to look for new jobs
+                _, running = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(interval)
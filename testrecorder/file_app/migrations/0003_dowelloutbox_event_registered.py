@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-17 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_app', '0002_dowelloutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dowelloutbox',
+            name='event_registered',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.4 on 2026-10-17 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_app', '0003_dowelloutbox_event_registered'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MergeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('webcam_name', models.CharField(max_length=1024)),
+                ('screen_name', models.CharField(max_length=1024)),
+                ('output_name', models.CharField(max_length=1024)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'merge_jobs',
+            },
+        ),
+    ]
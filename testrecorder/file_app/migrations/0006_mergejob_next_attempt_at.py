@@ -0,0 +1,19 @@
+# Generated by Django 4.0.4 on 2026-10-17 16:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_app', '0005_recordingfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergejob',
+            name='next_attempt_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
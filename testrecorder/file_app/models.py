@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-from django.db import models
 
 class TestRecords(models.Model):
     user_name = models.CharField(max_length=250, default="")
@@ -61,4 +62,68 @@ class VpsIncomingTestRecord(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        managed = False
\ No newline at end of file
+        managed = False
+
+
+class DowellOutbox(models.Model):
+    """Recording documents waiting to be written to the Dowell database by drain_dowell_outbox"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    payload = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(default="", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    event_registered = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        db_table = 'dowell_outbox'
+
+
+class MergeJob(models.Model):
+    """Webcam and screen files waiting to be merged picture in picture by run_merge_jobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Names in the recording storage
+    webcam_name = models.CharField(max_length=1024)
+    screen_name = models.CharField(max_length=1024)
+    output_name = models.CharField(max_length=1024)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(default="", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'merge_jobs'
+
+
+class RecordingFile(models.Model):
+    """The user a file of the recording storage belongs to, checked by RecordingMediaView"""
+    # Name in the recording storage
+    name = models.CharField(max_length=1024, unique=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'recording_files'
@@ -0,0 +1,195 @@
+"""
+Multi-track uploads of a recording's webcam, screen and merged files.
+
+A recording upload groups one resumable upload session (file_app.uploads)
+per track, so the tracks are uploaded concurrently with their own
+offsets through the upload session endpoints. Finalizing waits for every
+track, stages them next to the recording's folder and only then moves
+them in, so the folder never holds some tracks of a failed finalize.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+
+from . import uploads
+from .storage import is_path_segment
+from .uploads import UploadError, UploadNotFound
+
+
+TRACKS = ('webcam', 'screen', 'merged')
+
+
+def get_recording_dir(recording_id):
+    try:
+        recording_id = uuid.UUID(recording_id).hex
+    except (TypeError, ValueError):
+        raise UploadNotFound("Unknown recording id")
+    return os.path.join(settings.UPLOAD_RECORDINGS_ROOT, recording_id)
+
+
+def read_recording(recording_id, user_id):
+    """The recording upload's metadata, only found for its user"""
+    try:
+        with open(os.path.join(get_recording_dir(recording_id), 'recording.json')) as recording_file:
+            recording = json.load(recording_file)
+    except FileNotFoundError:
+        raise UploadNotFound("Unknown recording id")
+    if recording.get('user_id') != user_id:
+        raise UploadNotFound("Unknown recording id")
+    return recording
+
+
+def create_recording(user_id, user_name, user_files_timestamp, tracks):
+    """
+    Creates the upload sessions of a recording's tracks.
+    tracks maps track names of TRACKS to {'fileName': ..., 'size': ...}.
+    """
+    if not user_name or not user_files_timestamp:
+        raise UploadError("userName and userFilesTimestamp are required")
+    # They name the recording's folder
+    if not is_path_segment(user_name) or not is_path_segment(user_files_timestamp.split("_T")[0]):
+        raise UploadError("userName and userFilesTimestamp must be plain names")
+    if not tracks or not set(tracks) <= set(TRACKS):
+        raise UploadError(f"tracks must be some of {', '.join(TRACKS)}")
+    file_names = [track.get('fileName') for track in tracks.values()]
+    if len(set(file_names)) != len(file_names):
+        raise UploadError("Tracks must have different file names")
+
+    sizes = {}
+    for name, track in tracks.items():
+        try:
+            sizes[name] = int(track.get('size'))
+        except (TypeError, ValueError):
+            raise UploadError(f"{name} size must be an integer")
+
+    recording = {
+        'recording_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'user_name': user_name,
+        'user_files_timestamp': user_files_timestamp,
+        'created_at': time.time(),
+        'tracks': {},
+    }
+    try:
+        for name, track in tracks.items():
+            session = uploads.create_session(user_id, track.get('fileName'), sizes[name], track.get('chunkSize'))
+            recording['tracks'][name] = {
+                'upload_id': session['upload_id'],
+                'file_name': session['file_name'],
+                'size': session['size'],
+            }
+
+        os.makedirs(get_recording_dir(recording['recording_id']))
+        write_recording(recording)
+    except BaseException:
+        # The sessions of the other tracks would hold their reservations
+        # until they expire
+        for track in recording['tracks'].values():
+            uploads.delete_session(track['upload_id'])
+        delete_recording(recording)
+        raise
+
+    return recording
+
+
+def write_recording(recording):
+    """Replaces the recording upload's metadata file, readers never see half of it"""
+    recording_dir = get_recording_dir(recording['recording_id'])
+    path = os.path.join(recording_dir, 'recording.json')
+    with open(f"{path}.tmp", 'w') as recording_file:
+        json.dump(recording, recording_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def delete_recording(recording):
+    """Removes the recording upload once its files are saved"""
+    shutil.rmtree(get_recording_dir(recording['recording_id']), ignore_errors=True)
+
+
+def get_progress(recording):
+    """Bytes received and completion of every track and of the whole recording"""
+    tracks = {}
+    for name, track in recording['tracks'].items():
+        try:
+            session = uploads.read_session(track['upload_id'])
+        except UploadNotFound:
+            # Finalized, or staged by a finalize that failed later on. A
+            # session that is gone otherwise, pruned, has to be uploaded again
+            staging_dir = recording.get('staging_dir')
+            complete = recording.get('finalized') or bool(
+                staging_dir and os.path.exists(os.path.join(staging_dir, track['file_name'])))
+            received = track['size'] if complete else 0
+        else:
+            ranges = uploads.get_received_ranges(session)
+            received = sum(end - start for start, end in ranges)
+            complete = uploads.is_complete(session, ranges)
+
+        tracks[name] = {
+            'uploadId': track['upload_id'],
+            'fileName': track['file_name'],
+            'size': track['size'],
+            'received': received,
+            'complete': complete,
+        }
+
+    return {
+        'recordingId': recording['recording_id'],
+        'size': sum(track['size'] for track in tracks.values()),
+        'received': sum(track['received'] for track in tracks.values()),
+        'complete': all(track['complete'] for track in tracks.values()),
+        'tracks': tracks,
+    }
+
+
+def finalize_recording(recording, folder):
+    """
+    Moves the complete tracks of a recording to folder, the folder made by
+    FileView.create_recording_folder. Returns the track names' file paths.
+    The recording upload is kept, marked finalized, until delete_recording,
+    so a finalize whose files failed to be saved can be run again.
+    """
+    paths = {
+        name: os.path.join(folder, track['file_name'])
+        for name, track in recording['tracks'].items()
+    }
+    if recording.get('finalized'):
+        return paths
+
+    # Staged in the folder itself, so moving them in is a rename even when
+    # the sessions are on another file system
+    staging_dir = os.path.join(folder, f".{recording['recording_id']}.staging")
+
+    sessions = {}
+    incomplete = []
+    for name, track in recording['tracks'].items():
+        if os.path.exists(os.path.join(staging_dir, track['file_name'])):
+            # Staged by a finalize that failed later on
+            continue
+        session = uploads.read_session(track['upload_id'])
+        if not uploads.is_complete(session, uploads.get_received_ranges(session)):
+            incomplete.append(name)
+        sessions[name] = session
+    if incomplete:
+        raise UploadError(f"Incomplete tracks: {', '.join(incomplete)}")
+
+    os.makedirs(staging_dir, exist_ok=True)
+    if recording.get('staging_dir') != staging_dir:
+        # get_progress finds the staged tracks there
+        recording['staging_dir'] = staging_dir
+        write_recording(recording)
+    for session in sessions.values():
+        uploads.finalize_session(session, os.path.join(staging_dir, session['file_name']))
+
+    # Every track is staged, moving them in can't fail half way for lack of data
+    for name, track in recording['tracks'].items():
+        os.replace(os.path.join(staging_dir, track['file_name']), paths[name])
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    recording['finalized'] = True
+    write_recording(recording)
+
+    return paths
@@ -0,0 +1,208 @@
+"""
+Outbox for the Dowell database writes of finished recordings.
+
+FileView and save_recording_metadata only store the recording's document
+in DowellOutbox, with an event id from core.event_ids.
+`python manage.py drain_dowell_outbox` inserts the documents and retries
+failed deliveries with exponential backoff. Drains can run concurrently,
+each entry is claimed by one of them before it is delivered.
+`python manage.py reconcile_event_ids` optionally registers the event ids
+of delivered documents with the event creation service afterwards.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.event_ids import new_event_id
+from core.http_client import ServiceUnavailable, external_services
+from .models import DowellOutbox
+
+
+def build_recording_document(new_data) -> dict:
+    """The Dowell database document of a recording record"""
+    return {
+        "user_name": new_data.user_name,
+        "test_description": new_data.test_description,
+        "test_name": new_data.test_name,
+        "user_files_timestamp": new_data.user_files_timestamp,
+        "webcam_file": new_data.webcam_file,
+        "screen_file": new_data.screen_file,
+        "merged_webcam_screen_file": new_data.merged_webcam_screen_file,
+        "key_log_file": new_data.key_log_file,
+        "beanote_file": new_data.beanote_file,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "clickup_task_notes": new_data.clickup_task_notes,
+        "eventID": new_data.event_id,
+        "Account_info": new_data.Account_info,
+        "app_type": new_data.app_type
+    }
+
+
+def request_event_id(event_id: str) -> str:
+    """Registers a local event id with the event creation service, returns its id there"""
+    dd = datetime.datetime.now()
+    time = dd.strftime("%d:%m:%Y,%H:%M:%S")
+    data = {
+        "platformcode": "FB",
+        "citycode": "101",
+        "daycode": "0",
+        "dbcode": "pfm",
+        "ip_address": "192.168.0.41",
+        "login_id": "lav",
+        "session_id": "new",
+        "processcode": "1",
+        "regional_time": time,
+        "dowell_time": time,
+        "location": "22446576",
+        "objectcode": "1",
+        "instancecode": "100051",
+        "context": event_id,
+        "document_id": "3004",
+        "rules": "some rules",
+        "status": "work",
+        "data_type": "learn",
+        "purpose_of_usage": "add",
+        "colour": "color value",
+        "hashtags": "hash tag alue",
+        "mentions": "mentions value",
+        "emojis": "emojis",
+    }
+    r = external_services.request('event_creation', json=data)
+    return r.text
+
+
+def insert_recording_document(document: dict) -> str:
+    """Inserts a recording document in to the company's database"""
+    payload = json.dumps({
+        "cluster": "ux_live",
+        "database": "ux_live",
+        "collection": "ux_live_storyboard",
+        "document": "ux_live_storyboard",
+        "team_member_ID": "1088",
+        "function_ID": "ABCDE",
+        "command": "insert",
+        "field": document,
+        "update_field": {
+            "order_nos": 21
+        },
+        "platform": "bangalore"
+    })
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    response = external_services.request('dowell_connection', headers=headers, data=payload)
+    return response.text
+
+
+def enqueue_recording(megadrive_record) -> DowellOutbox:
+    """Give the recording an event id and queue its document for drain_dowell_outbox"""
+    megadrive_record.event_id = new_event_id()
+    return DowellOutbox.objects.create(payload=build_recording_document(megadrive_record))
+
+
+def deliver(entry: DowellOutbox) -> None:
+    """Writes one outbox entry, raises if its request fails"""
+    if not entry.payload.get('eventID'):
+        # Queued before event ids were local
+        entry.payload['eventID'] = new_event_id()
+        entry.save(update_fields=['payload'])
+
+    insert_recording_document(entry.payload)
+
+
+def claim_entries(batch_size: int) -> list:
+    """
+    Claims up to batch_size due entries by moving their next attempt
+    DOWELL_OUTBOX_CLAIM_TIMEOUT seconds ahead, a conditional update only one
+    drain wins. The entries of a drain that died are due again afterwards.
+    """
+    now = timezone.now()
+    claimed_until = now + datetime.timedelta(seconds=settings.DOWELL_OUTBOX_CLAIM_TIMEOUT)
+    due = (
+        DowellOutbox.objects
+        .filter(status=DowellOutbox.PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')[:batch_size]
+    )
+
+    entries = []
+    for entry in due:
+        # Conditional update, other drains may claim the same entry
+        claimed = DowellOutbox.objects.filter(
+            id=entry.id, status=DowellOutbox.PENDING, next_attempt_at=entry.next_attempt_at,
+        ).update(next_attempt_at=claimed_until)
+        if claimed:
+            entry.next_attempt_at = claimed_until
+            entries.append(entry)
+    return entries
+
+
+def drain_outbox(batch_size: int) -> tuple:
+    """
+    Delivers up to batch_size due entries, claimed first.
+    Returns the numbers of (sent, failed) deliveries.
+    """
+    sent = failed = 0
+    for entry in claim_entries(batch_size):
+        try:
+            deliver(entry)
+        except ServiceUnavailable as err:
+            # Not attempted, the entry waits for the circuit to close without
+            # using up its attempts
+            failed += 1
+            entry.last_error = str(err)
+            entry.next_attempt_at = timezone.now() + datetime.timedelta(seconds=err.retry_after)
+            entry.save(update_fields=['last_error', 'next_attempt_at'])
+            continue
+        except Exception as err:
+            failed += 1
+            entry.attempts += 1
+            entry.last_error = str(err)
+            if entry.attempts >= settings.DOWELL_OUTBOX_MAX_ATTEMPTS:
+                entry.status = DowellOutbox.FAILED
+            else:
+                backoff = min(
+                    settings.DOWELL_OUTBOX_RETRY_BASE * 2 ** (entry.attempts - 1),
+                    settings.DOWELL_OUTBOX_RETRY_MAX)
+                entry.next_attempt_at = timezone.now() + datetime.timedelta(seconds=backoff)
+            entry.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+            continue
+
+        sent += 1
+        entry.status = DowellOutbox.SENT
+        entry.sent_at = timezone.now()
+        entry.save(update_fields=['status', 'sent_at'])
+
+    return sent, failed
+
+
+def reconcile_event_ids(batch_size: int) -> tuple:
+    """
+    Registers the event ids of up to batch_size delivered documents with the
+    event creation service, keeping its id as remoteEventID.
+    Returns the numbers of (registered, failed) ids, failed ones are retried
+    on the next run.
+    """
+    entries = list(
+        DowellOutbox.objects
+        .filter(status=DowellOutbox.SENT, event_registered=False)
+        .order_by('id')[:batch_size]
+    )
+
+    registered = failed = 0
+    for entry in entries:
+        try:
+            entry.payload['remoteEventID'] = request_event_id(entry.payload['eventID'])
+        except Exception as err:
+            failed += 1
+            entry.last_error = str(err)
+            entry.save(update_fields=['last_error'])
+            continue
+
+        registered += 1
+        entry.event_registered = True
+        entry.save(update_fields=['payload', 'event_registered'])
+
+    return registered, failed
@@ -0,0 +1,301 @@
+"""
+Storage of saved recordings.
+
+Recordings are written to TEMP_FILES_ROOT, MEDIA_ROOT and the upload
+session directories on the web node and handed to the RECORDING_STORAGE
+backend when saved, under a '<user>/<date>/<file>' name:
+
+- FileSystemRecordingStorage moves them into PERMANENT_FILES_ROOT. On one
+  file system that is a rename, across file systems it is a copy of the
+  whole file. Set COLOCATE_TEMP_FILES to keep the temporary files on the
+  permanent files' mount, outside MEDIA_ROOT; the storage check warns at
+  startup when a move would copy.
+- S3RecordingStorage uploads them to an S3 compatible object store (AWS,
+  MinIO, ...) with multipart uploads, then removes the local file. The
+  bucket stays private, RecordingMediaView checks the owner and redirects
+  to a presigned link.
+"""
+import errno
+import functools
+import logging
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied, SuspiciousFileOperation
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import RecordingFile
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_device(path):
+    """The device of path, or of its closest existing parent"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def same_file_system(path, other_path):
+    return get_device(path) == get_device(other_path)
+
+
+def finalize_file(source_path, destination_path):
+    """
+    Moves a finished file to destination_path. This is a rename on one file
+    system. Across file systems the file is copied to a staged name next to
+    the destination first, so the destination never holds part of a file.
+    Returns destination_path.
+    """
+    try:
+        os.replace(source_path, destination_path)
+        return destination_path
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+
+    print(f"Copying {source_path} to another file system, "
+          f"set COLOCATE_TEMP_FILES to move it with a rename")
+    staged_path = os.path.join(
+        os.path.dirname(destination_path),
+        f".{os.path.basename(destination_path)}.{uuid.uuid4().hex}.partial")
+    try:
+        shutil.copyfile(source_path, staged_path)
+        os.replace(staged_path, destination_path)
+    except BaseException:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+        raise
+    os.remove(source_path)
+
+    return destination_path
+
+
+def is_path_segment(part):
+    """Whether a client supplied name is a single path segment, never a traversal"""
+    return bool(part) and part not in ('.', '..') and os.path.basename(part) == part \
+        and '\\' not in part and '\0' not in part
+
+
+def get_recording_name(user_name, user_time_stamp, file_name):
+    """
+    The storage name of a recording file, the folder layout of
+    FileView.create_recording_folder. The parts come from the client,
+    SuspiciousFileOperation is raised unless each is a plain path segment.
+    """
+    parts = (user_name, user_time_stamp.split("_T")[0], file_name)
+    if not all(is_path_segment(part) for part in parts):
+        raise SuspiciousFileOperation("userName, userFilesTimestamp and the file names must be plain names")
+    return "/".join(parts)
+
+
+class RecordingStorage:
+    """
+    Base class of the recording storage backends.
+    Files are uploaded in chunks to a working file on the web node, objects
+    stores can't append, and saved once complete.
+    """
+
+    def append(self, file_name, chunks):
+        """Appends chunks of bytes to the working file file_name in MEDIA_ROOT"""
+        with open(os.path.join(settings.MEDIA_ROOT, file_name), 'ab+') as destination:
+            for chunk in chunks:
+                destination.write(chunk)
+
+    def save(self, source_path, name):
+        """Stores the complete local file source_path as name, the local file is consumed"""
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def url(self, name):
+        """The link to a stored file"""
+        raise NotImplementedError
+
+    def signed_url(self, name):
+        """A short lived link to the stored file itself, for its owner"""
+        raise NotImplementedError
+
+
+class FileSystemRecordingStorage(RecordingStorage):
+    """Recordings in PERMANENT_FILES_ROOT, served from MEDIA_URL"""
+
+    def __init__(self, location=None):
+        self.location = location or settings.PERMANENT_FILES_ROOT
+
+    def path(self, name):
+        return os.path.join(self.location, *name.split("/"))
+
+    def save(self, source_path, name):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        finalize_file(source_path, path)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def url(self, name):
+        relative_path = os.path.relpath(self.path(name), settings.MEDIA_ROOT)
+        return settings.MEDIA_URL + relative_path.replace("\\", "/")
+
+
+class S3RecordingStorage(RecordingStorage):
+    """
+    Recordings in a private S3 compatible bucket. endpoint_url points it to
+    another store than AWS, like a MinIO server. Files larger than
+    multipart_threshold bytes are uploaded in parts of multipart_chunksize
+    bytes, max_concurrency parts at a time, read from the file as they
+    are sent. Links go through RecordingMediaView, which redirects to
+    presigned links valid for url_expiry seconds.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, region_name=None, access_key=None,
+                 secret_key=None, prefix='', url_expiry=300,
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                 max_concurrency=4):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix.strip("/")
+        self.url_expiry = int(url_expiry)
+        self.multipart_threshold = int(multipart_threshold)
+        self.multipart_chunksize = int(multipart_chunksize)
+        self.max_concurrency = int(max_concurrency)
+
+    @cached_property
+    def boto3(self):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured("S3RecordingStorage requires boto3, pip install boto3")
+        return boto3
+
+    @cached_property
+    def client(self):
+        from botocore.config import Config
+
+        # boto3 clients are thread safe, one is shared by the process.
+        # Presigned links are signed with v4, custom endpoints (MinIO) are
+        # addressed by path since they rarely have per bucket host names
+        return self.boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            region_name=self.region_name,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            config=Config(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path' if self.endpoint_url else 'auto'},
+            ),
+        )
+
+    @cached_property
+    def transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.max_concurrency,
+        )
+
+    def key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def save(self, source_path, name):
+        self.client.upload_file(source_path, self.bucket, self.key(name), Config=self.transfer_config)
+        os.remove(source_path)
+
+    def fetch(self, name, local_path):
+        """Downloads a stored file to local_path"""
+        self.client.download_file(self.bucket, self.key(name), local_path, Config=self.transfer_config)
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def url(self, name):
+        return reverse('recording-media', kwargs={'name': name})
+
+    def signed_url(self, name):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.key(name)}, ExpiresIn=self.url_expiry)
+
+
+@functools.lru_cache(maxsize=None)
+def get_recording_storage():
+    """The RECORDING_STORAGE backend, created with RECORDING_STORAGE_OPTIONS"""
+    return import_string(settings.RECORDING_STORAGE)(**settings.RECORDING_STORAGE_OPTIONS)
+
+
+def is_inside(path, directory):
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return os.path.commonpath((path, directory)) == directory
+
+
+def check_storage_layout(app_configs, **kwargs):
+    """
+    Warns when finalized files would be copied instead of renamed, and when
+    the temporary files are served from MEDIA_URL. Errors when recordings
+    would be read on the event loop with DEBUG off
+    """
+    warnings = []
+    if is_inside(settings.TEMP_FILES_ROOT, settings.MEDIA_ROOT):
+        warnings.append(checks.Warning(
+            "TEMP_FILES_ROOT is inside MEDIA_ROOT, unfinished uploads are served from MEDIA_URL",
+            hint="Keep the temporary files outside MEDIA_ROOT, see COLOCATED_TEMP_FILES_ROOT.",
+            id='file_app.W002',
+        ))
+
+    if not issubclass(import_string(settings.RECORDING_STORAGE), FileSystemRecordingStorage):
+        return warnings
+
+    if not settings.DEBUG and not settings.RECORDING_MEDIA_ACCEL_PREFIX:
+        warnings.append(checks.Error(
+            "RECORDING_MEDIA_ACCEL_PREFIX is not set, recordings can't be served with DEBUG off",
+            hint="Set RECORDING_MEDIA_ACCEL_PREFIX to the internal nginx location aliasing "
+                 "PERMANENT_FILES_ROOT.",
+            id='file_app.E001',
+        ))
+
+    for source in ('TEMP_FILES_ROOT', 'MEDIA_ROOT'):
+        source_path = getattr(settings, source)
+        if not same_file_system(source_path, settings.PERMANENT_FILES_ROOT):
+            warnings.append(checks.Warning(
+                f"{source} and PERMANENT_FILES_ROOT are on different file systems, "
+                f"saving a recording copies its files",
+                hint="Set COLOCATE_TEMP_FILES with COLOCATED_TEMP_FILES_ROOT on the "
+                     "PERMANENT_FILES_ROOT mount, or mount both on one file system.",
+                id='file_app.W001',
+            ))
+    return warnings
+
+
+def log_storage_layout():
+    """
+    Logs the storage check's messages. System checks only run with
+    manage.py commands, daphne and the ASGI workers start without them.
+    """
+    for message in check_storage_layout(None):
+        log = logger.error if message.is_serious() else logger.warning
+        log("%s: %s HINT: %s", message.id, message.msg, message.hint)
@@ -1,3 +1,90 @@
-from django.test import TestCase
+import os
+import tempfile
+import unittest
+from unittest.mock import ANY
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.core.exceptions import SuspiciousFileOperation
+from django.test import SimpleTestCase
+
+from .storage import S3RecordingStorage, get_recording_name
+
+try:
+    from botocore.stub import Stubber
+except ImportError:
+    Stubber = None
+
+
+class RecordingNameTest(SimpleTestCase):
+
+    def test_name(self):
+        self.assertEqual(get_recording_name('alice', '2023-05-01_T10-00', 'webcam.webm'),
+                         'alice/2023-05-01/webcam.webm')
+
+    def test_rejects_traversal(self):
+        for parts in (('..', '2023-05-01_T10-00', 'webcam.webm'),
+                      ('alice/../bob', '2023-05-01_T10-00', 'webcam.webm'),
+                      ('alice', '../../etc_T10-00', 'webcam.webm'),
+                      ('alice', '2023-05-01_T10-00', '../webcam.webm'),
+                      ('alice', '2023-05-01_T10-00', '..\\webcam.webm'),
+                      ('', '2023-05-01_T10-00', 'webcam.webm')):
+            with self.subTest(parts=parts), self.assertRaises(SuspiciousFileOperation):
+                get_recording_name(*parts)
+
+
+@unittest.skipUnless(Stubber, "boto3 is not installed")
+class S3RecordingStorageTest(SimpleTestCase):
+    """S3RecordingStorage against a stubbed MinIO style endpoint"""
+
+    def setUp(self):
+        self.storage = S3RecordingStorage(
+            'recordings',
+            endpoint_url='http://minio.test:9000',
+            region_name='us-east-1',
+            access_key='minio',
+            secret_key='minio-secret',
+            prefix='ux',
+            url_expiry=120,
+        )
+        self.stubber = Stubber(self.storage.client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def test_signed_url_is_presigned_and_expires(self):
+        url = urlsplit(self.storage.signed_url('alice/2023-05-01/webcam.webm'))
+        query = parse_qs(url.query)
+
+        self.assertEqual(url.netloc, 'minio.test:9000')
+        self.assertEqual(url.path, '/recordings/ux/alice/2023-05-01/webcam.webm')
+        self.assertEqual(query['X-Amz-Expires'], ['120'])
+        self.assertIn('X-Amz-Signature', query)
+
+    def test_url_goes_through_the_media_view(self):
+        url = self.storage.url('alice/2023-05-01/webcam.webm')
+
+        self.assertNotIn('minio.test', url)
+        self.assertTrue(url.endswith('/alice/2023-05-01/webcam.webm'))
+
+    def test_exists(self):
+        key = {'Bucket': 'recordings', 'Key': 'ux/alice/2023-05-01/webcam.webm'}
+        self.stubber.add_response('head_object', {'ContentLength': 4}, key)
+        self.stubber.add_client_error(
+            'head_object', service_error_code='404', http_status_code=404, expected_params=key)
+
+        self.assertTrue(self.storage.exists('alice/2023-05-01/webcam.webm'))
+        self.assertFalse(self.storage.exists('alice/2023-05-01/webcam.webm'))
+        self.stubber.assert_no_pending_responses()
+
+    def test_save_uploads_and_removes_the_source(self):
+        fd, source_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as source:
+            source.write(b'webm')
+        self.addCleanup(lambda: os.path.exists(source_path) and os.remove(source_path))
+        self.stubber.add_response(
+            'put_object', {'ETag': '"etag"'},
+            {'Bucket': 'recordings', 'Key': 'ux/alice/2023-05-01/webcam.webm', 'Body': ANY})
+
+        self.storage.save(source_path, 'alice/2023-05-01/webcam.webm')
+
+        self.stubber.assert_no_pending_responses()
+        self.assertFalse(os.path.exists(source_path))
@@ -0,0 +1,409 @@
+"""
+Resumable uploads of recording files.
+
+An upload session is a directory in UPLOAD_SESSIONS_ROOT holding the
+session's metadata, a data file preallocated to the file's size and a
+journal of the chunks written. Chunks are written at their offset with
+positional writes, so they can arrive in any order, in parallel and more
+than once. A chunk is added to the journal only once its checksum matched
+and it is written, so the journal's ranges are what the client doesn't
+have to send again after a failure. Finalizing a complete session moves
+the data file to MEDIA_ROOT/<fileName>, where BytesView writes files.
+
+Sessions belong to the user who created them. The data files are
+reserved on disk up front, so a user can't have more than
+UPLOAD_MAX_SESSIONS_PER_USER sessions or UPLOAD_MAX_RESERVED_PER_USER
+bytes reserved at once.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .storage import finalize_file
+
+
+class UploadError(Exception):
+    """The upload request is invalid, the message is returned to the client"""
+
+
+class UploadNotFound(UploadError):
+    """No upload session with that id"""
+
+
+def validate_file_name(file_name):
+    if not file_name or os.path.basename(file_name) != file_name or file_name in ('.', '..'):
+        raise UploadError("fileName must be a plain file name")
+    return file_name
+
+
+def get_session_dir(upload_id):
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except (TypeError, ValueError):
+        raise UploadNotFound("Unknown upload id")
+
+    session_dir = os.path.join(settings.UPLOAD_SESSIONS_ROOT, upload_id)
+    if not os.path.isdir(session_dir):
+        raise UploadNotFound("Unknown upload id")
+    return session_dir
+
+
+def read_session(upload_id, user_id=None):
+    """The session's metadata, only found for its user when user_id is given"""
+    session_dir = get_session_dir(upload_id)
+    try:
+        with open(os.path.join(session_dir, 'session.json')) as session_file:
+            session = json.load(session_file)
+    except FileNotFoundError:
+        # Finalized or pruned in between
+        raise UploadNotFound("Unknown upload id")
+    if user_id is not None and session.get('user_id') != user_id:
+        raise UploadNotFound("Unknown upload id")
+    session['dir'] = session_dir
+    return session
+
+
+def get_user_reservations(user_id):
+    """The number of open sessions of the user and the bytes they reserve"""
+    sessions = reserved = 0
+    if not os.path.isdir(settings.UPLOAD_SESSIONS_ROOT):
+        return sessions, reserved
+
+    for name in os.listdir(settings.UPLOAD_SESSIONS_ROOT):
+        try:
+            with open(os.path.join(settings.UPLOAD_SESSIONS_ROOT, name, 'session.json')) as session_file:
+                session = json.load(session_file)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            continue
+        if session.get('user_id') == user_id:
+            sessions += 1
+            reserved += session['size']
+    return sessions, reserved
+
+
+def create_session(user_id, file_name, size, chunk_size=None):
+    """Creates an upload session of the user with a data file preallocated to size bytes"""
+    validate_file_name(file_name)
+    if size is None:
+        raise UploadError("size is required")
+    if size < 0 or size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f"size must be between 0 and {settings.UPLOAD_MAX_SIZE}")
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    if chunk_size <= 0:
+        raise UploadError("chunkSize must be positive")
+
+    # Only one of the user's sessions is created at a time, so concurrent
+    # requests can't reserve past the limits together
+    lock_key = f'upload_reservation_lock_{user_id}'
+    for _ in range(50):
+        if cache.add(lock_key, 1, 30):
+            break
+        time.sleep(0.1)
+    else:
+        raise UploadError("Another upload is being created, retry later")
+    try:
+        sessions, reserved = get_user_reservations(user_id)
+        if sessions >= settings.UPLOAD_MAX_SESSIONS_PER_USER:
+            raise UploadError("Too many open uploads, finish or wait for some to expire")
+        if reserved + size > settings.UPLOAD_MAX_RESERVED_PER_USER:
+            raise UploadError("Open uploads are too large, finish or wait for some to expire")
+        return allocate_session(user_id, file_name, size, chunk_size)
+    finally:
+        cache.delete(lock_key)
+
+
+def allocate_session(user_id, file_name, size, chunk_size):
+    upload_id = uuid.uuid4().hex
+    session_dir = os.path.join(settings.UPLOAD_SESSIONS_ROOT, upload_id)
+    os.makedirs(session_dir)
+
+    fd = os.open(os.path.join(session_dir, 'data'), os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if size and hasattr(os, 'posix_fallocate'):
+            # Reserves the blocks, so a full disk fails here and not mid-upload
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+    open(os.path.join(session_dir, 'journal'), 'w').close()
+
+    session = {
+        'upload_id': upload_id,
+        'user_id': user_id,
+        'file_name': file_name,
+        'size': size,
+        'chunk_size': chunk_size,
+        'created_at': time.time(),
+    }
+    # Written last, a session without it is incomplete and pruned
+    with open(os.path.join(session_dir, 'session.json'), 'w') as session_file:
+        json.dump(session, session_file)
+
+    return session
+
+
+def get_chunk_offset(session, offset=None, index=None):
+    if offset is None and index is None:
+        raise UploadError("offset or index is required")
+    if offset is None:
+        offset = index * session['chunk_size']
+    if offset < 0 or offset > session['size']:
+        raise UploadError("Chunk starts outside of the file")
+    return offset
+
+
+def write_chunk(session, offset, uploaded_file, checksum=None):
+    """
+    Writes an uploaded chunk at offset of the session's data file.
+    checksum is the sha256 hex digest of the chunk, it is checked before
+    anything is written so a bad retry can't overwrite good data.
+    Returns the number of bytes written.
+    """
+    if offset + uploaded_file.size > session['size']:
+        raise UploadError("Chunk ends after the end of the file")
+
+    if checksum is not None:
+        digest = hashlib.sha256()
+        for data in uploaded_file.chunks():
+            digest.update(data)
+        if digest.hexdigest() != checksum.lower():
+            raise UploadError("Checksum mismatch")
+
+    position = offset
+    fd = os.open(os.path.join(session['dir'], 'data'), os.O_WRONLY)
+    try:
+        for data in uploaded_file.chunks():
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, position)
+                position += written
+                view = view[written:]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    length = position - offset
+    if length:
+        # One short O_APPEND write per chunk, parallel chunks don't interleave
+        fd = os.open(os.path.join(session['dir'], 'journal'), os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, f"{offset} {length}\n".encode())
+        finally:
+            os.close(fd)
+
+    return length
+
+
+def get_received_ranges(session):
+    """The merged [start, end) byte ranges written so far"""
+    with open(os.path.join(session['dir'], 'journal')) as journal:
+        chunks = sorted(
+            (int(offset), int(offset) + int(length))
+            for offset, length in (line.split() for line in journal if line.strip())
+        )
+
+    ranges = []
+    for start, end in chunks:
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def format_ranges(ranges):
+    """Ranges as inclusive start-end pairs, as in Range headers"""
+    return ",".join(f"{start}-{end - 1}" for start, end in ranges)
+
+
+def is_complete(session, ranges):
+    if session['size'] == 0:
+        return True
+    return ranges == [[0, session['size']]]
+
+
+def finalize_session(session, destination=None):
+    """
+    Moves the data file of a complete session to destination, by default
+    MEDIA_ROOT/<fileName>. Returns its path.
+    """
+    if not is_complete(session, get_received_ranges(session)):
+        raise UploadError("Upload is incomplete")
+
+    if destination is None:
+        destination = os.path.join(settings.MEDIA_ROOT, session['file_name'])
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        finalize_file(os.path.join(session['dir'], 'data'), destination)
+    except FileNotFoundError:
+        raise UploadNotFound("Upload was already finalized")
+    shutil.rmtree(session['dir'], ignore_errors=True)
+
+    return destination
+
+
+def delete_session(upload_id):
+    """Removes an upload session and its reserved data file"""
+    try:
+        shutil.rmtree(get_session_dir(upload_id), ignore_errors=True)
+    except UploadNotFound:
+        pass
+
+
+def get_last_activity(session_dir):
+    """The time of the last chunk written to a session"""
+    journal_path = os.path.join(session_dir, 'journal')
+    # The journal changes with every chunk, the directory only on creation
+    return os.path.getmtime(journal_path if os.path.exists(journal_path) else session_dir)
+
+
+def prune_sessions(max_age=None):
+    """
+    Removes the upload sessions and multi-track uploads older than max_age
+    seconds, returns how many. A multi-track upload is as old as the last
+    chunk of any of its tracks, and keeps all of its sessions until then.
+    """
+    max_age = settings.UPLOAD_SESSION_TTL if max_age is None else max_age
+    now = time.time()
+
+    pruned = 0
+    kept_upload_ids = set()
+    if os.path.isdir(settings.UPLOAD_RECORDINGS_ROOT):
+        for name in os.listdir(settings.UPLOAD_RECORDINGS_ROOT):
+            recording_dir = os.path.join(settings.UPLOAD_RECORDINGS_ROOT, name)
+            try:
+                with open(os.path.join(recording_dir, 'recording.json')) as recording_file:
+                    upload_ids = [track['upload_id'] for track in json.load(recording_file)['tracks'].values()]
+            except (FileNotFoundError, NotADirectoryError, ValueError, KeyError):
+                upload_ids = []
+
+            last_active = os.path.getmtime(recording_dir)
+            for upload_id in upload_ids:
+                session_dir = os.path.join(settings.UPLOAD_SESSIONS_ROOT, upload_id)
+                if os.path.isdir(session_dir):
+                    last_active = max(last_active, get_last_activity(session_dir))
+
+            if now - last_active > max_age:
+                shutil.rmtree(recording_dir, ignore_errors=True)
+                pruned += 1
+            else:
+                kept_upload_ids.update(upload_ids)
+
+    if os.path.isdir(settings.UPLOAD_SESSIONS_ROOT):
+        for name in os.listdir(settings.UPLOAD_SESSIONS_ROOT):
+            session_dir = os.path.join(settings.UPLOAD_SESSIONS_ROOT, name)
+            if name in kept_upload_ids:
+                continue
+            if now - get_last_activity(session_dir) > max_age:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                pruned += 1
+    return pruned
+
+
+def copy_stream(stream, fd, buffer_size=None):
+    """
+    Copies a file-like stream to fd in buffers of RAW_UPLOAD_BUFFER_SIZE
+    bytes, without holding more than one buffer in memory.
+    Returns the number of bytes copied.
+    """
+    buffer_size = buffer_size or settings.RAW_UPLOAD_BUFFER_SIZE
+    copied = 0
+    while True:
+        data = stream.read(buffer_size)
+        if not data:
+            return copied
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            copied += written
+            view = view[written:]
+
+
+def copy_file_descriptor(in_fd, out_fd, count):
+    """Copies count bytes from the current position of in_fd with os.sendfile, in the kernel"""
+    copied = 0
+    while copied < count:
+        sent = os.sendfile(out_fd, in_fd, None, min(count - copied, settings.RAW_UPLOAD_BUFFER_SIZE * 64))
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def get_body_file_descriptor(request):
+    """
+    The descriptor of the file the ASGI handler spooled the request body
+    to, or None if the body is in memory or read from the connection.
+    This relies on private attributes of Django's request and of
+    SpooledTemporaryFile, anything unexpected gives None.
+    """
+    stream = getattr(request, '_stream', None)
+    # The WSGI handler's LimitedStream wraps the connection
+    if stream is None or not isinstance(stream, tempfile.SpooledTemporaryFile):
+        return None
+    if not getattr(stream, '_rolled', False):
+        # Still in memory, fileno() would write it to disk first
+        return None
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def send_body_file(stream, body_fd, path, count):
+    """
+    Appends count bytes of the spooled body stream to path with os.sendfile.
+    Returns the number of bytes written, or None having written nothing if
+    the spooled file can't be used that way.
+    """
+    # sendfile can't write to an O_APPEND descriptor
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        start = os.lseek(fd, 0, os.SEEK_END)
+        position = None
+        try:
+            stream.flush()
+            position = stream.tell()
+            os.lseek(body_fd, position, os.SEEK_SET)
+            copied = copy_file_descriptor(body_fd, fd, count)
+            # Leave the stream as if it had been read
+            stream.seek(position + copied)
+            return copied
+        except (AttributeError, OSError, ValueError) as err:
+            print("Unable to send the spooled request body, reading it instead:", err)
+            os.ftruncate(fd, start)
+            if position is not None:
+                stream.seek(position)
+            return None
+    finally:
+        os.close(fd)
+
+
+def write_request_body(request, path):
+    """
+    Appends the raw body of a Django request to path.
+    With RAW_UPLOAD_SENDFILE a body already spooled to a file is copied
+    with os.sendfile, otherwise it is read in RAW_UPLOAD_BUFFER_SIZE buffers.
+    Returns the number of bytes written.
+    """
+    body_fd = get_body_file_descriptor(request) if settings.RAW_UPLOAD_SENDFILE else None
+    content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+
+    if body_fd is not None and content_length:
+        copied = send_body_file(request._stream, body_fd, path, content_length)
+        if copied is not None:
+            return copied
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        return copy_stream(request, fd)
+    finally:
+        os.close(fd)
@@ -1,8 +1,29 @@
 from django.urls import path
-from .views import FileView, BytesView, CreateBroadcastView
+from .views import (
+    FileView,
+    BytesView,
+    RawBytesView,
+    CreateBroadcastView,
+    UploadSessionView,
+    UploadChunkView,
+    UploadFinalizeView,
+    RecordingUploadView,
+    RecordingUploadProgressView,
+    RecordingUploadFinalizeView,
+)
 
 urlpatterns = [
     path('upload/', FileView.as_view(), name='file-upload'),
     path('upload/bytes/', BytesView.as_view(), name='file-bytes-upload'),
+    path('upload/raw/', RawBytesView.as_view(), name='file-raw-upload'),
+    path('upload/sessions/', UploadSessionView.as_view(), name='upload-session'),
+    path('upload/sessions/<str:upload_id>/', UploadChunkView.as_view(), name='upload-chunk'),
+    path('upload/sessions/<str:upload_id>/finalize/', UploadFinalizeView.as_view(),
+         name='upload-finalize'),
+    path('upload/recordings/', RecordingUploadView.as_view(), name='recording-upload'),
+    path('upload/recordings/<str:recording_id>/', RecordingUploadProgressView.as_view(),
+         name='recording-upload-progress'),
+    path('upload/recordings/<str:recording_id>/finalize/', RecordingUploadFinalizeView.as_view(),
+         name='recording-upload-finalize'),
     path('upload/createbroadcast/', CreateBroadcastView.as_view(), name='create-broadcast'),
 ]
\ No newline at end of file
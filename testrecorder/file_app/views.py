@@ -1,18 +1,21 @@
-import datetime
 import json
 import os
-import shutil
 
-import requests
 from django.conf import settings
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
 from dotenv import load_dotenv
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
 
+from . import multitrack, uploads
+from .merge import enqueue_merge
+from .storage import check_recording_owner, get_recording_name, get_recording_storage, set_recording_owner
 from .models import VpsTestRecord
+from .outbox import enqueue_recording
 from .serializers import (
     VpsFileSerializer,
     VpsIncomingFileSerializer,
@@ -46,8 +49,13 @@ class FileView(APIView):
                 if 'https://youtu.be' in webcam_file_name:
                     megadrive_record.webcam_file = webcam_file_name
                 else:
-                    self.handle_recording_file(megadrive_record, webcam_file_name)
+                    megadrive_record.webcam_file = self.handle_recording_file(
+                        megadrive_record, webcam_file_name, request.user)
 
+            except SuspiciousFileOperation as err:
+                return Response({'error': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+            except PermissionDenied as err:
+                return Response({'error': str(err)}, status=status.HTTP_403_FORBIDDEN)
             except Exception as err:
                 print("Error while handling webcam file:", err)
 
@@ -58,8 +66,13 @@ class FileView(APIView):
                 if 'https://youtu.be' in screen_file_name:
                     megadrive_record.screen_file = screen_file_name
                 else:
-                    self.handle_recording_file(megadrive_record, screen_file_name)
+                    megadrive_record.screen_file = self.handle_recording_file(
+                        megadrive_record, screen_file_name, request.user)
 
+            except SuspiciousFileOperation as err:
+                return Response({'error': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+            except PermissionDenied as err:
+                return Response({'error': str(err)}, status=status.HTTP_403_FORBIDDEN)
             except Exception as err:
                 print("Error while handling screen file:", err)
 
@@ -71,16 +84,20 @@ class FileView(APIView):
             except Exception as err:
                 print("Error while handling merged file:", err)
 
+            # The browser's merged file is the YouTube link of its live
+            # broadcast, the merge it streams live isn't uploaded. Clients
+            # that don't broadcast send no merged file and get it merged here
+            if settings.SERVER_SIDE_MERGE and not megadrive_record.merged_webcam_screen_file:
+                self.queue_merge(megadrive_record)
+
             # Get selected playlist
             account_info = request.data.get('accountInfo')
             if account_info:
                 megadrive_record.Account_info = json.loads(account_info)
 
-            # Get an event id
-            megadrive_record.event_id = self.get_event_id()
-
-            # Dowell connection insertion of data
-            insert_response = self.dowell_connection_db_insert(megadrive_record)
+            # The event id and the Dowell connection insertion of data are
+            # done by drain_dowell_outbox
+            enqueue_recording(megadrive_record)
 
             mega_file_serializer = VpsFileSerializer(megadrive_record)
             file_links = mega_file_serializer.data
@@ -91,20 +108,45 @@ class FileView(APIView):
             return Response(file_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-    def handle_recording_file(self, megadrive_record, file_name):
-            folder_created, new_path = self.create_recording_folder(
-                megadrive_record.user_name, megadrive_record.user_files_timestamp)
+    def handle_recording_file(self, megadrive_record, file_name, user=None):
+        """
+        Saves a recording file from the temporary folder to the recording
+        storage, owned by user, returns its link. A file already saved is
+        only linked again for its owner, PermissionDenied is raised for
+        other users. Raises if the file is in neither, so the record's field
+        stays empty, and SuspiciousFileOperation for names that aren't plain.
+        """
+        storage = get_recording_storage()
+        # Checks that the client's names are single path segments
+        name = get_recording_name(
+            megadrive_record.user_name, megadrive_record.user_files_timestamp, file_name)
+        source_path = os.path.join(settings.TEMP_FILES_ROOT, file_name)
+
+        owned = check_recording_owner(name, user, storage)
+        try:
+            if os.path.exists(source_path):
+                storage.save(source_path, name)
+                set_recording_owner(name, user)
+            elif not owned or not storage.exists(name):
+                raise FileNotFoundError("no such file was uploaded")
+        except Exception as err:
+            msg = f"Failed to save {file_name.split('.')[0]} file: {err}"
+            raise Exception(msg)
+
+        return storage.url(name)
 
-            if folder_created:
-                file_path = os.path.join(new_path, file_name)
-                source_path = os.path.join(settings.TEMP_FILES_ROOT, file_name)
+    def queue_merge(self, megadrive_record):
+        """Queues the server side merge of the recording's saved webcam and screen files"""
+        webcam_link = megadrive_record.webcam_file
+        screen_link = megadrive_record.screen_file
+        if not webcam_link or not screen_link or 'https://youtu.be' in webcam_link + screen_link:
+            return
 
-                if os.path.exists(source_path):
-                    shutil.move(source_path, file_path)
-                    megadrive_record.webcam_file = self.convert_file_path_to_link(file_path)
-            else:
-                msg = f"Failed to save {file_name.split('.')[0]} file"
-                raise Exception(msg)
+        try:
+            megadrive_record.merged_webcam_screen_file = enqueue_merge(
+                megadrive_record, webcam_link.rsplit("/", 1)[-1], screen_link.rsplit("/", 1)[-1])
+        except Exception as err:
+            print("Error while queuing the merge:", err)
 
     def create_recording_folder(self, user_name, user_time_stamp):
         """Creates a folder for storing user files"""
@@ -150,86 +192,6 @@ class FileView(APIView):
 
         return no_single_slashes
 
-    def get_event_id(self):
-        """
-            Gets an event id.
-        """
-        dd = datetime.datetime.now()
-        time = dd.strftime("%d:%m:%Y,%H:%M:%S")
-        url = "https://100003.pythonanywhere.com/event_creation"
-        data = {
-            "platformcode": "FB",
-            "citycode": "101",
-            "daycode": "0",
-            "dbcode": "pfm",
-            "ip_address": "192.168.0.41",
-            "login_id": "lav",
-            "session_id": "new",
-            "processcode": "1",
-            "regional_time": time,
-            "dowell_time": time,
-            "location": "22446576",
-            "objectcode": "1",
-            "instancecode": "100051",
-            "context": "afdafa ",
-            "document_id": "3004",
-            "rules": "some rules",
-            "status": "work",
-            "data_type": "learn",
-            "purpose_of_usage": "add",
-            "colour": "color value",
-            "hashtags": "hash tag alue",
-            "mentions": "mentions value",
-            "emojis": "emojis",
-        }
-        r = requests.post(url, json=data)
-        return r.text
-
-    def dowell_connection_db_insert(self, new_data):
-        """
-            Inserts a record in to the company's database
-        """
-
-        url = "http://100002.pythonanywhere.com/"
-
-        payload = json.dumps({
-            "cluster": "ux_live",
-            "database": "ux_live",
-            "collection": "ux_live_storyboard",
-            "document": "ux_live_storyboard",
-            "team_member_ID": "1088",
-            "function_ID": "ABCDE",
-            "command": "insert",
-            "field": {
-                "user_name": new_data.user_name,
-                "test_description": new_data.test_description,
-                "test_name": new_data.test_name,
-                "user_files_timestamp": new_data.user_files_timestamp,
-                "webcam_file": new_data.webcam_file,
-                "screen_file": new_data.screen_file,
-                "merged_webcam_screen_file": new_data.merged_webcam_screen_file,
-                "key_log_file": new_data.key_log_file,
-                "beanote_file": new_data.beanote_file,
-                "timestamp": datetime.datetime.now().isoformat(),
-                "clickup_task_notes": new_data.clickup_task_notes,
-                "eventID": new_data.event_id,
-                "Account_info": new_data.Account_info,
-                "app_type": new_data.app_type
-            },
-            "update_field": {
-                "order_nos": 21
-            },
-            "platform": "bangalore"
-        })
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.request("POST", url, headers=headers, data=payload)
-        print(response.text)
-        return response.text
-
-   
 
 class BytesView(APIView):
     """
@@ -254,19 +216,264 @@ class BytesView(APIView):
         filedata = request.data['video_bytes']
         # Extract the file name from the request data.
         file_name = request.data['fileName']
-        # Create the path where the file will be saved.
-        recording_file_path = settings.MEDIA_ROOT + "/" + file_name
 
-        # Open the file for writing in binary mode in append mode to ensure that data is added to the end of the file.
-        with open(recording_file_path, 'ab+') as destination:
-            for chunk in filedata.chunks():
-                # Write each chunk of data to the file.
-                destination.write(chunk)
+        # Append the chunks to the end of the working file of the recording storage.
+        get_recording_storage().append(file_name, filedata.chunks())
 
         # Return a DRF Response object with a message indicating the bytes were received and an HTTP status code of 201.
         return Response("Bytes Received", status=status.HTTP_201_CREATED)
 
 
+class RawBytesView(APIView):
+    """
+    Appends the application/octet-stream body of a POST request to the file
+    named by the 'fileName' query parameter, like BytesView does with its
+    multipart 'video_bytes'. The body isn't parsed: under ASGI the server
+    has already spooled it to a temporary file, which is copied to the file
+    with os.sendfile once it is on disk, and read in buffers otherwise.
+    Bodies are limited to UPLOAD_MAX_SIZE bytes.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        # request.data is never read, so DRF doesn't parse the body
+        try:
+            file_name = uploads.validate_file_name(request.query_params.get('fileName'))
+            content_length = get_int(request.META, 'CONTENT_LENGTH')
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+        if content_length is None:
+            return Response({'error': "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+        if content_length > settings.UPLOAD_MAX_SIZE:
+            return Response({'error': f"Body is larger than {settings.UPLOAD_MAX_SIZE} bytes"},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        recording_file_path = os.path.join(settings.MEDIA_ROOT, file_name)
+        received = uploads.write_request_body(request._request, recording_file_path)
+
+        return Response({'received': received}, status=status.HTTP_201_CREATED)
+
+
+def upload_error_response(err):
+    """Response of an uploads.UploadError"""
+    if isinstance(err, uploads.UploadNotFound):
+        return Response({'error': str(err)}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'error': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def get_int(data, key, default=None):
+    """An integer field of the request data, raises UploadError if it isn't one"""
+    value = data.get(key)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise uploads.UploadError(f"{key} must be an integer")
+
+
+def get_session_status(session):
+    ranges = uploads.get_received_ranges(session)
+    return {
+        'uploadId': session['upload_id'],
+        'fileName': session['file_name'],
+        'size': session['size'],
+        'chunkSize': session['chunk_size'],
+        'received': ranges,
+        'complete': uploads.is_complete(session, ranges),
+    }
+
+
+class UploadSessionView(APIView):
+    """
+    Starts a resumable upload, an alternative to BytesView that lets
+    chunks be sent in parallel, in any order and again after a failure.
+    The request gives the file's 'fileName' and 'size' and optionally the
+    'chunkSize' the chunk indexes count in.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            session = uploads.create_session(
+                request.user.id,
+                request.data.get('fileName'),
+                get_int(request.data, 'size'),
+                get_int(request.data, 'chunkSize'))
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response({
+            'uploadId': session['upload_id'],
+            'chunkSize': session['chunk_size'],
+        }, status=status.HTTP_201_CREATED)
+
+
+class UploadChunkView(APIView):
+    """
+    Chunks of a resumable upload.
+    PUT writes the 'chunk' file of a multipart/form-data request at its
+    'offset', or at its 'index' times the chunk size, after checking its
+    optional sha256 'checksum'. GET returns the byte ranges received so
+    far, HEAD the same in the Upload-Length and Upload-Received headers.
+    """
+
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, upload_id, *args, **kwargs):
+        try:
+            session = uploads.read_session(upload_id, request.user.id)
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response(get_session_status(session), status=status.HTTP_200_OK)
+
+    def head(self, request, upload_id, *args, **kwargs):
+        try:
+            session = uploads.read_session(upload_id, request.user.id)
+        except uploads.UploadNotFound:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        response = Response(status=status.HTTP_200_OK)
+        response['Upload-Length'] = session['size']
+        response['Upload-Received'] = uploads.format_ranges(uploads.get_received_ranges(session))
+        return response
+
+    def put(self, request, upload_id, *args, **kwargs):
+        try:
+            session = uploads.read_session(upload_id, request.user.id)
+            chunk = request.data.get('chunk')
+            if chunk is None:
+                raise uploads.UploadError("chunk is required")
+            offset = uploads.get_chunk_offset(
+                session, get_int(request.data, 'offset'), get_int(request.data, 'index'))
+            uploads.write_chunk(session, offset, chunk, request.data.get('checksum'))
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response(get_session_status(session), status=status.HTTP_200_OK)
+
+
+class UploadFinalizeView(APIView):
+    """Moves the file of a complete resumable upload to where BytesView saves files"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, upload_id, *args, **kwargs):
+        try:
+            session = uploads.read_session(upload_id, request.user.id)
+            uploads.finalize_session(session)
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response({'fileName': session['file_name']}, status=status.HTTP_201_CREATED)
+
+
+class RecordingUploadView(APIView):
+    """
+    Starts the multi-track upload of a recording.
+    The request gives the 'userName' and 'userFilesTimestamp' of the
+    recording and its 'tracks', a JSON object mapping 'webcam', 'screen'
+    and 'merged' to their 'fileName' and 'size'. Every track gets an
+    upload session of its own, so the tracks can be uploaded concurrently.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            tracks = request.data.get('tracks')
+            if isinstance(tracks, str):
+                tracks = json.loads(tracks)
+            if not isinstance(tracks, dict) or not all(isinstance(track, dict) for track in tracks.values()):
+                raise uploads.UploadError("tracks must be an object of tracks")
+            recording = multitrack.create_recording(
+                request.user.id, request.data.get('userName'), request.data.get('userFilesTimestamp'), tracks)
+        except json.JSONDecodeError:
+            return Response({'error': "tracks must be JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response(multitrack.get_progress(recording), status=status.HTTP_201_CREATED)
+
+
+class RecordingUploadProgressView(APIView):
+    """Bytes received of every track of a multi-track upload"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, recording_id, *args, **kwargs):
+        try:
+            recording = multitrack.read_recording(recording_id, request.user.id)
+            progress = multitrack.get_progress(recording)
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+
+        return Response(progress, status=status.HTTP_200_OK)
+
+
+class RecordingUploadFinalizeView(APIView):
+    """
+    Moves the tracks of a complete multi-track upload to the recording's
+    folder and saves them to the recording storage, returns the links of
+    the files by track.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, recording_id, *args, **kwargs):
+        file_view = FileView()
+        try:
+            recording = multitrack.read_recording(recording_id, request.user.id)
+            # Checked before anything is created or moved, the recording's
+            # folder may be the storage's. The files of a finalized recording
+            # are its own.
+            storage = None if recording.get('finalized') else get_recording_storage()
+            for track in recording['tracks'].values():
+                check_recording_owner(get_recording_name(
+                    recording['user_name'], recording['user_files_timestamp'], track['file_name']),
+                    request.user, storage)
+            folder_created, new_path = file_view.create_recording_folder(
+                recording['user_name'], recording['user_files_timestamp'])
+            if not folder_created:
+                return Response({'error': "Failed to create the recording folder"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            paths = multitrack.finalize_recording(recording, new_path)
+        except uploads.UploadError as err:
+            return upload_error_response(err)
+        except SuspiciousFileOperation as err:
+            return Response({'error': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+        except PermissionDenied as err:
+            return Response({'error': str(err)}, status=status.HTTP_403_FORBIDDEN)
+
+        # The files are complete in the recording's folder, the storage moves
+        # them on unless it is that folder
+        storage = get_recording_storage()
+        links = {}
+        for track, path in paths.items():
+            name = get_recording_name(
+                recording['user_name'], recording['user_files_timestamp'], os.path.basename(path))
+            try:
+                if os.path.exists(path):
+                    storage.save(path, name)
+                    set_recording_owner(name, request.user)
+                elif not storage.exists(name):
+                    raise FileNotFoundError(f"{os.path.basename(path)} is missing")
+            except Exception as err:
+                # The recording upload is kept, finalizing again saves the rest
+                print(f"Error while saving the {track} track:", err)
+                return Response({'error': f"Failed to save the {track} track, retry the finalize"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            links[track] = storage.url(name)
+
+        multitrack.delete_recording(recording)
+
+        return Response(links, status=status.HTTP_201_CREATED)
+
+
 class CreateBroadcastView(APIView):
     # parser_classes = (MultiPartParser, FormParser)
 
@@ -280,10 +487,10 @@ class CreateBroadcastView(APIView):
         return Response("Bytes Received", status=status.HTTP_201_CREATED)
 
 
-def save_recording_metadata(request):
+def save_recording_metadata(request, user=None):
     """
         Saves a recording meta data such as test_name.
-        requests is a dictionary of the metadata.
+        requests is a dictionary of the metadata, user owns the files.
     """
 
     file_serializer = VpsWebsocketFileSerializer(data=request)
@@ -320,27 +527,13 @@ def save_recording_metadata(request):
                       webcam_recording_file_path)
                 megadrive_record.webcam_file = webcam_recording_file_path
             else:
-                # Create folder to store the files
-                folder_created, new_path = file_view.create_recording_folder(
-                    megadrive_record.user_name, megadrive_record.user_files_timestamp)
-
-                if folder_created:
-                    # Copy webcam file from temporary folder to permanent folder
-                    webcam_recording_file_path = new_path+"/"+webcam_file_name
-                    print("webcam_recording_file_path: ",
-                          webcam_recording_file_path)
-
-                    source_path = settings.TEMP_FILES_ROOT+"/"+webcam_file_name
-                    if os.path.exists(source_path):
-                        shutil.move(
-                            source_path, webcam_recording_file_path)
-
-                    megadrive_record.webcam_file = file_view.convert_file_path_to_link(
-                        webcam_recording_file_path)
-                else:
-                    msg = "Failed to save webcam file"
-                    print(msg)
-                    
+                # Save the webcam file from the temporary folder to the recording storage
+                webcam_recording_file_path = file_view.handle_recording_file(
+                    megadrive_record, webcam_file_name, user)
+                print("webcam_recording_file_path: ",
+                      webcam_recording_file_path)
+                megadrive_record.webcam_file = webcam_recording_file_path
+
         except Exception as err:
             print("Error while handling webcam file: " + str(err))
 
@@ -356,27 +549,12 @@ def save_recording_metadata(request):
                       screen_recording_file_path)
                 megadrive_record.screen_file = screen_recording_file_path
             else:
-                # Create folder to store the files
-                folder_created, new_path = file_view.create_recording_folder(
-                    megadrive_record.user_name, megadrive_record.user_files_timestamp)
-
-                if folder_created:
-                    # Copy screen file from temporary folder to permanent folder
-                    screen_recording_file_path = new_path+"/"+screen_file_name
-                    print("screen_recording_file_path: ",
-                          screen_recording_file_path)
-
-                    source_path = settings.TEMP_FILES_ROOT+"/"+screen_file_name
-                    if os.path.exists(source_path):
-                        shutil.move(
-                            source_path, screen_recording_file_path)
-
-                    megadrive_record.screen_file = file_view.convert_file_path_to_link(
-                        screen_recording_file_path)
-                else:
-                    msg = "Failed to save screen file"
-                    print(msg)
-                    # raise Exception(msg)
+                # Save the screen file from the temporary folder to the recording storage
+                screen_recording_file_path = file_view.handle_recording_file(
+                    megadrive_record, screen_file_name, user)
+                print("screen_recording_file_path: ",
+                      screen_recording_file_path)
+                megadrive_record.screen_file = screen_recording_file_path
 
         except Exception as err:
             print("Error while handling screen file: " + str(err))
@@ -391,6 +569,9 @@ def save_recording_metadata(request):
         except Exception as err:
             print("Error while handling merged file: " + str(err))
 
+        if settings.SERVER_SIDE_MERGE and not megadrive_record.merged_webcam_screen_file:
+            file_view.queue_merge(megadrive_record)
+
         # Get selected playlist
         if 'Account_info' in request.keys():
             Account_info = request['Account_info']
@@ -398,19 +579,13 @@ def save_recording_metadata(request):
             print("Account_info: ", Account_info)
             megadrive_record.Account_info = Account_info
 
-        # Get an event id
-        event_id = file_view.get_event_id()
-        # event_id = "Testing"
-        print("Dowell Event ID: ", event_id)
-        megadrive_record.event_id = event_id
-
         # Save record in database
         """db_save_thread = threading.Thread(
             target=megadrive_record.save, args=())
         db_save_thread.start()"""
-        # Dowell connection insertion of data
-        insert_response = file_view.dowell_connection_db_insert(
-            megadrive_record)
+        # The event id and the Dowell connection insertion of data are
+        # done by drain_dowell_outbox
+        enqueue_recording(megadrive_record)
 
         mega_file_serializer = VpsFileSerializer(megadrive_record)
         # print("settings.BASE_DIR: ",settings.BASE_DIR)
@@ -0,0 +1,154 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import RecordingFile
+from .storage import FileSystemRecordingStorage, get_recording_storage
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Size of the reads of the files served by Django. Django 4.0 iterates the
+# streamed responses on the ASGI event loop, large reads keep the number of
+# blocking reads per file low
+MEDIA_BLOCK_SIZE = 1024 * 1024
+
+
+def get_file_etag(stat_result):
+    return quote_etag(f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}")
+
+
+def parse_range(range_header, size):
+    """
+    The (start, end) inclusive byte range of a Range header, None to serve
+    the whole file. Several ranges are served as the whole file, which
+    RFC 9110 allows. Raises ValueError if the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(range_header.replace(" ", ""))
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if size == 0:
+        raise ValueError("Empty file")
+
+    start, end = match.groups()
+    if start == "":
+        # Suffix range, the last bytes of the file
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range outside of the file")
+    return start, min(end, size - 1)
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as media_file:
+        media_file.seek(start)
+        while length > 0:
+            data = media_file.read(min(MEDIA_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+class RecordingMediaView(APIView):
+    """
+    Serves saved recording files at the links the recording storage gives
+    out, to the user who saved them (RecordingFile) and to staff.
+    Supports Range requests, so players fetch only the part they play, and
+    ETag/If-None-Match revalidation. With RECORDING_MEDIA_ACCEL_PREFIX set
+    the file itself is sent by nginx through X-Accel-Redirect, which is
+    required when DEBUG is off: daphne reads the files Django serves on the
+    event loop the websockets run on. Recordings in other storages are
+    redirected to with presigned links.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, name, *args, **kwargs):
+        if any(segment in ("", ".", "..") for segment in name.split("/")):
+            return Response({'error': "Recording not found"}, status=status.HTTP_404_NOT_FOUND)
+        # The user name in the path is the one the client sent, the owner is
+        # the user who saved the file
+        if not request.user.is_staff and not RecordingFile.objects.filter(name=name, owner=request.user).exists():
+            return Response({'error': "Not allowed to access this recording"},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        storage = get_recording_storage()
+        if not isinstance(storage, FileSystemRecordingStorage):
+            # The bucket is private, the owner gets a short lived link
+            return HttpResponseRedirect(storage.signed_url(name))
+
+        try:
+            path = safe_join(storage.location, name)
+            stat_result = os.stat(path)
+        except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+            return Response({'error': "Recording not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = get_file_etag(stat_result)
+        size = stat_result.st_size
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        if settings.RECORDING_MEDIA_ACCEL_PREFIX:
+            # nginx handles the ranges and conditional requests of the file
+            response = HttpResponse(content_type=content_type)
+            # nginx decodes the URI, names may have spaces and non-ASCII characters
+            response['X-Accel-Redirect'] = settings.RECORDING_MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + quote(name)
+            response['ETag'] = etag
+            return response
+
+        if not settings.DEBUG:
+            raise ImproperlyConfigured(
+                "RECORDING_MEDIA_ACCEL_PREFIX is required to serve recordings with DEBUG off")
+
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # A Range with a stale If-Range gets the whole, changed, file
+        if range_header and (not if_range or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+
+        if byte_range is None:
+            # Read on the event loop, ASGI has no file wrapper to sendfile with
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.block_size = MEDIA_BLOCK_SIZE
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_range(path, start, end - start + 1),
+                status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type)
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = end - start + 1
+
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat_result.st_mtime)
+        response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        return response
@@ -34,6 +34,8 @@ let audioStream = null;
 
 // Assume you have a global variable for your buffer
 let mediaBuffer = [];
+// Set while the server asks us to hold back media ("pause,<bytes>")
+let socketPaused = false;
 
 let currentCamera = "user";
 let audioConstraints = {
@@ -445,6 +447,7 @@ async function stopRecording(errorOccurred = false) {
         const youtubeLink = "https://youtu.be/" + newBroadcastID;
 
         if (recordScreen && recordWebcam) {
+          // The merged stream is the live broadcast, only its link is sent
           testRecordingData.set('mergedWebcamScreenFile', youtubeLink);
           testRecordingData.set('screenFile', screenFileName);
           testRecordingData.set('webcamFile', webcamFileName);
@@ -813,15 +816,19 @@ async function startRecording() {
     resetStateOnError();
     // showErrorModal(message = errorMessage);
   }
+}
 
-  async function sendDataBuffer() {
-    while (mediaBuffer.length > 0) {
-       const data = mediaBuffer.shift(); // Get and remove the first item from the buffer
-       console.log("Sending data to socket, data: ")
-       console.log(data)
-       await socket.send(data);
-    }
- }
+/**
+ * Sends the buffered media to the socket until the buffer is empty or the
+ * server pauses the stream.
+ */
+async function sendDataBuffer() {
+  while (mediaBuffer.length > 0 && !socketPaused) {
+     const data = mediaBuffer.shift(); // Get and remove the first item from the buffer
+     console.log("Sending data to socket, data: ")
+     console.log(data)
+     await socket.send(data);
+  }
 }
 
 /**
@@ -1311,6 +1318,7 @@ async function createWebsocket(recordWebcam, recordScreen) {
   function handleSocketOpen(socket, socketType) {
     const mediaFileName = `${testNameValue}_${filesTimestamp}_${socketType}.webm`;
     const socketMsg = `FILENAME,${mediaFileName}`;
+    socketPaused = false;
     socket.send(socketMsg);
     document.getElementById("app-status").innerHTML = "STATUS: WebSocket created.";
   }
@@ -1318,6 +1326,20 @@ async function createWebsocket(recordWebcam, recordScreen) {
   function handleSocketMessage(event) {
     const receivedMsg = event.data;
     msgRcvdFlag = true;
+    // Flow control, keep buffering locally until the server catches up
+    if (receivedMsg.startsWith("pause,")) {
+      socketPaused = true;
+      return;
+    }
+    if (receivedMsg.startsWith("resume,")) {
+      socketPaused = false;
+      // Media recorded while paused waits in the buffer, send it now
+      // rather than with the next recorded chunk
+      if (navigator.onLine && socket && socket.readyState === WebSocket.OPEN) {
+        sendDataBuffer();
+      }
+      return;
+    }
     if (receivedMsg.includes("RTMP url received: rtmp://")) {
       recordinginProgress = true;
       document.getElementById("app-status").innerHTML = "STATUS: Recording in Progress.";
@@ -22,7 +22,7 @@ import os
 import django
 from channels.routing import ProtocolTypeRouter
 from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 from . import routing
 
@@ -32,10 +32,11 @@ django.setup()
 
 
 application = ProtocolTypeRouter({
-  "http": get_asgi_application(),
-  "websocket": AuthMiddlewareStack(
+    "http": get_asgi_application(),
+    "websocket": AuthMiddlewareStack(
         URLRouter(
             routing.ws_urlpatterns
         )
-    )
+    ),
+    "channel": ChannelNameRouter(routing.channel_routes),
 })
@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path
 
-from app_websocket import consumers
+from app_websocket import consumers, ingest
 
 
 ws_urlpatterns = [
     path("ws/app/", consumers.VideoConsumer.as_asgi()),
-]
\ No newline at end of file
+]
+
+channel_routes = {
+    settings.FFMPEG_INGEST_CHANNEL: ingest.IngestWorkerConsumer.as_asgi(),
+}
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import socket
 from djongo.operations import DatabaseOperations
 from dotenv import load_dotenv
 
@@ -138,11 +139,91 @@ SOCIALACCOUNT_STORE_TOKENS = True
 WSGI_APPLICATION = 'testrecorder.wsgi.application'
 ASGI_APPLICATION = 'testrecorder.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Set CHANNEL_LAYER_REDIS_URL to share the channel layer between processes
+# and nodes, needed to run more than one `ws/app/` process or ingest workers.
+CHANNEL_LAYER_REDIS_URL = os.getenv("CHANNEL_LAYER_REDIS_URL")
+if CHANNEL_LAYER_REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [CHANNEL_LAYER_REDIS_URL],
+                # Frames are relayed through the layer, give streams some room
+                "capacity": 1500,
+                "expiry": 30,
+                "group_expiry": 86400,
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+# Stream registry (app_websocket.registry). Nodes are told apart by NODE_NAME,
+# entries of a stream expire STREAM_REGISTRY_TTL seconds after its last frame.
+NODE_NAME = os.getenv("NODE_NAME", socket.gethostname())
+STREAM_REGISTRY_TTL = 60
+
+# FFmpeg ingest (app_websocket.consumers)
+# Bytes buffered per stream before websocket reads are paused, and the level
+# the buffer has to drain back to before they resume.
+FFMPEG_QUEUE_HIGH_WATERMARK = 8 * 1024 * 1024
+FFMPEG_QUEUE_LOW_WATERMARK = 2 * 1024 * 1024
+# The client is sent "pause,<bytes>" above the high watermark and
+# "resume,<bytes>" below the low one. Once a stream has more than
+# FFMPEG_STREAM_BYTE_BUDGET bytes queued the backpressure policy applies:
+# 'block' waits for FFmpeg to catch up, 'drop' discards the oldest media up
+# to the next keyframe and 'disconnect' closes the websocket.
+FFMPEG_STREAM_BYTE_BUDGET = 32 * 1024 * 1024
+FFMPEG_BACKPRESSURE_POLICY = 'block'
+# Seconds between publishing a stream's FFmpeg progress to the cache
+FFMPEG_PROGRESS_PUBLISH_INTERVAL = 5
+# Pre-warmed FFmpeg processes (app_websocket.pool). When enabled, creating a
+# broadcast starts its FFmpeg processes before the browser sends the RTMP url.
+FFMPEG_POOL_ENABLED = False
+FFMPEG_POOL_MAX_WARM = 20
+FFMPEG_POOL_WARM_TTL = 120
+# Ingest workers (app_websocket.ingest). When enabled, the websocket process
+# only relays frames and FFmpeg runs in `manage.py runworker ffmpeg-ingest`
+# processes, which needs a channel layer shared between processes. The
+# websocket process keeps at most FFMPEG_STREAM_BYTE_BUDGET bytes in flight
+# per stream, the worker credits them back as FFmpeg takes them. The frames
+# waiting for credits, or for a worker to take the stream, are capped at
+# FFMPEG_INGEST_PENDING_BYTES, above it 'drop' discards the oldest and the
+# other policies close the websocket.
+FFMPEG_INGEST_WORKER = False
+FFMPEG_INGEST_CHANNEL = 'ffmpeg-ingest'
+FFMPEG_INGEST_PENDING_BYTES = 16 * 1024 * 1024
+# Seconds without frames before an ingest worker ends the stream
+FFMPEG_INGEST_IDLE_TIMEOUT = 30
+
+
+# Broadcast provisioning (youtube.utils.start_broadcast). Threads running the
+# YouTube calls concurrently, shared by all requests of the process.
+YOUTUBE_PROVISIONING_WORKERS = 16
+# Seconds an account's successful live streaming check is trusted
+YOUTUBE_LIVE_ENABLED_CACHE_TTL = 24 * 60 * 60
+# OAuth token refresh (refresh_youtube_tokens). Tokens of users active in the
+# last YOUTUBE_TOKEN_ACTIVE_WINDOW seconds are renewed when they expire within
+# YOUTUBE_TOKEN_REFRESH_MARGIN seconds.
+YOUTUBE_TOKEN_REFRESH_MARGIN = 10 * 60
+YOUTUBE_TOKEN_ACTIVE_WINDOW = 24 * 60 * 60
+# Pre-provisioned broadcasts (youtube.broadcast_pool). When enabled, each user
+# keeps BROADCAST_POOL_SIZE bound broadcasts ready for createbroadcast/api/,
+# unused ones are deleted after BROADCAST_POOL_TTL seconds.
+BROADCAST_POOL_ENABLED = False
+BROADCAST_POOL_SIZE = 1
+BROADCAST_POOL_TTL = 6 * 60 * 60
+# Threads loading the playlists of one LoadVideoView request concurrently
+YOUTUBE_LIBRARY_WORKERS = 8
+# Library cache (youtube.library_cache). Cached API responses are served as is
+# for LIBRARY_CACHE_FRESH_SECONDS, then revalidated with their etag, and kept
+# for LIBRARY_CACHE_TTL seconds.
+LIBRARY_CACHE_FRESH_SECONDS = 60
+LIBRARY_CACHE_TTL = 24 * 60 * 60
 
 
 # Database
@@ -232,8 +313,83 @@ STATICFILES_DIRS = [
 # Temporary files directory
 TEMP_FILES_ROOT = os.path.join(BASE_DIR, "temp")
 PERMANENT_FILES_ROOT = os.path.join(BASE_DIR, "media/UXLivingLab/UX_LIVE")
+# Saving a recording moves its files from the temporary to the permanent
+# directory, a rename only when both are on one file system. With
+# COLOCATE_TEMP_FILES the temporary files are kept in COLOCATED_TEMP_FILES_ROOT,
+# a directory on the permanent files' mount that is outside MEDIA_ROOT, so
+# unfinished uploads are never served (file_app.storage checks the layout
+# at startup).
+COLOCATE_TEMP_FILES = os.getenv("COLOCATE_TEMP_FILES", "False") == "True"
+if COLOCATE_TEMP_FILES:
+    TEMP_FILES_ROOT = os.getenv("COLOCATED_TEMP_FILES_ROOT", os.path.join(BASE_DIR, ".temp"))
+
+# Recording files are served by file_app.views_media.RecordingMediaView.
+# Set RECORDING_MEDIA_ACCEL_PREFIX to the internal nginx location aliasing
+# PERMANENT_FILES_ROOT to have nginx send the files (X-Accel-Redirect). It is
+# required when DEBUG is off, files served by Django are read on the ASGI
+# event loop and stall the websockets.
+RECORDING_MEDIA_ACCEL_PREFIX = os.getenv("RECORDING_MEDIA_ACCEL_PREFIX")
+
+# Backend saved recordings are stored with (file_app.storage),
+# file_app.storage.FileSystemRecordingStorage keeps them in
+# PERMANENT_FILES_ROOT. file_app.storage.S3RecordingStorage (needs boto3)
+# uploads them to the RECORDING_STORAGE_BUCKET bucket, of the
+# RECORDING_STORAGE_ENDPOINT_URL store for stores other than AWS (MinIO).
+# The bucket can stay private, its recordings are linked through
+# RecordingMediaView, which redirects their owners to presigned links valid
+# for RECORDING_STORAGE_URL_EXPIRY seconds (300 by default).
+RECORDING_STORAGE = os.getenv("RECORDING_STORAGE", "file_app.storage.FileSystemRecordingStorage")
+RECORDING_STORAGE_OPTIONS = {
+    option: value for option, value in {
+        'bucket': os.getenv("RECORDING_STORAGE_BUCKET"),
+        'endpoint_url': os.getenv("RECORDING_STORAGE_ENDPOINT_URL"),
+        'region_name': os.getenv("RECORDING_STORAGE_REGION"),
+        'access_key': os.getenv("RECORDING_STORAGE_ACCESS_KEY"),
+        'secret_key': os.getenv("RECORDING_STORAGE_SECRET_KEY"),
+        'url_expiry': os.getenv("RECORDING_STORAGE_URL_EXPIRY"),
+    }.items() if value is not None
+}
+
 LOGS_FILES_ROOT = os.path.join(BASE_DIR, "logs/logs.log")
 
+# Server side merge of the webcam and screen files (file_app.merge), for the
+# recordings saved without a merged file. The browser keeps merging: its
+# merged stream is the live broadcast, it sends the broadcast's YouTube link
+# as the merged file and uploads only the raw tracks. MERGE_PIP_SCALE is the
+# part of the screen's width the webcam covers. run_merge_jobs runs
+# MERGE_JOBS_PER_CORE FFmpeg jobs per CPU core, each limited to
+# MERGE_JOB_TIMEOUT seconds. Failed jobs, and jobs of workers that died, are
+# retried after MERGE_RETRY_BASE seconds, doubling up to MERGE_RETRY_MAX,
+# MERGE_MAX_ATTEMPTS times in all.
+SERVER_SIDE_MERGE = False
+MERGE_JOBS_PER_CORE = 0.5
+MERGE_JOB_TIMEOUT = 2 * 60 * 60
+MERGE_MAX_ATTEMPTS = 3
+MERGE_RETRY_BASE = 60
+MERGE_RETRY_MAX = 60 * 60
+MERGE_PIP_SCALE = 0.15
+MERGE_FFMPEG_PRESET = 'veryfast'
+MERGE_FFMPEG_CRF = 23
+MERGE_WORK_ROOT = os.path.join(TEMP_FILES_ROOT, "merge")
+
+# Resumable uploads (file_app.uploads), sessions not written to for
+# UPLOAD_SESSION_TTL seconds are removed by prune_upload_sessions
+UPLOAD_SESSIONS_ROOT = os.path.join(TEMP_FILES_ROOT, "uploads")
+# Multi-track uploads (file_app.multitrack), grouping a session per track
+UPLOAD_RECORDINGS_ROOT = os.path.join(TEMP_FILES_ROOT, "recording_uploads")
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 8 * 1024 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+# Limits of the sessions a user has open, their data files are reserved on disk
+UPLOAD_MAX_SESSIONS_PER_USER = 10
+UPLOAD_MAX_RESERVED_PER_USER = 16 * 1024 * 1024 * 1024
+
+# Raw body uploads (RawBytesView) are copied in buffers of this size. With
+# RAW_UPLOAD_SENDFILE a body the ASGI server already spooled to disk is
+# copied with os.sendfile instead (Linux).
+RAW_UPLOAD_BUFFER_SIZE = 1024 * 1024
+RAW_UPLOAD_SENDFILE = False
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -250,6 +406,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'youtube': {
+            'handlers': ['file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
 
@@ -280,6 +441,53 @@ CACHES = {
     }
 }
 
+# Dowell database outbox (file_app.outbox), drained by drain_dowell_outbox.
+# Failed deliveries are retried after DOWELL_OUTBOX_RETRY_BASE seconds,
+# doubling up to DOWELL_OUTBOX_RETRY_MAX, DOWELL_OUTBOX_MAX_ATTEMPTS times.
+# A drain claims its entries for DOWELL_OUTBOX_CLAIM_TIMEOUT seconds, the
+# entries of a drain that stopped are delivered by another one afterwards.
+DOWELL_OUTBOX_BATCH_SIZE = 50
+DOWELL_OUTBOX_CLAIM_TIMEOUT = 10 * 60
+DOWELL_OUTBOX_MAX_ATTEMPTS = 10
+DOWELL_OUTBOX_RETRY_BASE = 30
+DOWELL_OUTBOX_RETRY_MAX = 60 * 60
+
+# Event ids (core.event_ids). EVENT_ID_NODE must be unique per process
+# (0-1023) for ids to be guaranteed unique. When unset each process leases a
+# free node number in the cache for EVENT_ID_NODE_LEASE_TTL seconds, renewed
+# while it makes ids.
+EVENT_ID_NODE = os.getenv("EVENT_ID_NODE")
+EVENT_ID_NODE_LEASE_TTL = 60 * 60
+# 2023-01-01 UTC in milliseconds, ids count time from there
+EVENT_ID_EPOCH_MS = 1672531200000
+
+# External services called through core.http_client, with the (connect, read)
+# timeout of each in seconds. A service's circuit opens after
+# CIRCUIT_BREAKER_FAILURES consecutive failures and calls fail fast for
+# CIRCUIT_BREAKER_RESET_SECONDS.
+EXTERNAL_SERVICES = {
+    'dowell_connection': {
+        'url': 'http://100002.pythonanywhere.com/',
+        'timeout': (3.05, 15),
+    },
+    'event_creation': {
+        'url': 'https://100003.pythonanywhere.com/event_creation',
+        'timeout': (3.05, 10),
+    },
+}
+EXTERNAL_SERVICES_POOL_CONNECTIONS = 10
+EXTERNAL_SERVICES_POOL_MAXSIZE = 20
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# API key authentication cache (core.auth). Each process keeps up to
+# API_KEY_CACHE_SIZE keys for API_KEY_CACHE_LOCAL_TTL seconds in front of the
+# shared cache, which keeps API key -> pickled user for API_KEY_CACHE_TTL
+# seconds. Saving the user or its profile drops its key from both.
+API_KEY_CACHE_SIZE = 10000
+API_KEY_CACHE_LOCAL_TTL = 30
+API_KEY_CACHE_TTL = 24 * 60 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'core.auth.APIKeyAuthentication',
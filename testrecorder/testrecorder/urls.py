@@ -22,6 +22,8 @@ from django.conf.urls.static import static
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from file_app.views_media import RecordingMediaView
+
 ...
 
 schema_view = get_schema_view(
@@ -43,8 +45,12 @@ urlpatterns = [
     path('', include('home.urls')),
     path('file/', include('file_app.urls')),
     path('websocket/', include('app_websocket.urls')),
+    path('core/', include('core.urls')),
     path('youtube/', include('youtube.urls')),
     path('accounts/', include('allauth.urls')),
+    # Ahead of the DEBUG media files, recordings need access control
+    path('media/UXLivingLab/UX_LIVE/<path:name>', RecordingMediaView.as_view(),
+         name='recording-media'),
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0),
          name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger',
@@ -0,0 +1,175 @@
+"""
+Per-user pool of pre-provisioned broadcasts.
+
+With BROADCAST_POOL_ENABLED, StartBroadcastView takes a broadcast that is
+already bound to its stream from the user's pool instead of creating one,
+and renames it and adds it to the playlist before answering, a pooled
+broadcast that can't be prepared is deleted and a new one is created. The
+pool is refilled in the background after every take. Entries older than
+BROADCAST_POOL_TTL are deleted from YouTube and dropped from the pool.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .library_cache import PLAYLIST_ITEMS, invalidate_library
+from .utils import (
+    delete_broadcast,
+    discard_broadcast,
+    insert_video_into_playlist,
+    start_broadcast,
+    submit_step,
+    thread_http,
+    update_broadcast,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Refills and renames, kept apart from utils.provisioning_executor which
+# the refills wait on
+pool_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='broadcast-pool')
+
+# Privacy and title of broadcasts waiting in a pool
+POOLED_PRIVACY_STATUS = 'private'
+POOLED_TITLE = 'Upcoming broadcast'
+
+
+def get_pool_key(user_id: int) -> str:
+    return f'broadcast_pool{user_id}'
+
+
+@contextmanager
+def pool_lock(user_id: int, timeout: int = 5):
+    """Serializes changes to a user's pool across processes"""
+    lock_key = f'broadcast_pool_lock{user_id}'
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, 1, 30):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Broadcast pool of user {user_id} is locked')
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
+def split_expired(pool: list) -> tuple:
+    """Returns the (fresh, expired) entries of a pool"""
+    oldest = time.time() - settings.BROADCAST_POOL_TTL
+    fresh = [entry for entry in pool if entry['pooled_at'] >= oldest]
+    expired = [entry for entry in pool if entry['pooled_at'] < oldest]
+    return fresh, expired
+
+
+def take_pooled_broadcast(user_id: int):
+    """
+    Pops a ready broadcast from the user's pool.
+    Returns its stream dictionary, or None when the pool is empty.
+    """
+    try:
+        with pool_lock(user_id):
+            pool, expired = split_expired(cache.get(get_pool_key(user_id), []))
+            if not pool:
+                return None
+            stream_dict = pool.pop(0)
+            # Expired entries stay until prune_broadcast_pool deletes them
+            cache.set(get_pool_key(user_id), pool + expired, None)
+    except TimeoutError as e:
+        logger.warning(str(e))
+        return None
+
+    stream_dict.pop('pooled_at', None)
+    return stream_dict
+
+
+def prepare_pooled_broadcast(stream_dict: dict, video_privacy_status: str, test_name_value: str,
+                             playlist_id: str, youtube, credentials=None, user_id=None):
+    """
+    Renames a broadcast taken from the pool and adds it to the playlist,
+    concurrently. Returns None when both succeeded. Otherwise the broadcast
+    is deleted in the background and the error response is returned, the
+    caller creates a new broadcast.
+    """
+    timings = {}
+    video_id = stream_dict.get('new_broadcast_id')
+    steps = [submit_step(
+        timings, 'update_broadcast', update_broadcast, video_id, video_privacy_status, test_name_value,
+        youtube, credentials=credentials)]
+    if playlist_id:
+        steps.append(submit_step(
+            timings, 'insert_video_into_playlist', insert_video_into_playlist, video_id, playlist_id,
+            youtube, credentials=credentials))
+
+    error_response = None
+    for step in steps:
+        try:
+            response = step.result()
+        except Exception as e:
+            response = {'error': str(e)}
+        if 'error' in response and error_response is None:
+            error_response = response
+
+    if error_response is not None:
+        logger.error("Unable to prepare pooled broadcast %s, discarding it: %s", video_id, error_response)
+        pool_executor.submit(
+            discard_broadcast, video_id, stream_dict.get('new_stream_id'), youtube, credentials)
+        return error_response
+
+    if playlist_id and user_id:
+        # The cached playlist items don't have the new video
+        invalidate_library(user_id, PLAYLIST_ITEMS)
+    return None
+
+
+def refill_broadcast_pool(user_id: int, youtube, credentials=None) -> None:
+    """Tops the user's pool up to BROADCAST_POOL_SIZE in the background, once at a time"""
+    refill_key = f'broadcast_pool_refill{user_id}'
+    if not cache.add(refill_key, 1, 300):
+        return
+
+    def refill():
+        try:
+            prune_broadcast_pool(user_id, youtube, credentials=credentials)
+            while len(cache.get(get_pool_key(user_id), [])) < settings.BROADCAST_POOL_SIZE:
+                stream_dict = start_broadcast(
+                    POOLED_PRIVACY_STATUS, POOLED_TITLE, None, youtube,
+                    credentials=credentials, user_id=user_id)
+                if 'error' in stream_dict:
+                    logger.error("Unable to refill broadcast pool of user %s: %s", user_id, stream_dict)
+                    break
+
+                stream_dict['pooled_at'] = time.time()
+                with pool_lock(user_id):
+                    pool = cache.get(get_pool_key(user_id), [])
+                    cache.set(get_pool_key(user_id), pool + [stream_dict], None)
+        except Exception as e:
+            logger.exception("Broadcast pool refill of user %s failed: %s", user_id, e)
+        finally:
+            cache.delete(refill_key)
+
+    pool_executor.submit(refill)
+
+
+def prune_broadcast_pool(user_id: int, youtube, credentials=None) -> int:
+    """
+    Deletes the user's expired pooled broadcasts, returns how many were removed.
+    With credentials the calls use a connection of their own, as the refills
+    run on pool_executor's threads.
+    """
+    with pool_lock(user_id):
+        pool, expired = split_expired(cache.get(get_pool_key(user_id), []))
+        cache.set(get_pool_key(user_id), pool, None)
+
+    http = thread_http(credentials) if expired else None
+    for stream_dict in expired:
+        try:
+            delete_broadcast(stream_dict['new_broadcast_id'], stream_dict['new_stream_id'], youtube, http=http)
+        except Exception as e:
+            logger.warning("Unable to delete expired broadcast %s: %s", stream_dict['new_broadcast_id'], e)
+
+    return len(expired)
@@ -0,0 +1,78 @@
+"""
+Per-user cache of YouTube library responses (playlists, playlist items,
+video details).
+
+Responses are cached by user, resource and request uri. For
+LIBRARY_CACHE_FRESH_SECONDS a cached response is served as is, after that
+it is revalidated with its etag: an unchanged response comes back as
+304 Not Modified and costs no quota. The write views bump the generation
+of the resources they change, which drops the cached responses of that
+resource for the user.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from googleapiclient.errors import HttpError
+
+
+# Resources cached, and invalidated, separately
+CHANNELS = 'channels'
+PLAYLISTS = 'playlists'
+PLAYLIST_ITEMS = 'playlistItems'
+VIDEOS = 'videos'
+
+
+def get_generation_key(user_id: int, resource: str) -> str:
+    return f'library_generation_{user_id}_{resource}'
+
+
+def get_response_key(user_id: int, resource: str, uri: str) -> str:
+    generation = cache.get(get_generation_key(user_id, resource), 0)
+    uri_hash = hashlib.sha1(uri.encode()).hexdigest()
+    return f'library_{user_id}_{resource}_{generation}_{uri_hash}'
+
+
+def cached_execute(user_id: int, resource: str, request, http=None) -> dict:
+    """
+    Executes a list request of the YouTube API through the library cache.
+    Without a user the request is executed directly.
+    """
+    if user_id is None:
+        return request.execute(http=http)
+
+    cache_key = get_response_key(user_id, resource, request.uri)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if time.time() - cached['fetched_at'] < settings.LIBRARY_CACHE_FRESH_SECONDS:
+            return cached['body']
+        if cached['etag']:
+            request.headers['If-None-Match'] = cached['etag']
+
+    try:
+        response = request.execute(http=http)
+    except HttpError as err:
+        if cached is None or err.resp.status != 304:
+            raise
+        response = cached['body']
+
+    cache.set(cache_key, {
+        'etag': response.get('etag'),
+        'body': response,
+        'fetched_at': time.time(),
+    }, settings.LIBRARY_CACHE_TTL)
+
+    return response
+
+
+def invalidate_library(user_id: int, *resources: str) -> None:
+    """Drops the user's cached responses of the resources"""
+    for resource in resources:
+        generation_key = get_generation_key(user_id, resource)
+        cache.add(generation_key, 0, None)
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            # Evicted in between, any new generation will do
+            cache.set(generation_key, int(time.time()), None)
@@ -0,0 +1,58 @@
+import json
+import pickle
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from youtube.utils import build_youtube_client, get_discovery_document
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the old pickled (youtube, credentials) cache entry with "
+        "caching the token data and building the client per request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        # Dummy credentials, nothing here calls the API
+        credentials = Credentials(
+            token='token', refresh_token='refresh_token', client_id='client_id',
+            client_secret='client_secret', token_uri='https://oauth2.googleapis.com/token')
+        cache_key = f'benchmark_youtube_client_{uuid.uuid4().hex}'
+
+        def pickled_hit():
+            # The cache unpickles the resource and the credentials
+            return cache.get(cache_key)
+
+        def token_hit():
+            cached = Credentials.from_authorized_user_info(info=json.loads(cache.get(cache_key)))
+            return build_youtube_client(cached), cached
+
+        # Load the discovery document outside the timings
+        get_discovery_document()
+        try:
+            for name, value, hit in (
+                ('pickled resource',
+                 (build('youtube', 'v3', credentials=credentials, cache_discovery=False), credentials),
+                 pickled_hit),
+                ('token data', credentials.to_json(), token_hit),
+            ):
+                # Only the cache hit of a request is timed, the entry is set once
+                cache.set(cache_key, value, 60)
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    hit()
+                elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+
+                self.stdout.write(
+                    f"{name}: {elapsed_ms:.2f} ms per request, {len(pickle.dumps(value))} bytes cached")
+        finally:
+            cache.delete(cache_key)
@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from youtube.broadcast_pool import get_pool_key, prune_broadcast_pool
+from youtube.models import UserProfile
+from youtube.utils import create_user_youtube_object
+
+
+class Command(BaseCommand):
+    help = "Delete expired pre-provisioned broadcasts of every user, run it periodically"
+
+    def handle(self, *args, **options):
+        removed = 0
+        for youtube_user in UserProfile.objects.select_related('user'):
+            if not cache.get(get_pool_key(youtube_user.user_id)):
+                continue
+
+            youtube, credentials = create_user_youtube_object(scope={'user': youtube_user.user})
+            if youtube is None:
+                continue
+
+            removed += prune_broadcast_pool(youtube_user.user_id, youtube, credentials=credentials)
+
+        self.stdout.write(f"Deleted {removed} expired broadcasts")
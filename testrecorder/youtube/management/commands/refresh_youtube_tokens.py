@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from youtube.models import UserProfile
+from youtube.utils import (
+    expires_within,
+    get_cached_credentials,
+    get_user_cache_key,
+    load_user_credentials,
+    refresh_user_credentials,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Renew the OAuth tokens of active users before they expire, so requests "
+        "never wait on a refresh. Run it every few minutes or with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Seconds between runs, keeps running when set")
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh_tokens()
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh_tokens(self):
+        margin = settings.YOUTUBE_TOKEN_REFRESH_MARGIN
+        youtube_users = list(UserProfile.objects.select_related('user'))
+        active_keys = {
+            get_user_cache_key(youtube_user.user_id, 'youtube_active'): youtube_user
+            for youtube_user in youtube_users
+        }
+
+        refreshed = failed = 0
+        for active_key in cache.get_many(list(active_keys)):
+            youtube_user = active_keys[active_key]
+            credentials = get_cached_credentials(youtube_user.user_id)
+            if credentials is None:
+                credentials = load_user_credentials(youtube_user.credential)
+            if not expires_within(credentials, margin):
+                continue
+
+            try:
+                refresh_user_credentials(youtube_user.user, credentials, margin=margin)
+                refreshed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Unable to refresh the token of user {youtube_user.user_id}: {e}")
+
+        self.stdout.write(f"Refreshed {refreshed} tokens, {failed} failed")
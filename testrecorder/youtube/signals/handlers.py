@@ -1,9 +1,13 @@
 import json
 import os
+from django.conf import settings
 from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 import requests
 from ..models import UserProfile
 from allauth.account.signals import user_logged_in
+from core.auth import invalidate_api_key
+from core.http_client import ServiceUnavailable, external_services
 from django.core.cache import cache
 import datetime
 from dotenv import load_dotenv
@@ -71,15 +75,16 @@ def get_user(sender, **kwargs):
             user=user, api_key=api_key, credential=credentials)
         youtube_user.save()
 
-    db_status = is_available_in_db(user_email)
-
-    if db_status is False:
-        # print('inserting user credential into dowell database...')
-        insert_response = insert_user_credential_into_dowell_connection_db(
-            email=user_email, credential=credentials)
+    try:
+        db_status = is_available_in_db(user_email)
 
-    else:
-        pass
+        if db_status is False:
+            # print('inserting user credential into dowell database...')
+            insert_response = insert_user_credential_into_dowell_connection_db(
+                email=user_email, credential=credentials)
+    except (requests.RequestException, ServiceUnavailable) as err:
+        # The login doesn't depend on the Dowell database
+        print("Unable to save user credential in dowell database: ", err)
 
      # delete the 'oauth_data' token from the cache
     cache.delete('oauth_data')
@@ -88,6 +93,39 @@ def get_user(sender, **kwargs):
     return (kwargs['user'])
 
 
+@receiver(post_init, sender=UserProfile)
+@receiver(post_save, sender=UserProfile)
+def remember_api_key(sender, instance, **kwargs):
+    """Keeps the API key the profile was loaded or saved with"""
+    instance._saved_api_key = instance.api_key
+
+
+@receiver(pre_save, sender=UserProfile)
+def invalidate_regenerated_api_key(sender, instance, update_fields=None, **kwargs):
+    """Drops the cached user of an API key that is being replaced"""
+    if instance.pk is None or (update_fields is not None and 'api_key' not in update_fields):
+        return
+
+    old_api_key = getattr(instance, '_saved_api_key', None)
+    if old_api_key != instance.api_key:
+        invalidate_api_key(old_api_key)
+
+
+@receiver(post_delete, sender=UserProfile)
+def invalidate_deleted_api_key(sender, instance, **kwargs):
+    """Drops the cached user of a deleted profile's API key"""
+    invalidate_api_key(instance.api_key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_changed_user_api_key(sender, instance, created, **kwargs):
+    """Drops the cached copy of a changed user, deactivated users stop authenticating"""
+    if created:
+        return
+    for api_key in UserProfile.objects.filter(user=instance).values_list('api_key', flat=True):
+        invalidate_api_key(api_key)
+
+
 def is_available_in_db(email) -> bool:
     """
     Checks if record already exist in the database'
@@ -96,8 +134,6 @@ def is_available_in_db(email) -> bool:
         True: If record exist in the database.
         False: If record is not in the database.
     """
-    url = "http://100002.pythonanywhere.com/"
-
     payload = json.dumps({
         "cluster": "ux_live",
         "database": "ux_live",
@@ -118,8 +154,8 @@ def is_available_in_db(email) -> bool:
         'Content-Type': 'application/json'
     }
 
-    response = requests.request(
-        "POST", url, headers=headers, data=payload).json()
+    response = external_services.request(
+        'dowell_connection', headers=headers, data=payload).json()
 
     if response.get('data') is None:
         return False
@@ -136,8 +172,6 @@ def insert_user_credential_into_dowell_connection_db(email, credential):
         Json response from the database.
     """
 
-    url = "http://100002.pythonanywhere.com/"
-
     payload = json.dumps({
         "cluster": "ux_live",
         "database": "ux_live",
@@ -159,7 +193,7 @@ def insert_user_credential_into_dowell_connection_db(email, credential):
         'Content-Type': 'application/json'
     }
 
-    response = requests.request(
-        "POST", url, headers=headers, data=payload).json()
+    response = external_services.request(
+        'dowell_connection', headers=headers, data=payload).json()
     # print('=== Insert Response ===> ',response)
     return response
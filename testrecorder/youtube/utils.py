@@ -1,84 +1,193 @@
+import functools
 import json
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httplib2
+from django.conf import settings
 from django.core.cache import cache
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
 from google.oauth2.credentials import Credentials
+from .library_cache import PLAYLIST_ITEMS, invalidate_library
 from .models import UserProfile
 from datetime import datetime, timedelta
 
 
+logger = logging.getLogger(__name__)
+
+# Users marked active by this process, see mark_user_active
+active_users_marked = {}
+ACTIVE_MARK_INTERVAL = 5 * 60
+
+# Runs the independent YouTube calls of start_broadcast concurrently
+provisioning_executor = ThreadPoolExecutor(
+    max_workers=settings.YOUTUBE_PROVISIONING_WORKERS,
+    thread_name_prefix='youtube-provisioning')
+
+
 def get_user_cache_key(user_id: int, view_url: str) -> str:
     return f'user_{user_id}_view_{view_url}'
 
 
+@functools.lru_cache(maxsize=None)
+def get_discovery_document(service_name: str = 'youtube', version: str = 'v3') -> str:
+    """
+    The API's discovery document, read once per process from the copy
+    shipped with google-api-python-client. It is kept as JSON text, as
+    build_from_document changes the parsed document in place, each client
+    parses a copy of its own.
+    """
+    return discovery_cache.get_static_doc(service_name, version)
+
+
+def build_youtube_client(credentials):
+    """A YouTube v3 client bound to the credentials, cheap enough to create per request"""
+    return build_from_document(get_discovery_document(), credentials=credentials)
+
+
+def load_user_credentials(credentials_data) -> Credentials:
+    """Credentials from the UserProfile credential field"""
+    try:
+        # Convert the JSON string to a dictionary
+        credentials_data_dict = json.loads(credentials_data)
+        # Create credentials from the dictionary
+        return Credentials.from_authorized_user_info(info=credentials_data_dict)
+    except Exception as e:
+        return Credentials.from_authorized_user_info(info=credentials_data)
+
+
+def get_cached_credentials(user_id: int):
+    """The user's credentials from the cached token data, None if not cached"""
+    try:
+        credentials_json = cache.get(get_user_cache_key(user_id, 'youtube_credentials'))
+        if credentials_json:
+            return Credentials.from_authorized_user_info(info=json.loads(credentials_json))
+    except Exception:
+        pass
+    return None
+
+
+def cache_credentials(user_id: int, credentials) -> None:
+    """Cache the credentials' token data"""
+    cache.set(get_user_cache_key(user_id, 'youtube_credentials'), credentials.to_json(), 86400)
+
+
+def expires_within(credentials, seconds: int) -> bool:
+    """Checks if the access token expires in the next seconds, tokens without expiry never do"""
+    if credentials.expiry is None:
+        return False
+
+    return credentials.expiry - datetime.utcnow() < timedelta(seconds=seconds)
+
+
+def mark_user_active(user_id: int) -> None:
+    """
+    Marks the user for refresh_youtube_tokens, which keeps the tokens of
+    recently active users fresh. Written at most every few minutes per process.
+    """
+    now = time.monotonic()
+    if now - active_users_marked.get(user_id, -ACTIVE_MARK_INTERVAL) < ACTIVE_MARK_INTERVAL:
+        return
+
+    active_users_marked[user_id] = now
+    cache.set(get_user_cache_key(user_id, 'youtube_active'), 1, settings.YOUTUBE_TOKEN_ACTIVE_WINDOW)
+
+
+def wait_for_refresh(lock_key: str, timeout: float = 10) -> None:
+    """Waits for another process' token refresh to release its lock, polling with backoff"""
+    delay = 0.05
+    deadline = time.monotonic() + timeout
+    while cache.get(lock_key) is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 1)
+
+
+def refresh_user_credentials(user, credentials, margin: int = 0):
+    """
+    Refreshes the user's access token, once at a time across processes.
+    A caller that finds a refresh in progress waits for it and uses its
+    token, or refreshes itself when that refresh failed or is stuck.
+    Tokens still valid for margin seconds are not refreshed.
+    """
+    lock_key = get_user_cache_key(user.id, 'youtube_token_refresh')
+    locked = cache.add(lock_key, 1, 30)
+    if not locked:
+        wait_for_refresh(lock_key)
+        cached_credentials = get_cached_credentials(user.id)
+        if cached_credentials is not None and not expires_within(cached_credentials, margin):
+            return cached_credentials
+        locked = cache.add(lock_key, 1, 30)
+
+    try:
+        # Another process may have refreshed it since it was read
+        cached_credentials = get_cached_credentials(user.id)
+        if cached_credentials is not None and not expires_within(cached_credentials, margin):
+            return cached_credentials
+
+        # Import the modules required to refresh the access token
+        import google.auth.transport.requests
+
+        # Refresh the access token using the refresh token
+        credentials.refresh(google.auth.transport.requests.Request())
+
+        # Update the stored credential data with the refreshed token
+        youtube_user = UserProfile.objects.get(user=user)
+        youtube_user.credential = credentials.to_json()
+        youtube_user.save()
+        cache_credentials(user.id, credentials)
+
+        return credentials
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
 def create_user_youtube_object(request=None, scope=None) -> tuple:
     """
     Create a YouTube object using the v3 version of the API and
     the authenticated user's credentials.
+    Only the credentials' token data is cached, the client is built
+    from the process' discovery document on every call. Tokens are
+    normally renewed ahead of expiry by refresh_youtube_tokens.
     """
-    # #print('Creating youtube object...')
     try:
         if request is not None:
             user = request.user
         elif scope is not None:
             user = scope.get('user')
 
-        try:
-            cache_key = get_user_cache_key(
-                user.id, 'youtube_credenial_object')
-            youtube, credentials = cache.get(cache_key)
-
-            if youtube and credentials:
-                return youtube, credentials
-        except Exception:
-            pass
-
-        # Retrieve the UserProfile object associated with the authenticated user
-        youtube_user = UserProfile.objects.get(user=user)
+        mark_user_active(user.id)
+        credentials = get_cached_credentials(user.id)
+        if credentials is None:
+            # Retrieve the UserProfile object associated with the authenticated user
+            youtube_user = UserProfile.objects.get(user=user)
+            # Retrieve the user's credentials associated with the UserProfile object
+            credentials = load_user_credentials(youtube_user.credential)
+            cache_credentials(user.id, credentials)
 
-        # Retrieve the user's credentials associated with the UserProfile object
-        credentials_data = youtube_user.credential
-        try:
-            # Convert the JSON string to a dictionary
-            credentials_data_dict = json.loads(credentials_data)
-            # Create credentials from the dictionary
-            credentials = Credentials.from_authorized_user_info(
-                info=credentials_data_dict)
-        except Exception as e:
-            credentials = Credentials.from_authorized_user_info(
-                info=credentials_data)
         try:
             # Check if the access token has expired
             if credentials.expired:
-                # Import the modules required to refresh the access token
-                import google.auth.transport.requests
-
-                # Create a request object using the credentials
-                google_request = google.auth.transport.requests.Request()
-
-                # Refresh the access token using the refresh token
-                credentials.refresh(google_request)
-
-                # Update the stored credential data with the refreshed token
-                youtube_user.credential = credentials.to_json()
-                youtube_user.save()
+                credentials = refresh_user_credentials(user, credentials)
         except Exception as e:
             # Handle any error that occurred while refreshing the access token
             return None, None
 
         # Create a YouTube object using the v3 version of the API and the retrieved credentials
-        youtube = build('youtube', 'v3', credentials=credentials,
-                        cache_discovery=False)
-
-        if cache_key:
-            # Cache the youtube object
-            cache.set(cache_key, (youtube, credentials), 86400)
+        youtube = build_youtube_client(credentials)
 
         return youtube, credentials
     except UserProfile.DoesNotExist:
         return None, None
 
 
-def insert_broadcast(video_privacy_status: str, test_name_value: str, youtube) -> str:
+def insert_broadcast(video_privacy_status: str, test_name_value: str, youtube, http=None) -> str:
     """
     Creates a liveBroadcast resource and sets its title, scheduled start time,
     scheduled end time, and privacy status.
@@ -108,14 +217,14 @@ def insert_broadcast(video_privacy_status: str, test_name_value: str, youtube) -
             }
         )
 
-        insert_broadcast_response = request.execute()
+        insert_broadcast_response = request.execute(http=http)
         return insert_broadcast_response.get("id", None)
 
     except Exception as e:
         raise Exception(e.reason)
 
 
-def insert_stream(youtube) -> dict:
+def insert_stream(youtube, http=None) -> dict:
     """
     Creates a new live stream on YouTube and returns information about the stream.
     Args:
@@ -143,7 +252,7 @@ def insert_stream(youtube) -> dict:
             }
         )
 
-        insert_stream_response = request.execute()
+        insert_stream_response = request.execute(http=http)
 
         snippet = insert_stream_response.get("snippet", {})
         cdn = insert_stream_response.get("cdn", {})
@@ -167,7 +276,7 @@ def insert_stream(youtube) -> dict:
         raise Exception(e.reason)
 
 
-def bind_broadcast(youtube, broadcast_id: str, stream_id: str) -> dict:
+def bind_broadcast(youtube, broadcast_id: str, stream_id: str, http=None) -> dict:
     """
         Binds the broadcast to the video stream. By doing so, you link the video that
         you will transmit to YouTube to the broadcast that the video is for.
@@ -179,13 +288,57 @@ def bind_broadcast(youtube, broadcast_id: str, stream_id: str) -> dict:
             streamId=stream_id
         )
 
-        bind_broadcast_response = request.execute()
+        bind_broadcast_response = request.execute(http=http)
 
         return bind_broadcast_response
     except Exception as e:
         raise Exception(e.reason)
 
 
+def update_broadcast(broadcast_id: str, video_privacy_status: str, test_name_value: str, youtube,
+                     http=None) -> dict:
+    """Renames a broadcast and sets its privacy status, used for pre-provisioned broadcasts"""
+    time_now = datetime.utcnow()
+    future_date_iso = (time_now + timedelta(seconds=1)).isoformat()
+
+    try:
+        request = youtube.liveBroadcasts().update(
+            part="snippet,status",
+            body={
+                "id": broadcast_id,
+                "status": {
+                    "privacyStatus": video_privacy_status,
+                    "selfDeclaredMadeForKids": False
+                },
+                "snippet": {
+                    "scheduledStartTime": future_date_iso,
+                    "title": f"{test_name_value} {future_date_iso}"
+                },
+            }
+        )
+
+        return request.execute(http=http)
+    except Exception as e:
+        return {'error': getattr(e, 'reason', str(e))}
+
+
+def delete_broadcast(broadcast_id: str, stream_id: str, youtube, http=None) -> None:
+    """Deletes an unused broadcast and its stream, either id may be None"""
+    if broadcast_id:
+        youtube.liveBroadcasts().delete(id=broadcast_id).execute(http=http)
+    if stream_id:
+        youtube.liveStreams().delete(id=stream_id).execute(http=http)
+
+
+def discard_broadcast(broadcast_id: str, stream_id: str, youtube, credentials=None) -> None:
+    """Deletes what a failed start_broadcast created, so it doesn't count against the quota"""
+    try:
+        delete_broadcast(broadcast_id, stream_id, youtube, http=thread_http(credentials))
+    except Exception as e:
+        logger.error("Unable to delete broadcast %s and stream %s: %s", broadcast_id, stream_id,
+                     getattr(e, 'reason', e))
+
+
 def transition_broadcast(broadcast_id: str, status: str, youtube=None, scope=None) -> dict:
     """Handles requests to transition a broadcast to the 'complete' status"""
     if scope:
@@ -212,49 +365,7 @@ def transition_broadcast(broadcast_id: str, status: str, youtube=None, scope=Non
         return {'error': e.reason}
 
 
-def create_broadcast(video_privacy_status: str, test_name_value: str, youtube) -> dict:
-    """
-    Creates a broadcast with a live stream bound
-    """
-    stream_dict = {}
-    try:
-        # Check if the user's account has live streaming enabled
-        list_response = youtube.liveBroadcasts().list(
-            part='id,snippet,contentDetails,status',
-            mine=True
-        ).execute()
-
-        if list_response.get('items', [{}]) == [{}]:
-            return {'error': 'Live streaming is not enabled for this account'}
-
-        try:
-            # Create a new broadcast
-            new_broadcast_id = insert_broadcast(video_privacy_status, test_name_value, youtube)
-        except Exception as e:
-            return {'error': str(e)}
-
-        try:
-            # Create a new stream
-            stream_dict = insert_stream(youtube)
-            # Add the new broadcast id to the stream dictionary
-            stream_dict['new_broadcast_id'] = new_broadcast_id
-            stream_id = stream_dict.get('new_stream_id')
-        except Exception as e:
-            return {'error': str(e)}
-
-        try:
-            # Bind the stream to the broadcast
-            bind_broadcast(youtube, new_broadcast_id, stream_id)
-        except Exception as e:
-            return {'error': str(e)}
-        
-        return stream_dict
-
-    except Exception as e:
-        return {'error': str(e)}
-
-
-def insert_video_into_playlist(video_id: str, playlist_id: str, youtube) -> dict:
+def insert_video_into_playlist(video_id: str, playlist_id: str, youtube, http=None) -> dict:
     """Inserts a video into a YouTube channel playlist"""
 
     try:
@@ -274,28 +385,140 @@ def insert_video_into_playlist(video_id: str, playlist_id: str, youtube) -> dict
         request = youtube.playlistItems().insert(
             part="snippet", body=insert_request_body
         )
-        response = request.execute()
+        response = request.execute(http=http)
 
         return response
     except Exception as e:
         return {'error': (e.reason)}
 
 
-def start_broadcast(video_privacy_status: str, test_name_value: str, playlist_id: str, youtube) -> dict:
-    """ Start recording a video """
-    # Create a new broadcast and retrieve the broadcast id
-    stream_dict = create_broadcast(
-        video_privacy_status, test_name_value, youtube)
+def is_live_streaming_enabled(youtube, http=None) -> bool:
+    """Checks if the user's account has live streaming enabled"""
+    list_response = youtube.liveBroadcasts().list(
+        part='id',
+        mine=True,
+        maxResults=1
+    ).execute(http=http)
+
+    return list_response.get('items', [{}]) != [{}]
 
-    if 'error'  not in stream_dict:
-        # Insert the video into the playlist
-        video_id = stream_dict.get('new_broadcast_id')
 
-        playlist_insert_response = insert_video_into_playlist(video_id, playlist_id, youtube)
+def run_step(timings: dict, name: str, func, *args, **kwargs):
+    """Runs one provisioning step and records its latency in ms"""
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000)
 
-        if 'error' in playlist_insert_response:
-            return playlist_insert_response
 
-        return stream_dict
-    else:
-        return stream_dict
+def thread_http(credentials):
+    """
+    A connection of its own for a thread, httplib2 connections can't be
+    shared between threads. None without credentials.
+    """
+    if credentials is None:
+        return None
+
+    return AuthorizedHttp(credentials, http=httplib2.Http())
+
+
+def submit_step(timings: dict, name: str, func, *args, credentials=None) -> Future:
+    """
+    Runs a provisioning step on the executor with its own connection.
+    Without credentials the step runs inline on the youtube object's connection.
+    """
+    if credentials is not None:
+        return provisioning_executor.submit(
+            run_step, timings, name, func, *args, http=thread_http(credentials))
+
+    future = Future()
+    try:
+        future.set_result(run_step(timings, name, func, *args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def start_broadcast(video_privacy_status: str, test_name_value: str, playlist_id: str, youtube,
+                    credentials=None, user_id=None) -> dict:
+    """
+    Start recording a video.
+    The live streaming check, broadcast insert and stream insert run
+    concurrently, then the bind and playlist insert. An enabled live
+    streaming check is cached per user. Without a playlist_id the video
+    is not added to any playlist. The broadcast and stream of a failed
+    start are deleted.
+    """
+    timings = {}
+    started = time.perf_counter()
+    live_enabled_key = get_user_cache_key(user_id, 'live_streaming_enabled') if user_id else None
+
+    steps = {}
+    if live_enabled_key is None or not cache.get(live_enabled_key):
+        steps['live_check'] = submit_step(
+            timings, 'live_check', is_live_streaming_enabled, youtube, credentials=credentials)
+    steps['insert_broadcast'] = submit_step(
+        timings, 'insert_broadcast', insert_broadcast, video_privacy_status, test_name_value, youtube,
+        credentials=credentials)
+    steps['insert_stream'] = submit_step(
+        timings, 'insert_stream', insert_stream, youtube, credentials=credentials)
+
+    results = {}
+    errors = []
+    for name, step in steps.items():
+        try:
+            results[name] = step.result()
+        except Exception as e:
+            errors.append(str(e))
+
+    stream_dict = results.get('insert_stream', {})
+    video_id = results.get('insert_broadcast')
+    stream_id = stream_dict.get('new_stream_id')
+
+    # The inserts ran alongside the check, what they created is deleted
+    # when the broadcast can't be used
+    if results.get('live_check') is False:
+        discard_broadcast(video_id, stream_id, youtube, credentials)
+        return {'error': 'Live streaming is not enabled for this account'}
+    if errors:
+        discard_broadcast(video_id, stream_id, youtube, credentials)
+        return {'error': errors[0]}
+    if live_enabled_key is not None:
+        cache.set(live_enabled_key, True, settings.YOUTUBE_LIVE_ENABLED_CACHE_TTL)
+
+    # Add the new broadcast id to the stream dictionary
+    stream_dict['new_broadcast_id'] = video_id
+
+    # Bind the stream to the broadcast and insert the video into the playlist
+    bind_step = submit_step(
+        timings, 'bind_broadcast', bind_broadcast, youtube, video_id, stream_id,
+        credentials=credentials)
+    playlist_step = None
+    if playlist_id:
+        playlist_step = submit_step(
+            timings, 'insert_video_into_playlist', insert_video_into_playlist, video_id, playlist_id, youtube,
+            credentials=credentials)
+
+    error_response = None
+    try:
+        bind_step.result()
+    except Exception as e:
+        error_response = {'error': str(e)}
+
+    if playlist_step is not None:
+        playlist_insert_response = playlist_step.result()
+        if 'error' in playlist_insert_response and error_response is None:
+            error_response = playlist_insert_response
+
+    if error_response is not None:
+        discard_broadcast(video_id, stream_id, youtube, credentials)
+        return error_response
+    if playlist_step is not None and user_id:
+        # The cached playlist items don't have the new video
+        invalidate_library(user_id, PLAYLIST_ITEMS)
+
+    logger.info("Broadcast %s provisioned in %s ms, steps: %s", video_id,
+                round((time.perf_counter() - started) * 1000), timings)
+
+    return stream_dict
@@ -1,4 +1,5 @@
 import logging
+from django.conf import settings
 from django.core.cache import cache
 from django.shortcuts import redirect
 from rest_framework.response import Response
@@ -9,7 +10,14 @@ from googleapiclient.errors import HttpError
 from django.contrib.auth import logout
 from rest_framework.decorators import authentication_classes
 
+from app_websocket.pool import prewarm_stream
 from core.auth import APIKeyAuthentication
+from .library_cache import PLAYLISTS, cached_execute, invalidate_library
+from .broadcast_pool import (
+    prepare_pooled_broadcast,
+    refill_broadcast_pool,
+    take_pooled_broadcast,
+)
 from .serializers import (
     StartBroadcastSerializer,
     TransitionBroadcastSerializer,
@@ -40,12 +48,25 @@ class StartBroadcastView(APIView):
             test_name_value = serializer.validated_data["video_title"]
             playlist_id = serializer.validated_data["playlist_id"]
 
-            youtube, _ = create_user_youtube_object(request=request)
+            youtube, credentials = create_user_youtube_object(request=request)
 
             if youtube is None:
                 return Response({'Error': 'Account is not a Google account'}, status=status.HTTP_401_UNAUTHORIZED)
 
-            stream_dict = start_broadcast(video_privacy_status, test_name_value, playlist_id, youtube)
+            stream_dict = None
+            if settings.BROADCAST_POOL_ENABLED:
+                # A ready broadcast is renamed and added to the playlist, a
+                # new one is created if that fails
+                stream_dict = take_pooled_broadcast(request.user.id)
+                if stream_dict is not None and prepare_pooled_broadcast(
+                        stream_dict, video_privacy_status, test_name_value, playlist_id,
+                        youtube, credentials=credentials, user_id=request.user.id) is not None:
+                    stream_dict = None
+                refill_broadcast_pool(request.user.id, youtube, credentials=credentials)
+
+            if stream_dict is None:
+                stream_dict = start_broadcast(video_privacy_status, test_name_value, playlist_id, youtube,
+                                              credentials=credentials, user_id=request.user.id)
 
             if "error" in stream_dict:
                 return Response(stream_dict, status=status.HTTP_400_BAD_REQUEST)
@@ -53,6 +74,9 @@ class StartBroadcastView(APIView):
             # Cache the stream dictionary, manually deleted in the consumer after transitioning
             cache.set(f'stream_dict{request.user.id}', stream_dict, 6 * 60 * 60)
 
+            # Start FFmpeg while the response travels back to the browser
+            prewarm_stream(request.user.id, stream_dict.get('new_rtmp_url'))
+
             return Response(stream_dict, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -84,10 +108,11 @@ class TransitionBroadcastView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-def fetch_playlists_with_pagination(youtube_object):
+def fetch_playlists_with_pagination(youtube_object, user_id=None):
     """
     Fetches playlists with the help of pagination
     :param youtube_object: Object for accessing YouTube API
+    :param user_id: Id of the user whose library cache is used, if any
     :return: List of fetched playlists
     """
     fetch_playlists = True
@@ -101,7 +126,7 @@ def fetch_playlists_with_pagination(youtube_object):
             mine=True,
             pageToken=page_token
         )
-        response = request.execute()
+        response = cached_execute(user_id, PLAYLISTS, request)
 
         if "nextPageToken" in response:
             page_token = response['nextPageToken']
@@ -123,7 +148,7 @@ def fetch_and_add_playlist_to_cache(request, cache_key):
         return Response({'Error': 'Authentication error'}, status=status.HTTP_401_UNAUTHORIZED)
 
     # Get the playlists
-    playlists = fetch_playlists_with_pagination(youtube)
+    playlists = fetch_playlists_with_pagination(youtube, request.user.id)
 
     # Check if the playlist is empty
     if not playlists:
@@ -192,7 +217,7 @@ def create_playlist(playlist_title, playlist_description, playlist_privacy_statu
             return Response({'Error': 'Account is not a Google account'}, status=status.HTTP_401_UNAUTHORIZED)
 
         # Check if a playlist with provided title exists
-        playlists = fetch_playlists_with_pagination(youtube)
+        playlists = fetch_playlists_with_pagination(youtube, request.user.id)
         for playlist in playlists:
             title = playlist["snippet"]["title"]
             if playlist_title.lower() == title.lower():
@@ -246,6 +271,7 @@ class CreatePlaylistView(APIView):
                 user = request.user
 
                 # Fetch and add new playlists to cache.
+                invalidate_library(user.id, PLAYLISTS)
                 cache_key = get_user_cache_key(user.id, '/fetchplaylists/api/')
                 fetch_and_add_playlist_to_cache(request, cache_key)
 
@@ -10,18 +10,42 @@ from rest_framework.renderers import JSONRenderer
 from googleapiclient.errors import HttpError
 from .views_w import *
 
+from .library_cache import PLAYLIST_ITEMS, PLAYLISTS, VIDEOS, cached_execute, invalidate_library
 from .utils import create_user_youtube_object
 
 
 logger = logging.getLogger(__name__)
 
+# Most ids videos().list accepts in one call
+VIDEOS_LIST_MAX_IDS = 50
+
+
+def fetch_video_details(youtube, video_ids, user_id=None):
+    """
+    Fetch contentDetails and status of the videos in calls of up to
+    VIDEOS_LIST_MAX_IDS ids. Returns a dictionary of the video items by id,
+    videos YouTube does not return are left out.
+    """
+    video_details = {}
+    for start in range(0, len(video_ids), VIDEOS_LIST_MAX_IDS):
+        video_response = cached_execute(user_id, VIDEOS, youtube.videos().list(
+            part='contentDetails,status',
+            # maxResults isn't allowed with id, the ids bound the results
+            id=','.join(video_ids[start:start + VIDEOS_LIST_MAX_IDS])
+        ))
+        for video_item in video_response.get('items', []):
+            video_details[video_item['id']] = video_item
+
+    return video_details
+
 
 class FetchlibraryPlaylists(APIView):
     renderer_classes = [JSONRenderer]
 
     def get(self, request, *args, **kwargs):
         try:
-            youtube = create_user_youtube_object(request)
+            user_id = request.user.id
+            youtube, _ = create_user_youtube_object(request)
             if youtube is None:
                 raise AttributeError('youtube object creation failed!!')
 
@@ -36,7 +60,7 @@ class FetchlibraryPlaylists(APIView):
                     mine=True,
                     pageToken=page_token
                 )
-                response = request.execute()
+                response = cached_execute(user_id, PLAYLISTS, request)
                 # Get next page token
                 if "nextPageToken" in response.keys():
                     page_token = response['nextPageToken']
@@ -116,16 +140,16 @@ class SelectedPlaylistLoadVideo(APIView):
             Exception: If an error occurs during the loading process.
         """
         try:
-            youtube = create_user_youtube_object(request)
+            youtube, _ = create_user_youtube_object(request)
             if youtube is None:
                 raise AttributeError('youtube object creation failed!!')
 
             # Perform the YouTube API call to retrieve videos for the specified playlistId
-            playlist_items_response = youtube.playlistItems().list(
+            playlist_items_response = cached_execute(request.user.id, PLAYLIST_ITEMS, youtube.playlistItems().list(
                 part='snippet',
                 playlistId=playlistId,
                 maxResults=50
-            ).execute()
+            ))
             playlist_videos = playlist_items_response.get('items', [])
 
             videos = []
@@ -152,33 +176,33 @@ class SelectedPlaylistLoadVideo(APIView):
                 videoDescription = videoItem.get(
                     'snippet', {}).get('description', '')
 
-                try:
-                    video_response = youtube.videos().list(
-                        part='contentDetails, status',
-                        id=videoId
-                    ).execute()
-                    video_info = video_response.get('items', [])[0]
-                    privacyStatus = video_info.get(
-                        'status', {}).get('privacyStatus', 'Unknown')
-                    duration = video_info.get(
-                        'contentDetails', {}).get('duration', '00:00')
-                except HttpError as e:
-                    privacyStatus = 'Unknown'
-                    duration = '00:00'
-
                 video_info = {
                     'videoId': videoId,
                     'videoTitle': videoTitle,
                     'videoThumbnail': videoThumbnail,
                     'videoDescription': videoDescription,
-                    'privacyStatus': privacyStatus,
-                    'duration': duration,
+                    'privacyStatus': 'Unknown',
+                    'duration': '00:00',
                 }
                 videos.append(video_info)
 
-                playlist_details = {
-                    'playlist_videos': videos
-                }
+            # Details of all the page's videos in one call instead of one per video
+            try:
+                video_details = fetch_video_details(
+                    youtube, [video['videoId'] for video in videos], user_id=request.user.id)
+            except HttpError as e:
+                video_details = {}
+
+            for video_info in videos:
+                video_item = video_details.get(video_info['videoId'], {})
+                video_info['privacyStatus'] = video_item.get(
+                    'status', {}).get('privacyStatus', 'Unknown')
+                video_info['duration'] = video_item.get(
+                    'contentDetails', {}).get('duration', '00:00')
+
+            playlist_details = {
+                'playlist_videos': videos
+            }
 
             return Response(playlist_details, status=status.HTTP_200_OK)
         except Exception as e:
@@ -195,12 +219,13 @@ class RateVideoView(APIView):
             if rating not in ['like', 'dislike']:
                 raise ValueError('Invalid rating value')
 
-            youtube = create_user_youtube_object(request)
+            youtube, _ = create_user_youtube_object(request)
             if youtube is None:
                 raise AttributeError('youtube object creation failed!!')
 
             # Perform the YouTube API call to rate the video
             youtube.videos().rate(id=videoId, rating=rating).execute()
+            invalidate_library(request.user.id, VIDEOS)
 
             return Response({'message': f'Video {rating}d successfully.'}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -3,7 +3,9 @@ Second views file for the YouTube app.
 """
 import json
 import logging
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.core.cache import cache
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
@@ -15,7 +17,9 @@ from rest_framework.decorators import authentication_classes
 
 from .models import ChannelRecord
 from core.auth import APIKeyAuthentication
-from .utils import get_user_cache_key, create_user_youtube_object
+from core.http_client import external_services
+from .library_cache import CHANNELS, PLAYLIST_ITEMS, PLAYLISTS, VIDEOS, cached_execute, invalidate_library
+from .utils import get_user_cache_key, create_user_youtube_object, thread_http
 
 
 logger = logging.getLogger(__name__)
@@ -135,8 +139,6 @@ class UserChannelsView(APIView):
             True: If record exist in the database.
             False: If record is not in the database.
         """
-        url = "http://100002.pythonanywhere.com/"
-
         payload = json.dumps({
             "cluster": "ux_live",
             "database": "ux_live",
@@ -157,8 +159,8 @@ class UserChannelsView(APIView):
             'Content-Type': 'application/json'
         }
 
-        response = requests.request(
-            "POST", url, headers=headers, data=payload).json()
+        response = external_services.request(
+            'dowell_connection', headers=headers, data=payload).json()
 
         if response.get('data') is None:
             return False
@@ -173,8 +175,6 @@ class UserChannelsView(APIView):
             Json response from the database.
         """
 
-        url = "http://100002.pythonanywhere.com/"
-
         payload = json.dumps({
             "cluster": "ux_live",
             "database": "ux_live",
@@ -195,8 +195,8 @@ class UserChannelsView(APIView):
             'Content-Type': 'application/json'
         }
 
-        response = requests.request(
-            "POST", url, headers=headers, data=payload).json()
+        response = external_services.request(
+            'dowell_connection', headers=headers, data=payload).json()
 
         return response
 
@@ -252,6 +252,8 @@ class DeleteVideoView(APIView):
             # Delete the video using the video ID
             # If successful, this method returns an HTTP 204 response code (No Content).
             response = youtube.videos().delete(id=video_id).execute()
+            # The video may be in any playlist
+            invalidate_library(request.user.id, PLAYLIST_ITEMS, VIDEOS)
             return Response({'message': "Video deleted successfully", 'response': response}, status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
             return Response({'Error': str(e)})
@@ -292,63 +294,96 @@ class LoadVideoView(APIView):
                 return Response({'Error': 'Account is not a Google account'}, status=status.HTTP_401_UNAUTHORIZED)
         
             # Perform the YouTube Channels API call
-            channels_response = youtube.channels().list(
+            channels_response = cached_execute(request.user.id, CHANNELS, youtube.channels().list(
                 part='contentDetails',
                 mine=True
-            ).execute()
+            ))
 
             channels = channels_response.get('items', [])
-            if channels:
-                channel_id = channels[0]['id']
-
-                # Retrieve videos from each playlist
-                playlists_response = youtube.playlists().list(
-                    part='snippet,contentDetails',
-                    channelId=channel_id,
-                    maxResults=50
-                ).execute()
-
-                playlists = playlists_response.get('items', [])
-                videos = []
-
-                for playlist in playlists:
-                    temp_playlist = {}
-                    video = {}
-
-                    temp_playlist['playlistTitle'] = playlist['snippet']['title']
-                    temp_playlist['playlistId'] = playlist['id']
-
-                    playlist_id = playlist['id']
-                    playlist_items_response = youtube.playlistItems().list(
-                        part='snippet',
-                        playlistId=playlist_id,
-                        maxResults=50
-                    ).execute()
-
-                    playlist_videos = playlist_items_response.get('items', [])
-
-                    video = [
-                        {
-                            'videoId': videoItem['snippet']['resourceId']['videoId'],
-                            'videoTitle': videoItem['snippet']['title'],
-                            'videoThumbnail': videoItem['snippet']['thumbnails'].get('default', {}).get('url', 'No Thumbnail Available'),
-                            'videoDescription': videoItem['snippet']['description'],
-                        } for videoItem in playlist_videos
-                        if videoItem['snippet']['title'] != 'Deleted video'
-
-                    ]
-
-                    temp_playlist['videos'] = video  # playlist_videos
-
-                    videos.append(temp_playlist)
-            else:
+            if not channels:
                 # Handle case when no channels are found
-                videos = []
-
-            return Response(videos, status=status.HTTP_200_OK)
+                return Response([], status=status.HTTP_200_OK)
+
+            playlists = fetch_all_pages(
+                youtube.playlists(),
+                user_id=request.user.id,
+                resource=PLAYLISTS,
+                part='snippet,contentDetails',
+                channelId=channels[0]['id'],
+                maxResults=50
+            )
         except Exception as e:
             return Response({'Error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
+        # Loaded in this thread, the ASGI handler would iterate a streamed
+        # response in the event loop and block it
+        library = load_library(youtube, credential, playlists, request.user.id)
+        return Response(library, status=status.HTTP_200_OK)
+
+
+def fetch_all_pages(collection, http=None, user_id=None, resource=None, **kwargs):
+    """Returns the items of every page of a list request, through the user's library cache"""
+    items = []
+    page_token = None
+    while True:
+        response = cached_execute(user_id, resource, collection.list(pageToken=page_token, **kwargs), http=http)
+        items.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def load_playlist(youtube, credential, playlist, user_id=None):
+    """Loads all the videos of a playlist, run on a worker thread with its own connection"""
+    temp_playlist = {
+        'playlistTitle': playlist['snippet']['title'],
+        'playlistId': playlist['id'],
+    }
+
+    try:
+        playlist_videos = fetch_all_pages(
+            youtube.playlistItems(),
+            http=thread_http(credential),
+            user_id=user_id,
+            resource=PLAYLIST_ITEMS,
+            part='snippet',
+            playlistId=playlist['id'],
+            maxResults=50
+        )
+    except Exception as e:
+        temp_playlist['videos'] = []
+        temp_playlist['Error'] = str(e)
+        return temp_playlist
+
+    temp_playlist['videos'] = [
+        {
+            'videoId': videoItem['snippet']['resourceId']['videoId'],
+            'videoTitle': videoItem['snippet']['title'],
+            'videoThumbnail': videoItem['snippet']['thumbnails'].get('default', {}).get('url', 'No Thumbnail Available'),
+            'videoDescription': videoItem['snippet']['description'],
+        } for videoItem in playlist_videos
+        if videoItem['snippet']['title'] != 'Deleted video'
+    ]
+    return temp_playlist
+
+
+def load_library(youtube, credential, playlists, user_id=None):
+    """
+    Returns the playlists with their videos, in playlist order. The
+    playlists' items are loaded concurrently by at most
+    YOUTUBE_LIBRARY_WORKERS threads.
+    """
+    if credential is None:
+        # The youtube object's own connection can't be shared between threads
+        workers = 1
+    else:
+        workers = settings.YOUTUBE_LIBRARY_WORKERS
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='youtube-library') as executor:
+        return list(executor.map(
+            lambda playlist: load_playlist(youtube, credential if workers > 1 else None, playlist, user_id),
+            playlists))
+
 @authentication_classes([APIKeyAuthentication])
 class YouTubeVideoAPIView(APIView):
     """